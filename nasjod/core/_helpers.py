@@ -15,3 +15,32 @@ def get_next_friday():
     today = date.today()
     friday_date = today + timedelta((4 - today.weekday()) % 7)
     return friday_date
+
+def static_data_path(filename):
+    """Returns the path of a file in static/data, preferring the collected STATIC_ROOT copy."""
+    from django.conf import settings
+    file_path = os.path.join(settings.STATIC_ROOT, 'data', filename)
+    if not os.path.exists(file_path):
+        # Fallback to static files directory
+        file_path = os.path.join(settings.BASE_DIR, 'static', 'data', filename)
+    return file_path
+
+def open_storage_stream(name):
+    """
+    Opens `name` in default_storage for reading as a binary stream.
+    On S3 this is a single GET whose body is read as it arrives, instead of the
+    HEAD request and full download into a temporary file done by storage.open().
+    Raises FileNotFoundError when the object does not exist.
+    """
+    from django.core.files.storage import default_storage
+    bucket = getattr(default_storage, 'bucket', None)
+    if bucket is None:
+        return default_storage.open(name, 'rb')
+
+    from botocore.exceptions import ClientError
+    try:
+        return bucket.Object(default_storage._normalize_name(name)).get()['Body']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            raise FileNotFoundError(f"File '{name}' does not exist in block storage.") from e
+        raise
@@ -0,0 +1,119 @@
+"""
+On-disk cache for upstream HTTP responses.
+
+Entries are stored under sha256(url), fanned out over 256 sub-directories.
+An entry is fresh for `ttl` seconds after it was written. When the cache grows
+past `max_bytes`, the least recently read entries are evicted first.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a response is not in the cache."""
+
+
+class HttpCache:
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @classmethod
+    def from_settings(cls):
+        from django.conf import settings
+        return cls(settings.HTTP_CACHE_DIR, settings.HTTP_CACHE_TTL, settings.HTTP_CACHE_MAX_BYTES)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def path(self, url):
+        key = self.key(url)
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, url, allow_stale=False):
+        """Returns the cached body for `url`, or None when missing or expired."""
+        path = self.path(url)
+        try:
+            stat = os.stat(path)
+            if not allow_stale and time.time() - stat.st_mtime > self.ttl:
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # Record the read in atime (kept explicitly, mounts are often noatime) for LRU eviction
+        os.utime(path, (time.time(), stat.st_mtime))
+        self.hits += 1
+        return content
+
+    def set(self, url, content):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            previous = os.path.getsize(path)
+        except FileNotFoundError:
+            previous = 0
+
+        # Write then rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            # The first scan already counts the entry just written
+            self.size()
+        else:
+            self._size += len(content) - previous
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def evict(self, target=None):
+        """Deletes least recently read entries until the cache is under `target` (90% of max_bytes)."""
+        target = self.max_bytes * 0.9 if target is None else target
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
@@ -0,0 +1,83 @@
+"""
+Incremental reading of large JSON arrays with the standard library decoder.
+"""
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+def iter_array(fileobj, key=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields the items of a JSON array one by one while reading `fileobj` in chunks,
+    so only the current item is held in memory.
+
+    Without `key` the document itself must be the array. With `key` the array is the
+    value of that key; the key is located by its first occurrence, which suits
+    documents like {"prayer_times": [...]} but not keys repeated in nested objects.
+    `fileobj` may return bytes (decoded as UTF-8) or str.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    state = {'buffer': '', 'eof': False}
+
+    def fill():
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            state['eof'] = True
+            state['buffer'] += decoder.decode(b'', final=True)
+            return
+        state['buffer'] += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+    # Locate the opening bracket of the array
+    while True:
+        buffer = state['buffer']
+        if key is None:
+            start = len(buffer) - len(buffer.lstrip(WHITESPACE))
+            if start < len(buffer):
+                if buffer[start] != '[':
+                    raise ValueError("JSON document is not an array")
+                pos = start + 1
+                break
+        else:
+            key_at = buffer.find(json.dumps(key))
+            bracket = buffer.find('[', key_at) if key_at != -1 else -1
+            if bracket != -1:
+                pos = bracket + 1
+                break
+        if state['eof']:
+            raise ValueError(f"No JSON array found for key {key!r}" if key else "Empty JSON document")
+        fill()
+
+    while True:
+        buffer = state['buffer']
+        while pos < len(buffer) and buffer[pos] in WHITESPACE + ',':
+            pos += 1
+        if pos >= len(buffer):
+            if state['eof']:
+                raise ValueError("Unterminated JSON array")
+            fill()
+            continue
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if state['eof']:
+                raise
+            fill()
+            continue
+        # A scalar ending exactly at the buffer end may continue in the next chunk
+        if end == len(buffer) and not state['eof']:
+            fill()
+            continue
+
+        yield item
+        pos = end
+        # Drop what has been consumed so the buffer stays around one chunk
+        if pos > chunk_size:
+            state['buffer'] = state['buffer'][pos:]
+            pos = 0
@@ -3,10 +3,11 @@ import csv
 from django import forms
 from django.contrib.gis import admin
 from django.http import HttpResponse
+from django.utils import timezone
 
 from prayertime.models import EidPrayerTime, PrayerTime
 
-from .models import Address
+from .models import Address, Checkpoint, Job
 from masjid.models import Masjid
 
 class AddressAdminForm(forms.ModelForm):
@@ -42,7 +43,7 @@ class AddressAdmin(admin.GISModelAdmin):
             linked_masjid.save()
         else:
             # Unlink the address from any masjid if None is selected
-            Masjid.objects.filter(address=obj).update(address=None)
+            Masjid.objects.filter(address=obj).update(address=None, updated_at=timezone.now())
 
     def linked_masjid(self, obj):
         # Returns the linked Masjid's name if it exists
@@ -59,6 +60,27 @@ class AddressAdmin(admin.GISModelAdmin):
 admin.site.register(Address, AddressAdmin)
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'updated_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key')
+    readonly_fields = ('locked_at', 'locked_by', 'created_at', 'updated_at')
+    actions = ['retry_jobs']
+
+    @admin.action(description="Retry selected failed jobs")
+    def retry_jobs(self, request, queryset):
+        now = timezone.now()
+        queryset.filter(status=Job.FAILED).update(status=Job.QUEUED, attempts=0, run_at=now, updated_at=now)
+
+
+@admin.register(Checkpoint)
+class CheckpointAdmin(admin.ModelAdmin):
+    list_display = ('command', 'key', 'position', 'completed_at', 'updated_at')
+    list_filter = ('command',)
+    search_fields = ('command', 'key')
+
+
 @admin.action(description="Activate selected users")
 def activate_users(modeladmin, request, queryset):
     queryset.update(is_active=True)
@@ -0,0 +1,480 @@
+"""
+Streaming backups of the database to the R2 backup bucket.
+
+A backup is read in one REPEATABLE READ READ ONLY transaction, so all the models come
+from the same snapshot, each through a server-side cursor. Rows are written as they
+are read, and peak memory stays at about one chunk plus one upload part, whatever
+the size of the database.
+
+Layout of a backup named <name> in the bucket:
+
+    <name>/data.ndjson.gz   one gzip member per chunk of up to CHUNK_ROWS rows of a
+                            model, concatenated; the file as a whole is valid gzip
+    <name>/manifest.json    written last, so a backup without one is incomplete
+
+data.ndjson.gz is sent as a multipart upload of PART_SIZE parts while it is written.
+The manifest lists the models in dependency order with their row counts and, for
+each chunk, its byte range in data.ndjson.gz, its row count, its first and last pk
+and the sha256 of its compressed bytes. A chunk can therefore be fetched, checked
+and decoded on its own.
+
+Each NDJSON line is a row in the format of Django's python serializer:
+{"model": "core.address", "pk": 2, "fields": {...}}. Many-to-many links are not
+part of the rows: the auto-created through models are backed up as models of their own.
+
+Incremental backups hold only the rows written since the snapshot of their parent
+backup, minus OVERLAP for the transactions still open at that snapshot, as found by
+core/changes.py. Each model entry of their manifest also lists the pks `deleted`
+since then (tombstones). A chain is a full backup followed by incrementals, each the
+parent of the next, indexed in chains/<full backup>.json:
+
+    {"base": "nasjod_20260101_020000", "backups": [{"name": ..., "kind": ..., "snapshot": ...}, ...]}
+
+Restoring a backup replays its chain from the full backup up to it. Retention keeps
+the newest chains and deletes the others whole.
+"""
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+import boto3
+from botocore.exceptions import ClientError
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import changes
+
+FORMAT_VERSION = 1
+DATA_FILE = 'data.ndjson.gz'
+MANIFEST_FILE = 'manifest.json'
+CHUNK_ROWS = 5000
+FETCH_SIZE = 2000
+PART_SIZE = 8 * 1024 * 1024  # R2 wants equal parts but the last one, of at least 5 MiB
+CHAINS_PREFIX = 'chains'
+LOCK_NAME = 'backup_db'  # Held by backups and restores alike
+# Not backed up nor tracked: the change log, job queue and command checkpoints of this
+# database, and the read models rebuilt from the backed up rows
+EXCLUDED_MODELS = {
+    'core.RowChange', 'core.Job', 'core.Checkpoint', 'prayertime.DailySchedule', 'prayertime.OfflinePack',
+}
+OVERLAP = timedelta(hours=1)  # Longer than any transaction, so none is missed between two snapshots
+R2_VARIABLES = ('R2_BACKUP_BUCKET_NAME', 'R2_ENDPOINT_URL', 'R2_ACCESS_KEY_ID', 'R2_SECRET_ACCESS_KEY')
+
+
+class S3Store:
+    """Backup objects in an S3 compatible bucket (R2)."""
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def writer(self, key, part_size=PART_SIZE):
+        return MultipartUpload(self.client, self.bucket, key, part_size)
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def read(self, key, start=None, length=None):
+        options = {}
+        if start is not None:
+            options['Range'] = f'bytes={start}-{start + length - 1}'
+        return self.client.get_object(Bucket=self.bucket, Key=key, **options)['Body'].read()
+
+    def exists(self, key):
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return any(item['Key'] == key for item in response.get('Contents', []))
+
+    def list(self, prefix=''):
+        """Yields the (key, size, last modified) of the objects under `prefix`."""
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['Size'], item['LastModified']
+
+    def abort(self, key, upload_id):
+        """Discards the multipart upload `upload_id` of `key`, left by an interrupted backup."""
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    def delete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket, Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]]}
+            )
+
+
+def r2_store():
+    """The S3Store of the backup bucket configured by the R2_* environment variables."""
+    missing = [name for name in R2_VARIABLES if not os.getenv(name)]
+    if missing:
+        raise ImproperlyConfigured(f'Missing required environment variables: {", ".join(missing)}')
+    client = boto3.client(
+        's3',
+        endpoint_url=os.getenv('R2_ENDPOINT_URL'),
+        aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
+        region_name='auto',  # R2 uses 'auto' as region
+    )
+    return S3Store(client, os.getenv('R2_BACKUP_BUCKET_NAME'))
+
+
+def backup_store(directory=None):
+    """The LocalStore of `directory` when given, else the R2 bucket."""
+    return LocalStore(directory) if directory else r2_store()
+
+
+class MultipartUpload:
+    """File-like writer uploading what it is given as the parts of a multipart upload."""
+
+    def __init__(self, client, bucket, key, part_size=PART_SIZE):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def _upload(self, data):
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=bytes(data)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload(self.buffer)
+            self.buffer = bytearray()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class LocalStore:
+    """Backup objects in a local directory, for drills and tests."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def writer(self, key, part_size=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _LocalWriter(path)
+
+    def put(self, key, data):
+        with self.writer(key) as file:
+            file.write(data)
+
+    def read(self, key, start=None, length=None):
+        with open(self._path(key), 'rb') as file:
+            if start is None:
+                return file.read()
+            file.seek(start)
+            return file.read(length)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def list(self, prefix=''):
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    yield key, stat.st_size, datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc)
+
+    def abort(self, key, upload_id=None):
+        """Discards the partial file of `key` left by an interrupted backup."""
+        if os.path.exists(f'{self._path(key)}.part'):
+            os.remove(f'{self._path(key)}.part')
+
+    def delete(self, keys):
+        for key in keys:
+            if self.exists(key):
+                os.remove(self._path(key))
+
+
+class _LocalWriter:
+    upload_id = None
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(f'{path}.part', 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(f'{self.path}.part', self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(f'{self.path}.part')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.abort() if exc_type else self.close()
+
+
+def dependency_order(models):
+    """
+    `models` sorted so that every model comes after the models its foreign keys point
+    to, self references aside. Models on a cycle keep their relative order.
+    """
+    models = list(models)
+    remaining = {model: {
+        field.related_model for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model in models and field.related_model is not model
+    } for model in models}
+    ordered = []
+    while remaining:
+        ready = [model for model in models if model in remaining and not remaining[model] - set(ordered)]
+        if not ready:
+            # A cycle: deferred foreign keys let any order work inside one transaction
+            ready = [next(model for model in models if model in remaining)]
+        for model in ready:
+            ordered.append(model)
+            del remaining[model]
+    return ordered
+
+
+def _table_models():
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy
+    ]
+
+
+def backup_models():
+    """
+    The models holding rows, many-to-many through tables included, in dependency order.
+    The EXCLUDED_MODELS are not data.
+    """
+    return dependency_order(model for model in _table_models() if model._meta.label not in EXCLUDED_MODELS)
+
+
+def excluded_models():
+    """The EXCLUDED_MODELS installed."""
+    return [model for model in _table_models() if model._meta.label in EXCLUDED_MODELS]
+
+
+def field_names(model):
+    return [field.name for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def encode_chunk(model, objects):
+    """Serializes `objects` as NDJSON compressed into one gzip member. Returns (bytes, sha256)."""
+    rows = Serializer().serialize(objects, fields=field_names(model))
+    lines = ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows)
+    data = gzip.compress(lines.encode('utf-8'), compresslevel=6, mtime=0)
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def decode_chunk(data, sha256=None):
+    """The rows of a chunk. Raises ValueError when its bytes do not match `sha256`."""
+    if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256:
+        raise ValueError("Chunk checksum mismatch")
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+
+def _batches(iterator, size):
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _snapshot(isolate):
+    """
+    Starts the snapshot of the current transaction, REPEATABLE READ when `isolate` (the
+    transaction was just opened). Returns its time.
+    """
+    with connection.cursor() as cursor:
+        if isolate:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cursor.execute("SELECT now()")
+        return cursor.fetchone()[0]
+
+
+def changed_since(parent):
+    """The time from which an incremental backup on top of the manifest `parent` reads changes."""
+    return parse_datetime(parent['snapshot']) - OVERLAP
+
+
+def backup_queryset(model, since=None):
+    """The rows of `model` to back up: all of them, or those written since `since`."""
+    queryset = model._base_manager.all() if since is None else changes.changed(model, since)
+    return queryset.order_by('pk')
+
+
+def data_key(name):
+    return f'{name}/{DATA_FILE}'
+
+
+def write_backup(store, name, models=None, parent=None, chunk_rows=CHUNK_ROWS, progress=None, started=None):
+    """
+    Streams a backup of the database, or of `models`, to `store` under `name`/: a full
+    one, or an incremental one on top of the manifest `parent`. `progress(rows)` is
+    called after each chunk, `started(upload id)` once the data upload is opened, before
+    anything is read. Adds the backup to its chain and returns its manifest.
+    """
+    models = backup_models() if models is None else dependency_order(models)
+    since = changed_since(parent) if parent is not None else None
+    upload = store.writer(data_key(name))
+    offset = 0
+    manifest = {
+        'format': FORMAT_VERSION, 'name': name, 'kind': 'full' if parent is None else 'incremental',
+        'base': name if parent is None else parent['base'], 'parent': parent and parent['name'],
+        'since': since, 'data': DATA_FILE, 'models': [],
+    }
+    isolate = not connection.in_atomic_block
+    try:
+        if started is not None:
+            started(upload.upload_id)
+        with transaction.atomic():
+            manifest['snapshot'] = _snapshot(isolate).isoformat()
+            # Only a backup taken with the triggers in place can be the parent of an incremental
+            manifest['tracked'] = changes.is_installed()
+            for model in models:
+                entry = {'model': model._meta.label_lower, 'rows': 0, 'chunks': []}
+                if since is not None:
+                    entry['deleted'] = changes.deleted(model, since)
+                rows = backup_queryset(model, since).iterator(chunk_size=FETCH_SIZE)
+                for objects in _batches(rows, chunk_rows):
+                    data, sha256 = encode_chunk(model, objects)
+                    upload.write(data)
+                    entry['chunks'].append({
+                        'offset': offset, 'length': len(data), 'rows': len(objects), 'sha256': sha256,
+                        'first_pk': objects[0].pk, 'last_pk': objects[-1].pk,
+                    })
+                    offset += len(data)
+                    entry['rows'] += len(objects)
+                    if progress is not None:
+                        progress(len(objects))
+                manifest['models'].append(entry)
+        upload.close()
+    except BaseException:
+        upload.abort()
+        raise
+    manifest['size'] = offset
+    manifest['rows'] = sum(entry['rows'] for entry in manifest['models'])
+    manifest['created_at'] = timezone.now().isoformat()
+    store.put(f'{name}/{MANIFEST_FILE}', json.dumps(manifest, indent=2, cls=DjangoJSONEncoder).encode('utf-8'))
+
+    chain = read_chain(store, manifest['base']) if parent is not None else {'base': name, 'backups': []}
+    chain['backups'].append({'name': name, 'kind': manifest['kind'], 'snapshot': manifest['snapshot']})
+    store.put(_chain_key(manifest['base']), json.dumps(chain, indent=2).encode('utf-8'))
+    return json.loads(json.dumps(manifest, cls=DjangoJSONEncoder))
+
+
+def read_manifest(store, name):
+    return json.loads(store.read(f'{name}/{MANIFEST_FILE}'))
+
+
+def iter_chunks(store, manifest, models=None, wanted=None):
+    """
+    Yields (model label, chunk, rows) for the chunks of `manifest`, in order, fetching
+    each one by its byte range and checking its checksum. `models` limits the labels
+    read, `wanted(label, chunk)` the chunks.
+    """
+    key = f"{manifest['name']}/{manifest['data']}"
+    for entry in manifest['models']:
+        if models is not None and entry['model'] not in models:
+            continue
+        for chunk in entry['chunks']:
+            if wanted is not None and not wanted(entry['model'], chunk):
+                continue
+            data = store.read(key, chunk['offset'], chunk['length'])
+            yield entry['model'], chunk, decode_chunk(data, chunk['sha256'])
+
+
+def list_backups(store):
+    """The (name, last modified) of the complete backups in `store`, oldest first."""
+    backups = [
+        (key[:-len(MANIFEST_FILE) - 1], modified)
+        for key, _, modified in store.list() if key.endswith(f'/{MANIFEST_FILE}')
+    ]
+    return sorted(backups, key=lambda backup: backup[1])
+
+
+def _chain_key(base):
+    return f'{CHAINS_PREFIX}/{base}.json'
+
+
+def read_chain(store, base):
+    return json.loads(store.read(_chain_key(base)))
+
+
+def list_chains(store):
+    """The chains of `store`, oldest first."""
+    chains = [
+        json.loads(store.read(key)) for key, _, _ in store.list(f'{CHAINS_PREFIX}/') if key.endswith('.json')
+    ]
+    return sorted(chains, key=lambda chain: (chain['backups'][0]['snapshot'], chain['base']))
+
+
+def incremental_parent(store, max_length=None):
+    """
+    The manifest of the latest backup, when an incremental backup can be taken on top of
+    it: its chain holds fewer than `max_length` backups and it was taken with change
+    tracking. None when a full backup is due.
+    """
+    chains = list_chains(store)
+    if not chains or (max_length is not None and len(chains[-1]['backups']) >= max_length):
+        return None
+    parent = read_manifest(store, chains[-1]['backups'][-1]['name'])
+    return parent if parent.get('tracked') else None
+
+
+def chain_manifests(store, name):
+    """The manifests to replay to restore the backup `name`: its full backup, then its incrementals up to it."""
+    manifest = read_manifest(store, name)
+    if manifest.get('kind', 'full') == 'full':
+        return [manifest]
+    names = [backup['name'] for backup in read_chain(store, manifest['base'])['backups']]
+    return [read_manifest(store, backup) for backup in names[:names.index(name)]] + [manifest]
+
+
+def prune_chains(store, keep):
+    """
+    Deletes the backups of all chains but the `keep` (at least 1) newest ones, then the
+    change log entries no future incremental backup needs. Returns the names of the
+    deleted backups.
+    """
+    chains = list_chains(store)
+    deleted = []
+    for chain in chains[:-keep]:
+        for backup in chain['backups']:
+            store.delete(key for key, _, _ in list(store.list(f"{backup['name']}/")))
+            deleted.append(backup['name'])
+        store.delete([_chain_key(chain['base'])])
+    if chains:
+        changes.prune(parse_datetime(chains[-1]['backups'][-1]['snapshot']) - OVERLAP)
+    return deleted
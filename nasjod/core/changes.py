@@ -0,0 +1,126 @@
+"""
+Change tracking for the incremental backups (see core/backups.py).
+
+Every backed up table gets an AFTER INSERT OR UPDATE OR DELETE trigger that records
+the pk of each row written in core_rowchange. install() (re)creates the triggers after
+every migrate, so new tables are tracked as soon as they exist.
+
+Triggers catch every write, queryset.update(), bulk_update(), raw SQL and the
+on_delete=SET_NULL updates Django runs without touching auto_now fields (deleting an
+Address a Masjid points to) included. Rows of a model with an auto_now `updated_at`
+are also found by that timestamp, which covers the writes made before its table had
+the full trigger.
+"""
+from contextlib import contextmanager
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Cast
+
+from .models import RowChange
+
+TRIGGER_NAME = 'core_track_changes'
+
+TRACK_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION core_track_row_change() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    -- TG_ARGV: table name (TG_TABLE_NAME is the partition on partitioned tables), pk column
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO {RowChange._meta.db_table} (table_name, row_id, op, changed_at)
+        VALUES (TG_ARGV[0], to_jsonb(OLD) ->> TG_ARGV[1], 'D', now());
+        RETURN OLD;
+    END IF;
+    INSERT INTO {RowChange._meta.db_table} (table_name, row_id, op, changed_at)
+    VALUES (TG_ARGV[0], to_jsonb(NEW) ->> TG_ARGV[1], left(TG_OP, 1), now());
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+def has_updated_at(model):
+    """Whether `model` keeps an auto_now updated_at the incremental backups can rely on."""
+    try:
+        field = model._meta.get_field('updated_at')
+    except FieldDoesNotExist:
+        return False
+    return field.concrete and getattr(field, 'auto_now', False)
+
+
+def install(models):
+    """(Re)creates the change tracking triggers of `models`."""
+    with connection.cursor() as cursor:
+        cursor.execute(TRACK_FUNCTION)
+        for model in models:
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {table}')
+            cursor.execute(
+                f'CREATE TRIGGER {TRIGGER_NAME} AFTER INSERT OR UPDATE OR DELETE ON {table} '
+                f'FOR EACH ROW EXECUTE FUNCTION core_track_row_change(%s, %s)',
+                [model._meta.db_table, model._meta.pk.column],
+            )
+
+
+def uninstall(models):
+    """Drops the change tracking triggers of `models`, if any."""
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {connection.ops.quote_name(model._meta.db_table)}')
+
+
+@contextmanager
+def untracked():
+    """Turns the change tracking triggers off for the writes of this connection, as a restore needs."""
+    with connection.cursor() as cursor:
+        cursor.execute("SET core.track_changes = 'off'")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("RESET core.track_changes")
+
+
+def is_installed():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'core_track_row_change')")
+        return cursor.fetchone()[0]
+
+
+def _pk_field(model):
+    pk = model._meta.pk
+    return pk.target_field if pk.is_relation else pk
+
+
+def changed(model, since):
+    """The rows of `model` written since `since`."""
+    changed_ids = RowChange.objects.filter(
+        table_name=model._meta.db_table, changed_at__gte=since,
+    ).exclude(op=RowChange.DELETE).annotate(
+        pk_value=Cast('row_id', _pk_field(model).__class__()),
+    ).values('pk_value')
+    written = Q(pk__in=changed_ids)
+    if has_updated_at(model):
+        written |= Q(updated_at__gte=since)
+    return model._base_manager.filter(written)
+
+
+def deleted(model, since):
+    """The pks of the rows of `model` deleted since `since` and not written again."""
+    pk_field = _pk_field(model)
+    row_ids = RowChange.objects.filter(
+        table_name=model._meta.db_table, changed_at__gte=since, op=RowChange.DELETE,
+    ).values_list('row_id', flat=True).distinct()
+    pks = {pk_field.to_python(row_id) for row_id in row_ids}
+    if pks:
+        pks -= set(model._base_manager.filter(pk__in=pks).values_list('pk', flat=True))
+    return sorted(pks)
+
+
+def prune(before):
+    """Forgets the changes recorded before `before`. Returns how many."""
+    count, _ = RowChange.objects.filter(changed_at__lt=before).delete()
+    return count
@@ -0,0 +1,158 @@
+"""
+Shared machinery of the long management commands (imports, ingestion, backups):
+
+- one run at a time: a Postgres advisory lock named after the command is held for the
+  whole run, so overlapping cron runs fail fast instead of racing;
+- durable checkpoints: a Checkpoint row per (command, input) records how far the run
+  got; a rerun on the same input resumes there, --restart starts over;
+- progress: done/total with throughput and an ETA, at most every few seconds.
+
+A command subclasses CheckpointedCommand and implements run() instead of handle():
+
+    def run(self, *args, **options):
+        checkpoint = self.checkpoint(file_key(options['csv_file']))
+        rows = rows[checkpoint.position.get('rows', 0):]
+        progress = self.progress(total, done=checkpoint.position.get('rows', 0))
+        for batch in batches:
+            with transaction.atomic():
+                ...
+                checkpoint.advance(rows=...)
+            progress.advance(len(batch))
+        checkpoint.complete()
+
+The checkpoint is advanced in the transaction writing the batch it covers, so both are
+committed or lost together.
+"""
+import hashlib
+import os
+from contextlib import contextmanager
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from .models import Checkpoint
+
+PROGRESS_INTERVAL = 5.0  # seconds
+
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Tries to take the session advisory lock `name`; yields whether it was taken. The lock
+    is released on exit, or by Postgres when the process dies.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [name])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [name])
+
+
+def file_key(path, chunk_size=1024 * 1024):
+    """Checkpoint key of a file: its name and the sha256 of its content, so an edited file starts over."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return f'{os.path.basename(path)}:{digest.hexdigest()}'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    return f'{seconds // 60}m{seconds % 60:02d}s'
+
+
+class Progress:
+    """
+    Reports `done`/`total` with the throughput of this run and the time left, through
+    `write`, at most every `interval` seconds and once finished. `done` starts at the
+    work already done by a previous run, which does not count towards the throughput.
+    """
+
+    def __init__(self, total, write, label='', unit='rows', done=0, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.write = write
+        self.label = label
+        self.unit = unit
+        self.done = self.initial = done
+        self.interval = interval
+        self.started = self.reported = monotonic()
+
+    @property
+    def rate(self):
+        elapsed = monotonic() - self.started
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        rate = self.rate
+        text = f'{self.label}{self.done}/{self.total} {self.unit}'
+        if self.total:
+            text += f' ({self.done / self.total:.0%})'
+        text += f', {rate:.1f} {self.unit}/s'
+        if rate > 0 and self.done < self.total:
+            text += f', ETA {format_duration((self.total - self.done) / rate)}'
+        return text
+
+    def advance(self, count=1):
+        self.done += count
+        now = monotonic()
+        if now - self.reported >= self.interval or self.done >= self.total:
+            self.reported = now
+            self.write(self.line())
+
+
+class CheckpointedCommand(BaseCommand):
+    """A command run under its advisory lock, with checkpoints and progress reports. Implement run()."""
+
+    # Commands sharing a lock_name never run concurrently; defaults to the command name
+    lock_name = None
+    # False for commands that start over after an interruption, only cleaning up after it
+    resumable = True
+
+    @property
+    def command_name(self):
+        return self.__module__.rsplit('.', 1)[-1]
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint of an interrupted run on the same input and start over.'
+        )
+        return parser
+
+    def handle(self, *args, **options):
+        self.options = options
+        lock_name = self.lock_name or self.command_name
+        with advisory_lock(lock_name) as acquired:
+            if not acquired:
+                raise CommandError(f'{lock_name} is already running')
+            return self.run(*args, **options)
+
+    def run(self, *args, **options):
+        raise NotImplementedError('subclasses of CheckpointedCommand must provide a run() method')
+
+    def checkpoint(self, key):
+        """
+        The Checkpoint of this command for the input `key`. The position of an interrupted
+        run is kept unless --restart is given; a completed run starts over.
+        """
+        checkpoint, _ = Checkpoint.objects.get_or_create(command=self.command_name, key=key[:255])
+        if self.options.get('restart') or checkpoint.completed_at is not None:
+            checkpoint.position, checkpoint.completed_at = {}, None
+            checkpoint.save(update_fields=['position', 'completed_at', 'updated_at'])
+        elif checkpoint.position:
+            action = 'Resuming' if self.resumable else 'Cleaning up after'
+            self.stdout.write(self.style.NOTICE(f'{action} an interrupted run from {checkpoint.position}'))
+        return checkpoint
+
+    def progress(self, total, **kwargs):
+        return Progress(total, self.stdout.write, **kwargs)
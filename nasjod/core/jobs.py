@@ -0,0 +1,226 @@
+"""
+Background jobs stored in Postgres, without an external broker.
+
+Tasks are plain functions registered with @task and enqueued with `func.delay(**kwargs)`
+or enqueue(); their arguments must be JSON serializable. A job is written in the
+caller's transaction, so workers only see it once that transaction commits.
+
+Workers (`manage.py run_worker`) claim jobs with SELECT ... FOR UPDATE SKIP LOCKED,
+highest priority first. A failing job is retried with exponential backoff until
+`max_attempts`, then marked failed with its traceback. Queued jobs sharing a
+dedup_key are collapsed into a single job. While a worker runs, a heartbeat thread
+refreshes the lock of the jobs it holds, so only the jobs of a dead worker go stale.
+
+Tasks registered with `every` also run on their own: workers queue the next run of
+each of them at the start of its next period (see schedule_periodic).
+"""
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30  # seconds, doubled after each failed attempt
+STALE_AFTER = timedelta(minutes=30)
+HEARTBEAT_INTERVAL = 60  # seconds, well under STALE_AFTER
+KEEP_FINISHED = timedelta(days=7)
+EPOCH = datetime.fromtimestamp(0, dt_timezone.utc)
+
+registry = {}
+periodic = {}
+
+
+class UnknownTaskError(Exception):
+    """Raised when a job names a task that is not registered in this process."""
+
+
+def task(name=None, priority=0, max_attempts=MAX_ATTEMPTS, dedup_key=None, every=None):
+    """
+    Registers a function as a task and adds `func.delay(**kwargs)` to enqueue it.
+    `dedup_key` is a format string filled with the kwargs, e.g. "relink:{masjid_id}".
+    A task taking no arguments can run `every` period (a timedelta) on its own.
+    """
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        registry[task_name] = func
+        if every is not None:
+            periodic[task_name] = (every, priority, max_attempts)
+
+        def delay(**kwargs):
+            return enqueue(
+                task_name,
+                kwargs,
+                priority=priority,
+                max_attempts=max_attempts,
+                dedup_key=dedup_key.format(**kwargs) if dedup_key else None,
+            )
+
+        func.task_name = task_name
+        func.delay = delay
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, priority=0, max_attempts=MAX_ATTEMPTS, dedup_key=None, run_at=None):
+    """
+    Adds a job and returns it. When a queued job with the same dedup_key already
+    exists, no job is added and the queued one is returned instead.
+    """
+    job = Job(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        max_attempts=max_attempts,
+        dedup_key=dedup_key,
+        run_at=run_at or timezone.now(),
+    )
+    if dedup_key is None:
+        job.save()
+        return job
+
+    # ON CONFLICT DO NOTHING against the partial unique index on queued dedup keys
+    Job.objects.bulk_create([job], ignore_conflicts=True)
+    return Job.objects.filter(dedup_key=dedup_key, status=Job.QUEUED).first()
+
+
+def schedule_periodic(now=None):
+    """
+    Queues the next run of every periodic task at the start of its next period, counted
+    from the Unix epoch (a daily task runs at midnight UTC). A run already queued is kept,
+    so workers call this at each maintenance; a run missed while no worker was up is
+    done as soon as one starts.
+    """
+    now = now or timezone.now()
+    for name, (every, priority, max_attempts) in periodic.items():
+        run_at = now - (now - EPOCH) % every + every
+        enqueue(name, priority=priority, max_attempts=max_attempts, dedup_key=f"periodic:{name}", run_at=run_at)
+
+
+def claim(worker, limit=1):
+    """Marks up to `limit` due jobs as running for `worker` and returns them."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'id')[:limit]
+        )
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.RUNNING, locked_at=now, locked_by=worker, attempts=F('attempts') + 1, updated_at=now,
+            )
+    for job in jobs:
+        job.status = Job.RUNNING
+        job.locked_at = now
+        job.locked_by = worker
+        job.attempts += 1
+    return jobs
+
+
+def release(claimed):
+    """Returns claimed jobs that were not started to the queue, without counting an attempt."""
+    for job in claimed:
+        _requeue(job, job.last_error, timedelta(0), attempts=F('attempts') - 1)
+
+
+def _requeue(job, error, delay, **changes):
+    """Puts a job back in the queue, or fails it when a newer queued job with its dedup_key took its place."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, run_at=now + delay, locked_at=None, locked_by=None,
+                last_error=error, updated_at=now, **changes,
+            )
+    except IntegrityError:
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, last_error=f"{error}\nSuperseded by a queued job with the same dedup key.",
+            updated_at=now,
+        )
+
+
+def execute(job):
+    """
+    Runs a claimed job in a transaction, so a failed attempt leaves no partial writes.
+    Returns True when the job succeeded.
+    """
+    func = registry.get(job.name)
+    try:
+        if func is None:
+            raise UnknownTaskError(f"Unknown task '{job.name}'")
+        with transaction.atomic():
+            func(**job.payload)
+    except Exception as e:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts and not isinstance(e, UnknownTaskError):
+            delay = timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+            logger.warning("Job %s failed (attempt %s/%s), retrying in %s: %s", job, job.attempts, job.max_attempts, delay, e)
+            _requeue(job, error, delay)
+        else:
+            logger.error("Job %s failed: %s", job, e)
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, updated_at=timezone.now())
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, last_error='', updated_at=timezone.now())
+    return True
+
+
+def heartbeat(worker):
+    """Refreshes the lock of the jobs `worker` holds, running or claimed. Returns how many."""
+    return Job.objects.filter(status=Job.RUNNING, locked_by=worker).update(locked_at=timezone.now())
+
+
+@contextmanager
+def heartbeating(worker, interval=HEARTBEAT_INTERVAL):
+    """Calls heartbeat(worker) every `interval` seconds from a thread, on its own connection, meanwhile."""
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    heartbeat(worker)
+                except Exception as e:
+                    logger.warning("Heartbeat of worker %s failed: %s", worker, e)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{worker}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def recover_stale(older_than=STALE_AFTER):
+    """
+    Requeues jobs left running by a worker that died: their lock was not refreshed by a
+    heartbeat for `older_than`. Returns how many were recovered.
+    """
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - older_than)
+    count = 0
+    for job in stale:
+        error = f"Worker {job.locked_by} stopped while running the job."
+        if job.attempts < job.max_attempts:
+            _requeue(job, error, timedelta(0))
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, updated_at=timezone.now())
+        count += 1
+    return count
+
+
+def prune(older_than=KEEP_FINISHED):
+    """Deletes jobs that finished successfully more than `older_than` ago."""
+    deleted, _ = Job.objects.filter(status=Job.DONE, updated_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -1,15 +1,19 @@
 import csv
 import re
+from collections import namedtuple
 from datetime import time, datetime
-from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import Point
-from django.db import transaction
-from django.core.exceptions import ValidationError
+from time import monotonic
 
-from masjid.models import Masjid
-from prayertime.models import JumuahPrayerTime
+from django.core.management.base import BaseCommand, CommandError
+
+from masjid.matching import match_points
+from prayertime.jumuah import add_times
 from core._helpers import get_next_friday
 
+DEFAULT_RADIUS = 100
+
+CsvPoint = namedtuple('CsvPoint', 'row_num name lon lat times')
+
 
 class Command(BaseCommand):
     help = 'Add jumuah prayer times from CSV file by matching masjids using latitude and longitude'
@@ -17,20 +21,24 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='The path to the CSV file containing jumuah times')
         parser.add_argument('--dry-run', action='store_true', help='Run without actually creating objects')
-        parser.add_argument('--tolerance', type=float, default=0.001, 
-                          help='Coordinate matching tolerance in degrees (default: 0.001, ~100 meters)')
+        parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS,
+                          help=f'Matching distance in meters (default: {DEFAULT_RADIUS})')
+        parser.add_argument('--skip-ambiguous', action='store_true',
+                          help='Leave out the points having several masjids within the radius '
+                               'instead of using the nearest one')
         parser.add_argument('--date', type=str, default=None,
                           help='Date for jumuah time in YYYY-MM-DD format (default: next Friday)')
+        parser.add_argument('--report', type=str,
+                          help='Write the unmatched, ambiguous and invalid rows to this CSV file')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
         dry_run = options['dry_run']
-        tolerance = options['tolerance']
         date_str = options.get('date')
-        
+
         if dry_run:
             self.stdout.write(self.style.WARNING('Running in DRY RUN mode - no objects will be created'))
-        
+
         # Determine the date for jumuah times
         if date_str:
             try:
@@ -44,159 +52,110 @@ class Command(BaseCommand):
                 return
         else:
             jumuah_date = get_next_friday()
-        
+
         self.stdout.write(f'Using date: {jumuah_date} ({"Friday" if jumuah_date.weekday() == 4 else "NOT Friday"})')
 
         try:
             with open(csv_file_path, 'r', encoding='utf-8') as file:
                 # Use semicolon as delimiter based on the CSV structure
                 reader = csv.DictReader(file, delimiter=';')
-                
-                matched_count = 0
-                created_count = 0
-                updated_count = 0
-                not_found_count = 0
-                error_count = 0
-                
-                for row_num, row in enumerate(reader, start=2):  # Start at 2 because of header
-                    try:
-                        # Extract and validate coordinates
-                        try:
-                            lat = float(row.get('lat', ''))
-                            lon = float(row.get('lon', ''))
-                        except (ValueError, TypeError):
-                            error_count += 1
-                            self.stdout.write(
-                                self.style.ERROR(f'Row {row_num}: Invalid coordinates (lat: {row.get("lat")}, lon: {row.get("lon")})')
-                            )
-                            continue
-                        
-                        # Get jumuah times from CSV
-                        jumuah_times_str = row.get('jumuah_times', '').strip()
-                        if not jumuah_times_str:
-                            error_count += 1
-                            self.stdout.write(
-                                self.style.WARNING(f'Row {row_num}: No jumuah_times found')
-                            )
-                            continue
-                        
-                        # Parse jumuah times (can be single or multiple times separated by comma)
-                        jumuah_times = self.parse_jumuah_times(jumuah_times_str)
-                        if not jumuah_times:
-                            error_count += 1
-                            self.stdout.write(
-                                self.style.ERROR(f'Row {row_num}: Could not parse jumuah_times: {jumuah_times_str}')
-                            )
-                            continue
-                        
-                        # Find matching masjid(s) by coordinates
-                        masjids = self.find_masjids_by_coordinates(lat, lon, tolerance)
-                        
-                        if not masjids.exists():
-                            not_found_count += 1
-                            self.stdout.write(
-                                self.style.WARNING(
-                                    f'Row {row_num}: No masjid found near coordinates ({lat}, {lon}) '
-                                    f'for "{row.get("name_en", "Unknown")}"'
-                                )
-                            )
-                            continue
-                        
-                        matched_count += 1
-                        
-                        if not dry_run:
-                            # Create or update JumuahPrayerTime for each matching masjid
-                            row_created = 0
-                            row_updated = 0
-                            for masjid in masjids:
-                                for jumuah_time in jumuah_times:
-                                    with transaction.atomic():
-                                        jumuah_prayer_time, created = JumuahPrayerTime.objects.update_or_create(
-                                            masjid=masjid,
-                                            date=jumuah_date,
-                                            jumuah_time=jumuah_time,
-                                            defaults={
-                                                'first_timeslot_jumuah': False,
-                                            }
-                                        )
-                                        
-                                        if created:
-                                            created_count += 1
-                                            row_created += 1
-                                        else:
-                                            updated_count += 1
-                                            row_updated += 1
-                            
-                            action = "Created" if row_created > 0 else "Updated"
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Row {row_num}: {action} jumuah times for '
-                                    f'"{masjids.first().name}" ({masjids.count()} masjid(s), {len(jumuah_times)} time(s))'
-                                )
-                            )
-                        else:
-                            # Dry run mode - just report what would be done
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Row {row_num}: Would create/update jumuah times for '
-                                    f'"{row.get("name_en", "Unknown")}" '
-                                    f'({masjids.count()} masjid(s), {len(jumuah_times)} time(s))'
-                                )
-                            )
-                                
-                    except Exception as e:
-                        error_count += 1
-                        self.stdout.write(
-                            self.style.ERROR(f'Row {row_num}: Error processing "{row.get("name_en", "Unknown")}": {str(e)}')
-                        )
-                        if not dry_run:
-                            continue
+                points, issues = self.read_points(enumerate(reader, start=2))  # Start at 2 because of header
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {csv_file_path}')
 
-                # Summary
-                self.stdout.write('')
-                self.stdout.write(self.style.SUCCESS('=' * 60))
-                if dry_run:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Dry run completed. Would process: {matched_count} matched, '
-                            f'{not_found_count} not found, {error_count} errors'
-                        )
-                    )
-                else:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Import completed. Matched: {matched_count}, '
-                            f'Created: {created_count}, Updated: {updated_count}, '
-                            f'Not found: {not_found_count}, Errors: {error_count}'
-                        )
-                    )
-                self.stdout.write(self.style.SUCCESS('=' * 60))
+        started = monotonic()
+        matches = match_points(((point.row_num, point.lon, point.lat) for point in points), options['radius'])
+        self.stdout.write(f'Matched {len(points)} points against the masjids in {monotonic() - started:.2f}s')
 
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f'File not found: {csv_file_path}'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Unexpected error: {str(e)}'))
+        times_by_masjid, claimed_by = {}, {}
+        matched_count = ambiguous_count = not_found_count = 0
+        for point in points:
+            candidates = matches.get(point.row_num)
+            if not candidates:
+                not_found_count += 1
+                issues.append((point.row_num, point.name, 'unmatched', f'No masjid within {options["radius"]:g}m'))
+                continue
+            if len(candidates) > 1:
+                ambiguous_count += 1
+                nearby = ', '.join(f'"{candidate.name}" ({candidate.distance:.0f}m)' for candidate in candidates)
+                issues.append((point.row_num, point.name, 'ambiguous', f'{len(candidates)} masjids nearby: {nearby}'))
+                if options['skip_ambiguous']:
+                    continue
+            masjid = candidates[0]
+            if masjid.masjid_id in claimed_by:
+                issues.append((
+                    point.row_num, point.name, 'ambiguous',
+                    f'"{masjid.name}" also matched by row {claimed_by[masjid.masjid_id]}, times merged',
+                ))
+            claimed_by.setdefault(masjid.masjid_id, point.row_num)
+            times = times_by_masjid.setdefault(masjid.masjid_id, [])
+            times.extend(jumuah_time for jumuah_time in point.times if jumuah_time not in times)
+            matched_count += 1
 
-    def find_masjids_by_coordinates(self, lat, lon, tolerance):
-        """
-        Find masjids with coordinates within tolerance distance.
-        Uses PostGIS dwithin for efficient spatial queries.
-        For geographic coordinates (SRID 4326), tolerance must be in degrees.
-        """
-        from django.contrib.gis.geos import Point
-        
-        # Create a point from the CSV coordinates
-        csv_point = Point(lon, lat, srid=4326)
-        
-        # Find masjids with addresses within tolerance using dwithin
-        # For geographic coordinates (SRID 4326), dwithin requires tolerance in degrees
-        # tolerance is in degrees (0.001 degrees ≈ 111 meters)
-        masjids = Masjid.objects.filter(
-            address__coordinates__isnull=False,
-            address__coordinates__dwithin=(csv_point, tolerance)
-        ).select_related('address')
-        
-        return masjids
+        error_count = sum(1 for issue in issues if issue[2] == 'error')
+        for row_num, name, status, detail in sorted(issues):
+            style = self.style.ERROR if status == 'error' else self.style.WARNING
+            self.stdout.write(style(f'Row {row_num}: {status.capitalize()} "{name}": {detail}'))
+        if options['report']:
+            self.write_report(options['report'], sorted(issues))
+
+        # Summary
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('=' * 60))
+        if dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Dry run completed. Would process: {matched_count} matched '
+                    f'({len(times_by_masjid)} masjids), {ambiguous_count} ambiguous, '
+                    f'{not_found_count} not found, {error_count} errors'
+                )
+            )
+        else:
+            created_count, updated_count = add_times(times_by_masjid, jumuah_date)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Import completed. Matched: {matched_count} ({len(times_by_masjid)} masjids), '
+                    f'Created: {created_count}, Updated: {updated_count}, Ambiguous: {ambiguous_count}, '
+                    f'Not found: {not_found_count}, Errors: {error_count}'
+                )
+            )
+        self.stdout.write(self.style.SUCCESS('=' * 60))
+
+    def read_points(self, rows):
+        """Parses the (row number, CSV row) pairs. Returns (CsvPoint list, [(row, name, 'error', detail)])."""
+        points, errors = [], []
+        for row_num, row in rows:
+            name = row.get('name_en') or 'Unknown'
+            try:
+                lat = float(row.get('lat', ''))
+                lon = float(row.get('lon', ''))
+            except (ValueError, TypeError):
+                errors.append((row_num, name, 'error', f'Invalid coordinates (lat: {row.get("lat")}, lon: {row.get("lon")})'))
+                continue
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                errors.append((row_num, name, 'error', f'Invalid coordinates (lat: {lat}, lon: {lon})'))
+                continue
+
+            # Get jumuah times from CSV
+            jumuah_times_str = (row.get('jumuah_times') or '').strip()
+            if not jumuah_times_str:
+                errors.append((row_num, name, 'error', 'No jumuah_times found'))
+                continue
+
+            # Parse jumuah times (can be single or multiple times separated by comma)
+            jumuah_times = self.parse_jumuah_times(jumuah_times_str)
+            if not jumuah_times:
+                errors.append((row_num, name, 'error', f'Could not parse jumuah_times: {jumuah_times_str}'))
+                continue
+            points.append(CsvPoint(row_num, name, lon, lat, jumuah_times))
+        return points, errors
+
+    def write_report(self, path, issues):
+        with open(path, 'w', encoding='utf-8', newline='') as report:
+            writer = csv.writer(report, delimiter=';')
+            writer.writerow(['row', 'name_en', 'status', 'detail'])
+            writer.writerows(issues)
+        self.stdout.write(f'Report written to {path}')
 
     def parse_jumuah_times(self, jumuah_times_str):
         """
@@ -0,0 +1,60 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from prayertime.partitions import archive_rules, archive_year, default_years, ensure_partitions, partition_years
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the coming yearly PrayerTime partitions, then archive past years to the storage and "
+        "detach their partitions, along with Eid prayers and superseded Jumuah rules. Run yearly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-years',
+            type=int,
+            default=2,
+            help='Number of years kept in the database, the current one included (default: 2).'
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=1,
+            help='Number of coming years to create partitions for (default: 1).'
+        )
+        parser.add_argument(
+            '--keep-detached',
+            action='store_true',
+            help='Keep the detached partitions as standalone tables instead of dropping them.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be created and archived without changing anything.'
+        )
+
+    def handle(self, *args, **options):
+        current = timezone.localdate().year
+        cutoff = current - max(options['keep_years'], 1) + 1
+        wanted = set(range(current, current + options['ahead'] + 1)) | set(default_years())
+        expired = [year for year in partition_years() if year < cutoff]
+
+        if options['dry_run']:
+            missing = sorted(wanted - set(partition_years()))
+            self.stdout.write(self.style.WARNING("DRY RUN - nothing is changed"))
+            self.stdout.write(f"Partitions to create: {missing or 'none'}")
+            self.stdout.write(f"Years to archive: {expired or 'none'}, rules dated before {date(cutoff, 1, 1)}")
+            return
+
+        for year in ensure_partitions(wanted):
+            self.stdout.write(self.style.SUCCESS(f"Created the {year} partition"))
+
+        for year in expired:
+            name, count, sha256 = archive_year(year, drop=not options['keep_detached'])
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} prayer times of {year} to {name} (sha256 {sha256})"))
+
+        for model, (name, count) in archive_rules(date(cutoff, 1, 1)).items():
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} {model} rows to {name}"))
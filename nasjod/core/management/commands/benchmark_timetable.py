@@ -0,0 +1,62 @@
+import random
+import statistics
+from datetime import timedelta
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from prayertime.models import PrayerTime
+from prayertime.timetable import PRAYERS, Timetable
+
+
+class Command(BaseCommand):
+    help = "Compare masjid prayer time lookups through the ORM and through the memory-mapped timetable."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--masjids', type=int, default=500, help='Number of masjids per lookup.')
+        parser.add_argument('--days', type=int, default=7, help='Number of days per lookup, from today.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed lookups per path.')
+        parser.add_argument('--path', type=str, default=settings.TIMETABLE_PATH, help='Timetable file.')
+
+    def handle(self, *args, **options):
+        table = Timetable(options['path'])
+        if not table.available:
+            raise CommandError(f"No timetable at {options['path']}, run build_timetable first.")
+
+        today = timezone.localdate()
+        dates = [today + timedelta(days=offset) for offset in range(options['days'])]
+        Link = PrayerTime.masjids.through
+        masjid_ids = list(Link.objects.filter(prayertime__date=today).values_list('masjid_id', flat=True).distinct())
+        masjid_ids = random.sample(masjid_ids, min(options['masjids'], len(masjid_ids)))
+        if not masjid_ids:
+            raise CommandError("No masjid is linked to today's prayer times.")
+
+        def orm():
+            result = {}
+            rows = Link.objects.filter(masjid_id__in=masjid_ids, prayertime__date__in=dates).values_list(
+                'masjid_id', 'prayertime__date', *(f'prayertime__{prayer}' for prayer in PRAYERS)
+            )
+            for masjid_id, day, *times in rows:
+                result.setdefault(masjid_id, {})[day] = times
+            return result
+
+        def mapped():
+            return table.masjid_times(masjid_ids, dates)
+
+        self.stdout.write(self.style.NOTICE(
+            f"{len(masjid_ids)} masjids x {len(dates)} days, {options['repeat']} lookups per path"
+        ))
+        timings = {}
+        for name, lookup in (('ORM', orm), ('Timetable', mapped)):
+            lookup()  # Warm up connections and page cache
+            samples = []
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                lookup()
+                samples.append((perf_counter() - started) * 1000)
+            timings[name] = statistics.median(samples)
+            self.stdout.write(f"{name:<10} median {timings[name]:8.3f} ms, max {max(samples):8.3f} ms")
+
+        self.stdout.write(self.style.SUCCESS(f"Timetable is {timings['ORM'] / timings['Timetable']:.0f}x faster"))
@@ -0,0 +1,39 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from masjid.models import Masjid
+from prayertime.schedules import build_schedules, horizon, prune
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySchedule read model over the rolling horizon and drop past days. Workers also run it daily (prayertime.tasks.extend_daily_schedules)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Number of days covered from today (default: DAILY_SCHEDULE_HORIZON_DAYS).'
+        )
+        parser.add_argument(
+            '--masjids',
+            type=str,
+            nargs='+',
+            help='Only rebuild these masjids (UUIDs).'
+        )
+
+    def handle(self, *args, **options):
+        start, end = horizon(days=options['days'])
+        masjid_ids = None
+        if options['masjids']:
+            masjid_ids = list(Masjid.objects.filter(uuid__in=options['masjids']).values_list('id', flat=True))
+
+        self.stdout.write(self.style.NOTICE(f"Building daily schedules from {start} to {end}..."))
+        started = monotonic()
+        with transaction.atomic():
+            written, deleted = build_schedules(masjid_ids, start, end)
+            pruned = prune(start)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{written} schedules written, {deleted} stale and {pruned} past ones deleted "
+            f"in {monotonic() - started:.2f}s"
+        ))
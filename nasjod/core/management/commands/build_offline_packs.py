@@ -0,0 +1,44 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from prayertime.linking import zone_location_ids
+from prayertime.packs import KEEP_VERSIONS, build_packs
+
+
+class Command(BaseCommand):
+    help = "Build the offline timetable packs of every zone for the given years. Run after loading prayer times."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years',
+            type=int,
+            nargs='+',
+            help='Years to build (default: the current and next year).'
+        )
+        parser.add_argument(
+            '--governorate',
+            type=str,
+            help='Only build the zones of this governorate.'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=KEEP_VERSIONS,
+            help='Number of versions kept per pack to serve deltas from.'
+        )
+
+    def handle(self, *args, **options):
+        current = timezone.localdate().year
+        years = options['years'] or [current, current + 1]
+        location_ids = None
+        if options['governorate']:
+            location_ids = zone_location_ids(state__iexact=options['governorate'])
+
+        for year in years:
+            started = monotonic()
+            built, unchanged = build_packs(year, location_ids, keep=options['keep'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{year}: {built} packs built, {unchanged} unchanged in {monotonic() - started:.2f}s"
+            ))
@@ -0,0 +1,26 @@
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from prayertime.timetable import build
+
+
+class Command(BaseCommand):
+    help = "Build the memory-mapped timetable shared by the web workers. Rebuilt automatically after prayer time loads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            type=str,
+            default=settings.TIMETABLE_PATH,
+            help='File to write (default: TIMETABLE_PATH).'
+        )
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        zones, days, masjids = build(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Timetable of {zones} zones, {days} days and {masjids} masjids written to {options['path']} "
+            f"in {monotonic() - started:.2f}s"
+        ))
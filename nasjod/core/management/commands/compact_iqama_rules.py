@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from masjid.models import Masjid
+from prayertime.iqamas import redundant_rules
+from prayertime.models import IqamaTime
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the IqamaTime rules that never apply: rules shadowed by a later one of the same date "
+        "and rules repeating the rule they follow."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--masjids',
+            type=str,
+            nargs='+',
+            help='Only compact the rules of these masjids (UUIDs).'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the redundant rules without deleting them.'
+        )
+
+    def handle(self, *args, **options):
+        masjid_ids = None
+        if options['masjids']:
+            masjid_ids = list(Masjid.objects.filter(uuid__in=options['masjids']).values_list('id', flat=True))
+
+        redundant = list(redundant_rules(masjid_ids))
+        if options['dry_run']:
+            self.stdout.write(self.style.NOTICE(f"{len(redundant)} of {IqamaTime.objects.count()} rules are redundant."))
+            return
+
+        # Resolved iqamas do not change, the delete signals only refresh the schedules of the masjids
+        deleted = 0
+        with transaction.atomic():
+            for start in range(0, len(redundant), BATCH_SIZE):
+                count, _ = IqamaTime.objects.filter(id__in=redundant[start:start + BATCH_SIZE]).delete()
+                deleted += count
+        self.stdout.write(self.style.SUCCESS(f"{deleted} redundant iqama rules deleted."))
@@ -1,25 +1,17 @@
-import json
-import os
-import requests
-from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import Point
-from django.utils import timezone
-from core.models import Address
-from prayertime.models import PrayerTime
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.db import transaction
 
+from core.commands import CheckpointedCommand
+from prayertime.loaders import PrayerTimeLoader, resolve_location
+from prayertime.meteo import add_fetch_arguments, client_options, fetch_prayer_time_cells, load_zones
+from prayertime.planner import plan_refresh
+from datetime import datetime, timedelta
+
 # Constants
-BASE_URL = "https://www.meteo.tn/horaire_gouvernorat/{date}/{state_id}/{city_id}"
-BASE_URL_SUNRISE = "https://www.meteo.tn/lever_coucher_gouvernorat/{date}/{state_id}/{city_id}"
-STATE_ID = 359  # Sfax state ID
-CITY_IDS = [540, 538, 545, 541, 539, 536, 543, 544, 537, 542, 548, 547, 632, 546, 549]
 DEFAULT_START_DATE = "2024-12-15"
 DEFAULT_END_DATE = "2024-12-16"
-MAX_WORKERS = 10
+ZONE_BATCH_SIZE = 10
 
-class Command(BaseCommand):
+class Command(CheckpointedCommand):
     help = "Fetch prayer times along with sunrise from API and store them directly into the database."
 
     def add_arguments(self, parser):
@@ -36,31 +28,27 @@ class Command(BaseCommand):
             help='End date in YYYY-MM-DD format.'
         )
         parser.add_argument(
-            '--state-id',
-            type=int,
-            default=STATE_ID,
-            help='State ID to fetch data for.'
+            '--governorates',
+            type=str,
+            nargs='+',
+            help='Governorates to fetch (names from governorats-meteo-ids.json). Defaults to all of them.'
         )
         parser.add_argument(
-            '--city-ids',
-            type=int,
-            nargs='+',
-            default=CITY_IDS,
-            help='List of city IDs to fetch data for.'
+            '--only-missing',
+            action='store_true',
+            help='Only fetch the (zone, date) cells of the window that are not in the database yet.'
         )
         parser.add_argument(
-            '--max-workers',
+            '--max-age-days',
             type=int,
-            default=MAX_WORKERS,
-            help='Maximum number of threads for concurrent requests.'
+            default=None,
+            help='With --only-missing, also refetch cells fetched more than this many days ago.'
         )
+        add_fetch_arguments(parser)
 
-    def handle(self, *args, **options):
+    def run(self, *args, **options):
         start_date_str = options['start_date']
         end_date_str = options['end_date']
-        state_id = options['state_id']
-        city_ids = options['city_ids']
-        max_workers = options['max_workers']
 
         # Parse dates
         try:
@@ -77,41 +65,81 @@ class Command(BaseCommand):
         # Generate list of dates
         date_list = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
 
-        self.stdout.write(self.style.NOTICE(f"Fetching prayer times and sunrise from {start_date} to {end_date} for state ID {state_id}."))
-
-        # Fetch data concurrently
-        results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_params = {
-                executor.submit(self.fetch_city_data, city_id, date_list, state_id): city_id
-                for city_id in city_ids
-            }
-
-            for future in as_completed(future_to_params):
-                city_id = future_to_params[future]
-                try:
-                    data = future.result()
-                    self.stdout.write(self.style.SUCCESS(f"Successfully fetched data for city_id {city_id}."))
-                    results.append(data)
-                except Exception as exc:
-                    self.stderr.write(self.style.ERROR(f"City_id {city_id} generated an exception: {exc}"))
+        zones = load_zones(options['governorates'])
+        if not zones:
+            self.stderr.write(self.style.ERROR("No matching governorates found in governorats-meteo-ids.json."))
+            return
 
-        if not results:
+        if options['only_missing']:
+            max_age = timedelta(days=options['max_age_days']) if options['max_age_days'] is not None else None
+            plan = plan_refresh(zones, start_date, end_date, max_age=max_age)
+            cells = [(zone, day) for zone, days in plan.items() for day in days]
+            if not cells:
+                self.stdout.write(self.style.SUCCESS(f"No missing prayer times from {start_date} to {end_date}. Nothing to fetch."))
+                return
+            self.stdout.write(self.style.NOTICE(
+                f"{len(cells)} of {len(zones) * len(date_list)} (zone, date) cells are missing or stale in {len(plan)} zones."
+            ))
+        else:
+            cells = [(zone, day) for zone in zones for day in date_list]
+
+        self.stdout.write(self.style.NOTICE(
+            f"Fetching prayer times and sunrise from {start_date} to {end_date} for {len(zones)} zones."
+        ))
+
+        # Zones are fetched and stored in batches; a rerun of the same window skips the zones stored
+        checkpoint = self.checkpoint(
+            f"{start_date}:{end_date}:{','.join(sorted(options['governorates'] or ['all']))}"
+            f":{'missing' if options['only_missing'] else 'all'}"
+        )
+        done = set(checkpoint.position.get('zones', []))
+        pending = [zone for zone in dict.fromkeys(zone for zone, _ in cells) if self.zone_key(zone) not in done]
+        progress = self.progress(len(cells), unit='cells', done=sum(1 for zone, _ in cells if self.zone_key(zone) in done))
+
+        fetch_options = client_options(options)
+        stored = False
+        failed = set()
+        for start in range(0, len(pending), ZONE_BATCH_SIZE):
+            batch = set(pending[start:start + ZONE_BATCH_SIZE])
+            batch_cells = [(zone, day) for zone, day in cells if zone in batch]
+            prayer_times_data, batch_failed = self.group_results(fetch_prayer_time_cells(batch_cells, **fetch_options))
+            # Only zones whose cells were all stored are recorded, with the rows they cover
+            with transaction.atomic():
+                if prayer_times_data:
+                    # Store data into the database
+                    batch_failed |= self.store_data(prayer_times_data)
+                    stored = True
+                done.update(key for key in map(self.zone_key, batch) if key not in batch_failed)
+                checkpoint.advance(zones=sorted(done))
+            failed |= batch_failed
+            progress.advance(len(batch_cells))
+        if failed:
+            # Left uncompleted, so that the next run retries them
+            self.stderr.write(self.style.WARNING(
+                f"{len(failed)} zones were not fully stored and will be fetched again: {', '.join(sorted(failed))}"
+            ))
+        else:
+            checkpoint.complete()
+
+        if fetch_options['cache'] is not None:
+            cache = fetch_options['cache']
+            self.stdout.write(self.style.NOTICE(f"Response cache: {cache.hits} hits, {cache.misses} misses."))
+
+        if not stored and pending:
             self.stderr.write(self.style.ERROR("No data fetched. Exiting."))
             return
 
-        # Merge all city data
-        prayer_times_data = self.merge_data(results)
-
-        # Store data into the database
-        self.store_data(prayer_times_data)
-
         self.stdout.write(self.style.SUCCESS("Prayer times data with sunrise has been successfully fetched and stored."))
 
-    def fetch_city_data(self, city_id, date_list, state_id):
+    @staticmethod
+    def zone_key(zone):
+        return f"{zone.governorate}/{zone.city}"
+
+    def group_results(self, results):
         """
-        Fetches prayer times and sunrise data for a single city_id over the specified date range.
-        Returns a nested dictionary structure:
+        Groups fetch results into the nested structure used by store_data, keyed on the
+        zone names of governorats-meteo-ids.json so reruns resolve to the same Address.
+        Returns it with the keys of the zones having a cell that failed or had no data:
         {
             "GovernorateName": {
                 "CityName": {
@@ -123,150 +151,52 @@ class Command(BaseCommand):
             }
         }
         """
-        city_data = {}
-
-        for current_date in date_list:
-            formatted_date = current_date.strftime("%Y-%m-%d")
-
-            # Fetch main prayer times
-            url_main = BASE_URL.format(date=formatted_date, state_id=state_id, city_id=city_id)
-            try:
-                response_main = requests.get(url_main, timeout=10)
-                response_main.raise_for_status()
-                data_main = response_main.json().get("data", {})
-
-                if not data_main:
-                    self.stderr.write(self.style.WARNING(f"No data found for city_id {city_id} on {formatted_date}."))
-                    continue
-
-                governorate_name = data_main.get("gouvernorat", {}).get("intituleAn", "Unknown")
-                city_name = data_main.get("delegation", {}).get("intituleAn", "Unknown")
-                lat = data_main.get("lat")
-                lng = data_main.get("lng")
-                sobh = data_main.get("sobh")
-                dhohr = data_main.get("dhohr")
-                aser = data_main.get("aser")
-                magreb = data_main.get("magreb")
-                isha = data_main.get("isha")
-                prayer_date = data_main.get("date")
-
-                if not all([governorate_name, city_name, lat, lng, sobh, dhohr, aser, magreb, isha, prayer_date]):
-                    self.stderr.write(self.style.WARNING(f"Incomplete data for city_id {city_id} on {formatted_date}. Skipping."))
-                    continue
-
-                # Fetch sunrise data
-                url_sunrise = BASE_URL_SUNRISE.format(date=formatted_date, state_id=state_id, city_id=city_id)
-                response_sunrise = requests.get(url_sunrise, timeout=10)
-                response_sunrise.raise_for_status()
-                data_sunrise = response_sunrise.json().get("data", {})
-                sunrise_time = data_sunrise.get("lever")
-
-                # Initialize data structure
-                if governorate_name not in city_data:
-                    city_data[governorate_name] = {}
-                if city_name not in city_data[governorate_name]:
-                    city_data[governorate_name][city_name] = {
-                        "latitude": lat,
-                        "longitude": lng,
-                        "prayer_times": []
-                    }
-
-                # Append prayer time entry including sunrise
-                city_data[governorate_name][city_name]["prayer_times"].append({
-                    "date": prayer_date,
-                    "sobh": sobh,
-                    "dhohr": dhohr,
-                    "aser": aser,
-                    "magreb": magreb,
-                    "isha": isha,
-                    "sunrise": sunrise_time
-                })
-
-            except requests.RequestException as e:
-                self.stderr.write(self.style.ERROR(f"Request failed for city_id {city_id} on {formatted_date}: {e}"))
-            except json.JSONDecodeError:
-                self.stderr.write(self.style.ERROR(f"Invalid JSON response for city_id {city_id} on {formatted_date}."))
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Unexpected error for city_id {city_id} on {formatted_date}: {e}"))
-
-        return city_data
-
-    def merge_data(self, results_list):
-        """
-        Merge multiple city data dictionaries into a single dictionary.
-        """
-        merged = {}
-        for res in results_list:
-            for gov_name, gov_data in res.items():
-                if gov_name not in merged:
-                    merged[gov_name] = {}
-                for city_name, city_info in gov_data.items():
-                    if city_name not in merged[gov_name]:
-                        merged[gov_name][city_name] = {
-                            "latitude": city_info["latitude"],
-                            "longitude": city_info["longitude"],
-                            "prayer_times": []
-                        }
-                    # Extend the prayer times list
-                    merged[gov_name][city_name]["prayer_times"].extend(city_info["prayer_times"])
-        return merged
+        grouped, failed = {}, set()
+        for zone, day, result in results:
+            if isinstance(result, Exception):
+                self.stderr.write(self.style.ERROR(f"Request failed for {zone.city} ({zone.governorate}) on {day}: {result}"))
+                failed.add(self.zone_key(zone))
+                continue
+            if result is None:
+                self.stderr.write(self.style.WARNING(f"No data found for {zone.city} ({zone.governorate}) on {day}."))
+                failed.add(self.zone_key(zone))
+                continue
+
+            city_data = grouped.setdefault(zone.governorate, {}).setdefault(zone.city, {
+                "latitude": result['latitude'],
+                "longitude": result['longitude'],
+                "prayer_times": []
+            })
+            city_data["prayer_times"].append(result['entry'])
+        return grouped, failed
 
     def store_data(self, prayer_times_data):
         """
         Stores the merged prayer times data into the database.
+        Rows are upserted per city, so running the command twice does not create duplicates.
+        Returns the keys of the zones that failed, whose writes are rolled back.
         """
-        with transaction.atomic():
-            for gov_name, cities in prayer_times_data.items():
-                for city_name, city_info in cities.items():
-                    latitude = float(city_info['latitude'])
-                    longitude = float(city_info['longitude'])
-                    coordinates = Point(longitude, latitude)  # Longitude first
-
-                    # Create a new Address entry every time (as requested)
-                    try:
-                        address = Address.objects.create(
-                            city=city_name,
-                            state=gov_name,
-                            country="Tunisia",
-                            coordinates=coordinates
+        loader = PrayerTimeLoader()
+        failed = set()
+        for gov_name, cities in prayer_times_data.items():
+            for city_name, city_info in cities.items():
+                try:
+                    with transaction.atomic():
+                        address = resolve_location(
+                            gov_name, city_name, city_info['latitude'], city_info['longitude'], rename=True
                         )
-                        self.stdout.write(self.style.SUCCESS(f"Created new address for {city_name}, {gov_name}."))
-                    except Exception as e:
-                        self.stderr.write(self.style.ERROR(f"Error creating Address for {city_name}, {gov_name}: {e}"))
-                        continue
-
-                    for prayer_time_entry in city_info['prayer_times']:
-                        try:
-                            date_str = prayer_time_entry['date']
-                            # Attempt parsing date with time
-                            try:
-                                date = datetime.strptime(date_str, "%Y-%m-%d %H:%M").date()
-                            except ValueError:
-                                # Fallback if no time is provided
-                                date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-                            fajr_time = datetime.strptime(prayer_time_entry['sobh'], "%H:%M").time()
-                            dhuhr_time = datetime.strptime(prayer_time_entry['dhohr'], "%H:%M").time()
-                            asr_time = datetime.strptime(prayer_time_entry['aser'], "%H:%M").time()
-                            maghrib_time = datetime.strptime(prayer_time_entry['magreb'], "%H:%M").time()
-                            isha_time = datetime.strptime(prayer_time_entry['isha'], "%H:%M").time()
-
-                            sunrise_time_str = prayer_time_entry.get('sunrise')
-                            sunrise_time = datetime.strptime(sunrise_time_str, "%H:%M").time() if sunrise_time_str else None
+                        errors = loader.load(address, city_info['prayer_times'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Error storing prayer times for {city_name}, {gov_name}: {e}"))
+                    failed.add(f"{gov_name}/{city_name}")
+                    continue
 
-                            PrayerTime.objects.create(
-                                location=address,
-                                date=date,
-                                fajr=fajr_time,
-                                sunrise=sunrise_time,
-                                dhuhr=dhuhr_time,
-                                asr=asr_time,
-                                maghrib=maghrib_time,
-                                isha=isha_time
-                            )
+                for date_str, error in errors:
+                    self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {error}"))
+                if errors:
+                    failed.add(f"{gov_name}/{city_name}")
+                    continue
+                self.stdout.write(self.style.SUCCESS(f"Stored prayer times for {city_name}, {gov_name}."))
 
-                            self.stdout.write(self.style.SUCCESS(f"Created PrayerTime for {city_name} on {date}."))
-                        except ValueError as e:
-                            self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {e}"))
-                        except Exception as e:
-                            self.stderr.write(self.style.ERROR(f"Error saving PrayerTime for {city_name} on {date_str}: {e}"))
+        self.stdout.write(self.style.SUCCESS(f"PrayerTime load: {loader.summary()}"))
+        return failed
@@ -0,0 +1,51 @@
+import os
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from masjid.models import Masjid
+from masjid.variants import IMAGE_FIELDS, generate, is_stale
+
+BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the thumbnail, card and full derivatives (WebP and JPEG) and the placeholder of the masjid "
+        "covers and photos that have none or were rendered from another image."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--masjids',
+            type=str,
+            nargs='+',
+            help='Only render the images of these masjids (UUIDs).'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Render again the derivatives that are up to date.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processes rendering the images (default: one per CPU).'
+        )
+
+    def handle(self, *args, **options):
+        masjids = Masjid.objects.order_by('id').only('id', *IMAGE_FIELDS, 'cover_variants', 'photo_variants')
+        if options['masjids']:
+            masjids = masjids.filter(uuid__in=options['masjids'])
+        masjids = [masjid for masjid in masjids.iterator()
+                   if options['force'] or any(is_stale(masjid, field) for field in IMAGE_FIELDS)]
+
+        started = monotonic()
+        updated = 0
+        for start in range(0, len(masjids), BATCH_SIZE):
+            updated += generate(masjids[start:start + BATCH_SIZE], force=options['force'], workers=options['workers'])
+            self.stdout.write(f"{min(start + BATCH_SIZE, len(masjids))}/{len(masjids)} masjids")
+        self.stdout.write(self.style.SUCCESS(
+            f"Derivatives rendered for {updated} masjids in {monotonic() - started:.2f}s."
+        ))
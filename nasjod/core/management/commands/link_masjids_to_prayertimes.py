@@ -1,35 +1,74 @@
+from time import monotonic
+
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from core.models import Address
 from masjid.models import Masjid
+from prayertime.linking import link_prayer_times, unlink_prayer_times
 from prayertime.models import PrayerTime
 
 class Command(BaseCommand):
     help = "Link all masjids to prayer times based on matching state."
 
-    def handle(self, *args, **kwargs):
-        # Track the number of masjids and prayer times linked
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Also remove links to prayer times outside the masjid state.'
+        )
+
+    def handle(self, *args, **options):
+        prune = options['prune']
+        started = monotonic()
+
+        # Masjids and prayer time locations grouped by state, one query each
+        masjids_by_state = dict(
+            Masjid.objects.filter(address__state__isnull=False)
+            .exclude(address__state='')
+            .values(state=Lower('address__state'))
+            .annotate(ids=ArrayAgg('id'))
+            .values_list('state', 'ids')
+        )
+        locations_by_state = dict(
+            Address.objects.filter(id__in=PrayerTime.objects.values('location_id'), state__isnull=False)
+            .values(state_lower=Lower('state'))
+            .annotate(ids=ArrayAgg('id'))
+            .values_list('state_lower', 'ids')
+        )
+
+        skipped = Masjid.objects.filter(Q(address__state__isnull=True) | Q(address__state='')).count()
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"{skipped} masjids have no address or state. Skipping..."))
+
+        # Track the number of links created and removed
         linked_count = 0
+        unlinked_count = 0
+        total = len(masjids_by_state)
+        for index, (state, masjid_ids) in enumerate(sorted(masjids_by_state.items()), start=1):
+            location_ids = locations_by_state.get(state, [])
+            if not location_ids:
+                self.stdout.write(self.style.WARNING(
+                    f"[{index}/{total}] No prayer times found for state '{state}' to link with {len(masjid_ids)} masjids"
+                ))
+                if not prune:
+                    continue
 
-        # Iterate through each masjid and attempt to link it to prayer times by state
-        for masjid in Masjid.objects.all():
-            state = masjid.address.state if masjid.address else None
-            if not state:
-                self.stdout.write(self.style.WARNING(f"Masjid '{masjid.name}' has no address or state. Skipping..."))
-                continue
-
-            # Find prayer times matching the masjid's state
-            prayer_times = PrayerTime.objects.filter(location__state=state)
-
-            if prayer_times.exists():
-                with transaction.atomic():  # Use a transaction for atomic updates
-                    for prayer_time in prayer_times:
-                        prayer_time.masjids.add(masjid)
-                    linked_count += prayer_times.count()
-                    self.stdout.write(
-                        self.style.SUCCESS(f"Linked Masjid '{masjid.name}' to {prayer_times.count()} prayer times in '{state}'")
-                    )
-            else:
-                self.stdout.write(self.style.WARNING(f"No prayer times found for state '{state}' to link with Masjid '{masjid.name}'"))
+            zone_started = monotonic()
+            with transaction.atomic():
+                removed = unlink_prayer_times(masjid_ids, location_ids) if prune else 0
+                added = link_prayer_times(masjid_ids, location_ids)
+            linked_count += added
+            unlinked_count += removed
+            self.stdout.write(self.style.SUCCESS(
+                f"[{index}/{total}] '{state}': {len(masjid_ids)} masjids, {added} links created, "
+                f"{removed} removed in {monotonic() - zone_started:.2f}s"
+            ))
 
         # Summary of results
-        self.stdout.write(self.style.SUCCESS(f"Total prayer times linked to masjids: {linked_count}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Total prayer time links created: {linked_count}, removed: {unlinked_count} "
+            f"in {monotonic() - started:.2f}s"
+        ))
@@ -1,13 +1,23 @@
-import json
+import os
+from time import monotonic
+
 from django.core.management.base import BaseCommand
+from django.db import transaction
+
 from core.models import Address  # Import your Address model
-import os
+from core.seeds import BATCH_SIZE, load_fixture, reset_sequences
+
+REQUIRED_FIELDS = ('street', 'city', 'state', 'country', 'coordinates')
+# Address.save normalization, skipped by the bulk upserts
+LOWERCASE_FIELDS = ('country', 'state', 'city', 'district')
+
 
 class Command(BaseCommand):
     help = 'Populate the Address model from a JSON file'
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='The path to the JSON file with address data')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Addresses upserted per query')
 
     def handle(self, *args, **options):
         file_path = options['file_path']
@@ -16,39 +26,24 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f"File not found: {file_path}"))
             return
 
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-
-        # Counter for tracking how many addresses are populated
-        created_count = 0
-
-        for entry in data:
-            if entry['model'] == 'core.address':
-                fields = entry.get('fields', {})
-
-                # Extract the fields with conditions
-                street = fields.get('street')
-                city = fields.get('city')
-                state = fields.get('state')
-                country = fields.get('country')
-                coordinates = fields.get('coordinates')
-
-                # Skip records where street is "$"
-                if street == "$":
-                    continue
-
-                # Create a new Address instance if all required fields are present
-                if all([street, city, state, country, coordinates]):
-                    Address.objects.update_or_create(
-                        pk=entry['pk'],
-                        defaults={
-                            'street': street,
-                            'city': city,
-                            'state': state,
-                            'country': country,
-                            'coordinates': coordinates,
-                        }
-                    )
-                    created_count += 1
-
-        self.stdout.write(self.style.SUCCESS(f"{created_count} addresses populated successfully."))
+        started = monotonic()
+        with open(file_path, 'rb') as file, transaction.atomic():
+            loaded = load_fixture(file, Address, prepare=self.prepare, batch_size=options['batch_size'])
+            reset_sequences(Address)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(loaded)} addresses populated successfully in {monotonic() - started:.2f}s."
+        ))
+
+    def prepare(self, entries):
+        kept = []
+        for entry in entries:
+            fields = entry.get('fields', {})
+            # Skip records where street is "$" and the ones missing a required field
+            if fields.get('street') == "$" or not all(fields.get(field) for field in REQUIRED_FIELDS):
+                continue
+            for field in LOWERCASE_FIELDS:
+                if fields.get(field):
+                    fields[field] = fields[field].lower()
+            kept.append(entry)
+        return kept
@@ -1,39 +1,77 @@
-import json
-from django.core.management.base import BaseCommand
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from core.models import Address
+from core.seeds import BATCH_SIZE, load_fixture, reset_sequences
 from masjid.models import Masjid
+from masjid.tasks import generate_image_variants
+from masjid.variants import IMAGE_FIELDS, is_stale
+
 
 class Command(BaseCommand):
     help = 'Populate the Masjid model from a JSON file'
 
     def add_arguments(self, parser):
         parser.add_argument('json_file', type=str, help='The path to the JSON file containing masjid data')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Masjids upserted per query')
 
     def handle(self, *args, **options):
         json_file_path = options['json_file']
-        
-        # Load JSON data
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            masjids_data = json.load(file)
-
-        # Iterate over each masjid entry in the JSON file
-        for entry in masjids_data:
-            fields = entry['fields']
-            
-            # Remove the address key from fields
-            if 'address' in fields:
-                del fields['address']
-
-
-            # Create or update the masjid instance
-            masjid, created = Masjid.objects.update_or_create(
-                pk=entry['pk'],
-                defaults=fields  # Pass in fields with address set to None
-            )
-
-            # Log output
-            if created:
-                self.stdout.write(self.style.SUCCESS(f'Masjid "{masjid.name}" created successfully'))
-            else:
-                self.stdout.write(self.style.SUCCESS(f'Masjid "{masjid.name}" updated successfully'))
-
-        self.stdout.write(self.style.SUCCESS('All masjids processed successfully'))
+        self.dangling = 0
+
+        started = monotonic()
+        try:
+            with open(json_file_path, 'rb') as file, transaction.atomic():
+                loaded = load_fixture(file, Masjid, prepare=self.prepare, batch_size=options['batch_size'])
+                # Masjid.clean() and the m2m_changed check of the roles, once for the whole file
+                self.check_unique_addresses()
+                self.check_unique_roles()
+                reset_sequences(Masjid)
+                self.queue_image_variants(loaded)
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {json_file_path}')
+
+        if self.dangling:
+            self.stdout.write(self.style.WARNING(f'{self.dangling} masjids reference a missing address, left without one'))
+        self.stdout.write(self.style.SUCCESS(
+            f'All masjids processed successfully: {len(loaded)} in {monotonic() - started:.2f}s'
+        ))
+
+    def prepare(self, entries):
+        # Addresses skipped by populate_address are not linked
+        address_ids = {entry['fields'].get('address') for entry in entries} - {None}
+        existing = set(Address.objects.filter(pk__in=address_ids).values_list('pk', flat=True))
+        for entry in entries:
+            address_id = entry['fields'].get('address')
+            if address_id is not None and address_id not in existing:
+                entry['fields']['address'] = None
+                self.dangling += 1
+        return entries
+
+    def check_unique_addresses(self):
+        duplicates = list(
+            Masjid.objects.filter(address__isnull=False).values('address_id')
+            .annotate(count=Count('id')).filter(count__gt=1).values_list('address_id', flat=True)
+        )
+        if duplicates:
+            raise CommandError(f'Several masjids share the addresses {sorted(duplicates)}: nothing was loaded')
+
+    def check_unique_roles(self):
+        assistant = Masjid.assistants.through.objects.filter(
+            masjid_id=OuterRef('masjid_id'), user_id=OuterRef('user_id')
+        )
+        conflicts = sorted(set(
+            Masjid.managers.through.objects.filter(Exists(assistant)).values_list('masjid_id', flat=True)
+        ))
+        if conflicts:
+            raise CommandError(f'Masjids {conflicts} have a user both manager and assistant: nothing was loaded')
+
+    def queue_image_variants(self, masjid_ids):
+        # The post_save receiver is not run by bulk upserts
+        masjids = Masjid.objects.filter(pk__in=masjid_ids).only('id', *IMAGE_FIELDS, 'cover_variants', 'photo_variants')
+        stale = [masjid.pk for masjid in masjids if any(is_stale(masjid, field) for field in IMAGE_FIELDS)]
+        for start in range(0, len(stale), BATCH_SIZE):
+            generate_image_variants.delay(masjid_ids=stale[start:start + BATCH_SIZE])
@@ -0,0 +1,163 @@
+import json
+from datetime import datetime
+from uuid import UUID
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.backups import backup_store, chain_manifests, list_backups
+from core.restore import write_selection
+from core.verify import find, replay, select
+
+
+class Command(BaseCommand):
+    help = (
+        'Restore chosen apps, models or rows of a backup, with the rows related to them, into the live '
+        'database or into a scratch schema'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backup-file',
+            type=str,
+            help='Backup to restore from (e.g., app_20241217_143022). If not specified, uses the latest backup.',
+        )
+        parser.add_argument(
+            '--backup-dir',
+            type=str,
+            help='Restore from a backup of this local directory instead of the R2 bucket',
+        )
+        parser.add_argument(
+            '--models',
+            nargs='+',
+            default=[],
+            help='Apps or models whose rows are all restored (e.g., masjid prayertime.iqamatime)',
+        )
+        parser.add_argument(
+            '--pks',
+            action='append',
+            default=[],
+            help='Rows of a model to restore, as model=pk,pk,... (e.g., core.address=12,14); repeatable',
+        )
+        parser.add_argument(
+            '--masjid',
+            action='append',
+            default=[],
+            help='UUID of a masjid to restore with its address, iqamas, jumuah times and links; repeatable',
+        )
+        parser.add_argument(
+            '--no-related',
+            action='store_true',
+            help='Do not restore the rows deleted along with the chosen ones (iqamas of a masjid...)',
+        )
+        parser.add_argument(
+            '--schema',
+            type=str,
+            help='Restore into copies of the tables in this scratch schema instead of the live tables',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Skip confirmation prompt (use with caution)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the rows that would be restored without writing anything',
+        )
+
+    def model_label(self, name):
+        try:
+            return apps.get_model(name)._meta.label_lower
+        except (LookupError, ValueError):
+            raise CommandError(f'Unknown model "{name}"')
+
+    def seeds(self, store, manifests, options):
+        seeds = {}
+        for name in options['models']:
+            if '.' in name:
+                seeds[self.model_label(name)] = None
+                continue
+            try:
+                app = apps.get_app_config(name)
+            except LookupError:
+                raise CommandError(f'Unknown app or model "{name}"')
+            for model in app.get_models(include_auto_created=True):
+                seeds[model._meta.label_lower] = None
+        for value in options['pks']:
+            name, _, pks = value.partition('=')
+            label = self.model_label(name)
+            pk_field = apps.get_model(label)._meta.pk
+            try:
+                values = [json.loads(json.dumps(pk_field.to_python(pk), cls=DjangoJSONEncoder)) for pk in pks.split(',')]
+            except Exception as e:
+                raise CommandError(f'Invalid pks "{pks}" for {label}: {e}')
+            if seeds.get(label, ()) is not None:
+                seeds[label] = set(seeds.get(label, ())) | set(values)
+        if options['masjid']:
+            masjids = set()
+            for value in options['masjid']:
+                try:
+                    uuid = str(UUID(value))
+                except ValueError:
+                    raise CommandError(f'Invalid masjid UUID "{value}"')
+                found = find(store, manifests, 'masjid.masjid', 'uuid', uuid)
+                if not found:
+                    raise CommandError(f'No masjid {uuid} in the backup')
+                masjids |= found
+            if seeds.get('masjid.masjid', ()) is not None:
+                seeds['masjid.masjid'] = set(seeds.get('masjid.masjid', ())) | masjids
+        if not seeds:
+            raise CommandError('Choose what to restore with --models, --pks or --masjid')
+        return seeds
+
+    def handle(self, *args, **options):
+        try:
+            store = backup_store(options['backup_dir'])
+            name = options['backup_file']
+            if not name:
+                backups = list_backups(store)
+                if not backups:
+                    raise CommandError('No backups found')
+                name = backups[-1][0]
+            manifests = chain_manifests(store, name)
+            seeds = self.seeds(store, manifests, options)
+            selected, required = select(replay(store, manifests), seeds, related=not options['no_related'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        except (ClientError, BotoCoreError, FileNotFoundError, ValueError) as e:
+            raise CommandError(f'Failed to read backup "{options["backup_file"] or "latest"}": {e}')
+
+        target = f'scratch schema "{options["schema"]}"' if options['schema'] else 'the live database'
+        self.stdout.write(self.style.SUCCESS(f'[{datetime.now()}] Restoring from backup {name} into {target}:'))
+        for label in sorted(set(selected) | set(required)):
+            if selected.get(label) or required.get(label):
+                self.stdout.write(
+                    f'  {label}: {len(selected.get(label, ()))} rows, {len(required.get(label, ()))} referenced rows'
+                )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No actual restore will be performed'))
+            return
+
+        if not options['force'] and not options['schema']:
+            self.stdout.write(self.style.WARNING(
+                'WARNING: The rows above will REPLACE the live rows with the same ids; '
+                'referenced rows are only added when missing.'
+            ))
+            confirm = input('Are you sure you want to continue? (yes/no): ')
+            if confirm.lower() not in ['yes', 'y']:
+                self.stdout.write(self.style.ERROR('Restore operation cancelled.'))
+                return
+
+        try:
+            rows = write_selection(store, manifests, selected, required, schema=options['schema'])
+        except (ClientError, BotoCoreError) as e:
+            raise CommandError(f'Failed to download backup: {e}')
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'[{datetime.now()}] Restored {rows} rows into {target}'))
@@ -0,0 +1,86 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from core import jobs
+
+POLL_INTERVAL = 1.0
+MAINTENANCE_INTERVAL = 300  # seconds between stale job recovery, pruning and periodic scheduling
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1,
+            help='Number of jobs claimed at once.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=POLL_INTERVAL,
+            help='Seconds to wait before polling again when the queue is empty.'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once no job is due instead of waiting for new ones.'
+        )
+
+    def handle(self, *args, **options):
+        # Register the tasks of every installed app (their tasks.py modules)
+        autodiscover_modules('tasks')
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.stdout.write(self.style.NOTICE(f"Worker {worker} started with {len(jobs.registry)} tasks."))
+        succeeded = failed = 0
+        last_maintenance = 0.0
+
+        # Keeps the jobs held by this worker from being requeued as stale while they run
+        with jobs.heartbeating(worker):
+            while not self.stopping:
+                close_old_connections()
+                if time.monotonic() - last_maintenance > MAINTENANCE_INTERVAL:
+                    recovered = jobs.recover_stale()
+                    if recovered:
+                        self.stdout.write(self.style.WARNING(f"Requeued {recovered} stale jobs."))
+                    jobs.prune()
+                    jobs.schedule_periodic()
+                    last_maintenance = time.monotonic()
+
+                claimed = jobs.claim(worker, options['batch_size'])
+                if not claimed:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                for index, job in enumerate(claimed):
+                    if self.stopping:
+                        jobs.release(claimed[index:])
+                        break
+                    started = time.monotonic()
+                    if jobs.execute(job):
+                        succeeded += 1
+                        self.stdout.write(self.style.SUCCESS(f"{job.name} #{job.pk} done in {time.monotonic() - started:.2f}s"))
+                    else:
+                        failed += 1
+                        self.stderr.write(self.style.ERROR(f"{job.name} #{job.pk} failed (attempt {job.attempts}/{job.max_attempts})"))
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} stopped: {succeeded} jobs done, {failed} failed."))
+
+    def stop(self, signum, frame):
+        # Finish the job in progress, then exit
+        self.stopping = True
@@ -1,11 +1,7 @@
 import json
-from datetime import datetime
 from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import Point
 from django.core.files.storage import default_storage
-from core.models import Address
-from prayertime.models import PrayerTime
-from django.db import transaction
+from prayertime.loaders import PrayerTimeLoader, resolve_location
 
 MAX_WORKERS = 10
 GOUVERNORAT = "sfax"
@@ -65,59 +61,25 @@ class Command(BaseCommand):
     def store_data(self, prayer_times_data):
         """
         Stores the merged prayer times data into the database.
+        Rows are upserted per city, so running the command twice does not create duplicates.
         """
-        with transaction.atomic():
-            for gov_name, cities in prayer_times_data.items():
-                for city_name, city_info in cities.items():
-                    latitude = float(city_info['latitude'])
-                    longitude = float(city_info['longitude'])
-                    coordinates = Point(longitude, latitude)  # Longitude first
-
-                    # Create a new Address entry every time (as requested)
-                    try:
-                        address = Address.objects.create(
-                            city=city_name,
-                            state=gov_name,
-                            country="Tunisia",
-                            coordinates=coordinates
-                        )
-                        self.stdout.write(self.style.SUCCESS(f"Created new address for {city_name}, {gov_name}."))
-                    except Exception as e:
-                        self.stderr.write(self.style.ERROR(f"Error creating Address for {city_name}, {gov_name}: {e}"))
-                        continue
-
-                    for prayer_time_entry in city_info['prayer_times']:
-                        try:
-                            date_str = prayer_time_entry['date']
-                            # Attempt parsing date with time
-                            try:
-                                date = datetime.strptime(date_str, "%Y-%m-%d %H:%M").date()
-                            except ValueError:
-                                # Fallback if no time is provided
-                                date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-                            fajr_time = datetime.strptime(prayer_time_entry['sobh'], "%H:%M").time()
-                            dhuhr_time = datetime.strptime(prayer_time_entry['dhohr'], "%H:%M").time()
-                            asr_time = datetime.strptime(prayer_time_entry['aser'], "%H:%M").time()
-                            maghrib_time = datetime.strptime(prayer_time_entry['magreb'], "%H:%M").time()
-                            isha_time = datetime.strptime(prayer_time_entry['isha'], "%H:%M").time()
-
-                            sunrise_time_str = prayer_time_entry.get('sunrise')
-                            sunrise_time = datetime.strptime(sunrise_time_str, "%H:%M").time() if sunrise_time_str else None
-
-                            PrayerTime.objects.create(
-                                location=address,
-                                date=date,
-                                fajr=fajr_time,
-                                sunrise=sunrise_time,
-                                dhuhr=dhuhr_time,
-                                asr=asr_time,
-                                maghrib=maghrib_time,
-                                isha=isha_time
-                            )
-
-                            self.stdout.write(self.style.SUCCESS(f"Created PrayerTime for {city_name} on {date}."))
-                        except ValueError as e:
-                            self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {e}"))
-                        except Exception as e:
-                            self.stderr.write(self.style.ERROR(f"Error saving PrayerTime for {city_name} on {date_str}: {e}"))
+        loader = PrayerTimeLoader()
+        for gov_name, cities in prayer_times_data.items():
+            for city_name, city_info in cities.items():
+                try:
+                    address = resolve_location(gov_name, city_name, city_info['latitude'], city_info['longitude'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Error resolving Address for {city_name}, {gov_name}: {e}"))
+                    continue
+
+                try:
+                    errors = loader.load(address, city_info['prayer_times'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Error saving PrayerTime for {city_name}, {gov_name}: {e}"))
+                    continue
+
+                for date_str, error in errors:
+                    self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {error}"))
+                self.stdout.write(self.style.SUCCESS(f"Stored prayer times for {city_name}, {gov_name}."))
+
+        self.stdout.write(self.style.SUCCESS(f"PrayerTime load: {loader.summary()}"))
@@ -1,15 +1,18 @@
 import json
 import os
-from datetime import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import Point
-from django.core.files.storage import default_storage
 from django.conf import settings
-from core.models import Address
-from prayertime.models import PrayerTime
-from django.db import transaction
+from core._helpers import open_storage_stream
+from core._json_stream import iter_array
+from core.seeds import batched
+from prayertime.loaders import PrayerTimeLoader, prefetch_locations, resolve_location
 
 MAX_WORKERS = 10
+QUEUED_BATCHES = 2  # per worker, parsed batches waiting for the database thread
 
 class Command(BaseCommand):
     help = "Fetch prayer times from block storage and store them directly into the database."
@@ -68,141 +71,121 @@ class Command(BaseCommand):
         if not governorate_city_pairs:
             self.stderr.write(self.style.ERROR("No governorate-city pairs provided. Use --governorate-city-pairs argument."))
             return
+
+        pairs = []
+        for pair in governorate_city_pairs:
+            # Split the pair into governorate and city
+            if '-' not in pair:
+                self.stderr.write(self.style.ERROR(f"Invalid format for pair '{pair}'. Expected format: 'Governorate-City'"))
+                continue
+            governorate, city = pair.split('-', 1)  # Split only on first dash
+            pairs.append((governorate.strip(), city.strip()))
+        pairs = list(dict.fromkeys(pairs))
         
         # Load coordinates data
         coordinates_data = self.load_coordinates_data()
         if not coordinates_data:
             self.stderr.write(self.style.WARNING("Could not load coordinates data. Addresses will be created without coordinates."))
         
-        self.stdout.write(self.style.NOTICE(f"Processing {len(governorate_city_pairs)} governorate-city pairs..."))
-        
-        for pair in governorate_city_pairs:
+        self.stdout.write(self.style.NOTICE(f"Processing {len(pairs)} governorate-city pairs with {max_workers} workers..."))
+        self.loader = PrayerTimeLoader()
+        # Addresses already holding prayer times, resolved once for every pair
+        self.locations = prefetch_locations(pairs)
+        self.coordinates_data = coordinates_data
+
+        # Files are downloaded and parsed in full by the workers, which hand the parsed
+        # batches to this thread through a bounded queue; only this thread writes
+        results = queue.Queue(maxsize=max_workers * QUEUED_BATCHES)
+        abandoned = threading.Event()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for pair in pairs:
+                executor.submit(self.read_prayer_times, pair, results, abandoned)
             try:
-                # Split the pair into governorate and city
-                if '-' not in pair:
-                    self.stderr.write(self.style.ERROR(f"Invalid format for pair '{pair}'. Expected format: 'Governorate-City'"))
-                    continue
-                
-                governorate, city = pair.split('-', 1)  # Split only on first dash
-                governorate = governorate.strip()
-                city = city.strip()
-                
-                # Create safe filename
-                safe_governorate = "".join(c for c in governorate if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                safe_city = "".join(c for c in city if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                filename = f"prayer-times-{safe_governorate}-{safe_city}.json"
-                
-                self.stdout.write(self.style.NOTICE(f"Processing {governorate} - {city}..."))
-                
-                # Get prayer times data from file
-                prayer_times_data = self.get_file_as_dict(filename)
-                
-                # Find coordinates for this governorate-city pair
-                latitude, longitude = self.find_coordinates(governorate, city, coordinates_data)
-                
-                # Store data in database
-                self.store_data(prayer_times_data, governorate, city, latitude, longitude)
-                
-                self.stdout.write(self.style.SUCCESS(f"Successfully processed {governorate} - {city}"))
-                
-            except FileNotFoundError as e:
-                self.stderr.write(self.style.ERROR(f"File not found for {pair}: {e}"))
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Error processing {pair}: {e}"))
-        
+                self.store_results(results, len(pairs))
+            finally:
+                abandoned.set()
+                executor.shutdown(cancel_futures=True)
+
+        self.stdout.write(self.style.SUCCESS(f"PrayerTime load: {self.loader.summary()}"))
         self.stdout.write(self.style.SUCCESS("All governorate-city pairs have been processed."))
+
+    @staticmethod
+    def filename_for(governorate, city):
+        """Name of the file written by fetch_and_push_to_s3_prayer_times_from_file."""
+        safe_governorate = "".join(c for c in governorate if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        safe_city = "".join(c for c in city if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        return f"prayer-times-{safe_governorate}-{safe_city}.json"
     
-    def get_file_as_dict(self, file_path):
+    def read_prayer_times(self, pair, results, abandoned):
         """
-        Retrieve a file from block storage and load it as a dictionary.
-
-        :param file_path: Path of the file in block storage.
-        :return: A dictionary containing the data from the file.
-        :raises: FileNotFoundError if the file does not exist, ValueError for invalid JSON.
+        Runs in a worker: retrieves the file of `pair` from block storage with a single GET,
+        parses its "prayer_times" entries while the body is read, closes the stream, then
+        puts (pair, batch) on `results` for each batch of entries and (pair, None) once done,
+        or (pair, error) if the file is missing or invalid. Gives up once `abandoned` is set.
         """
+        if abandoned.is_set():
+            return
+        file_path = self.filename_for(*pair)
         try:
-            # Check if the file exists in storage
-            if not default_storage.exists(file_path):
-                raise FileNotFoundError(f"File '{file_path}' does not exist in block storage.")
-
-            # Open the file and read its content
-            with default_storage.open(file_path, 'r') as file:
-                content = file.read()
-
-            # Parse JSON content into a dictionary
-            data_dict = json.loads(content)
-            return data_dict
-
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON content in file '{file_path}': {str(e)}")
+            with closing(open_storage_stream(file_path)) as stream:
+                try:
+                    items = [*batched(iter_array(stream, 'prayer_times'), self.loader.batch_size), None]
+                except ValueError as e:
+                    raise ValueError(f"Invalid JSON content in file '{file_path}': {str(e)}")
         except Exception as e:
-            raise RuntimeError(f"An error occurred while retrieving the file: {str(e)}")
+            items = [e]
+        for item in items:
+            while True:
+                if abandoned.is_set():
+                    return
+                try:
+                    results.put((pair, item), timeout=1)
+                    break
+                except queue.Full:
+                    pass
+
+    def store_results(self, results, pending):
+        """Writes the batches put on `results` by the workers until `pending` files are done."""
+        failed = set()
+        loaded = set()
+        while pending:
+            (governorate, city), item = results.get()
+            if isinstance(item, FileNotFoundError):
+                self.stderr.write(self.style.ERROR(f"File not found for {governorate}-{city}: {item}"))
+            elif isinstance(item, Exception):
+                self.stderr.write(self.style.ERROR(f"Error processing {governorate}-{city}: {item}"))
+            elif item is None:
+                if (governorate, city) not in loaded:
+                    self.stderr.write(self.style.WARNING(f"No prayer times found in data for {city}, {governorate}"))
+                elif (governorate, city) not in failed:
+                    self.stdout.write(self.style.SUCCESS(f"Successfully processed {governorate} - {city}"))
+            else:
+                loaded.add((governorate, city))
+                if (governorate, city) not in failed and not self.store_data(item, governorate, city):
+                    failed.add((governorate, city))
+                continue
+            pending -= 1
 
-    def store_data(self, prayer_times_data, governorate_name, city_name, latitude=None, longitude=None):
+    def store_data(self, prayer_times, governorate_name, city_name):
         """
-        Stores the prayer times data into the database.
-        Expected format: {"prayer_times": [{"date": "...", "sobh": "...", ...}, ...]}
+        Stores a batch of prayer times entries into the database, reusing the pair's Address.
+        Expected entries: {"date": "...", "sobh": "...", ...}. Returns False on failure.
         """
-        with transaction.atomic():
-            # Create coordinates if available
-            coordinates = None
-            if latitude is not None and longitude is not None:
-                coordinates = Point(longitude, latitude)  # Longitude first for Point
-                self.stdout.write(self.style.SUCCESS(f"Found coordinates for {city_name}, {governorate_name}: {latitude}, {longitude}"))
-            else:
-                self.stdout.write(self.style.WARNING(f"No coordinates found for {city_name}, {governorate_name}"))
-            
-            # Create a new Address entry
+        address = self.locations.get((governorate_name, city_name))
+        if address is None:
+            latitude, longitude = self.find_coordinates(governorate_name, city_name, self.coordinates_data)
             try:
-                address = Address.objects.create(
-                    city=city_name,
-                    state=governorate_name,
-                    country="Tunisia",
-                    coordinates=coordinates
-                )
-                self.stdout.write(self.style.SUCCESS(f"Created new address for {city_name}, {governorate_name}."))
+                address = resolve_location(governorate_name, city_name, latitude, longitude, rename=True)
             except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Error creating Address for {city_name}, {governorate_name}: {e}"))
-                return
-
-            # Process prayer times
-            prayer_times_list = prayer_times_data.get('prayer_times', [])
-            if not prayer_times_list:
-                self.stderr.write(self.style.WARNING(f"No prayer times found in data for {city_name}, {governorate_name}"))
-                return
-
-            for prayer_time_entry in prayer_times_list:
-                try:
-                    date_str = prayer_time_entry['date']
-                    # Attempt parsing date with time
-                    try:
-                        date = datetime.strptime(date_str, "%Y-%m-%d %H:%M").date()
-                    except ValueError:
-                        # Fallback if no time is provided
-                        date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-                    fajr_time = datetime.strptime(prayer_time_entry['sobh'], "%H:%M").time()
-                    dhuhr_time = datetime.strptime(prayer_time_entry['dhohr'], "%H:%M").time()
-                    asr_time = datetime.strptime(prayer_time_entry['aser'], "%H:%M").time()
-                    maghrib_time = datetime.strptime(prayer_time_entry['magreb'], "%H:%M").time()
-                    isha_time = datetime.strptime(prayer_time_entry['isha'], "%H:%M").time()
-
-                    sunrise_time_str = prayer_time_entry.get('sunrise')
-                    sunrise_time = datetime.strptime(sunrise_time_str, "%H:%M").time() if sunrise_time_str else None
-
-                    PrayerTime.objects.create(
-                        location=address,
-                        date=date,
-                        fajr=fajr_time,
-                        sunrise=sunrise_time,
-                        dhuhr=dhuhr_time,
-                        asr=asr_time,
-                        maghrib=maghrib_time,
-                        isha=isha_time
-                    )
+                self.stderr.write(self.style.ERROR(f"Error resolving Address for {city_name}, {governorate_name}: {e}"))
+                return False
+            self.locations[(governorate_name, city_name)] = address
 
-                    self.stdout.write(self.style.SUCCESS(f"Created PrayerTime for {city_name} on {date}."))
-                except ValueError as e:
-                    self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {e}"))
-                except Exception as e:
-                    self.stderr.write(self.style.ERROR(f"Error saving PrayerTime for {city_name} on {date_str}: {e}"))
+        try:
+            errors = self.loader.load(address, prayer_times)
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error processing {governorate_name}-{city_name}: {e}"))
+            return False
+        for date_str, error in errors:
+            self.stderr.write(self.style.ERROR(f"Date/time parsing error for {city_name} on {date_str}: {error}"))
+        return True
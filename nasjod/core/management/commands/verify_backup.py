@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backups import backup_store, list_backups
+from core.verify import verify
+
+
+class Command(BaseCommand):
+    help = (
+        'Check a backup and its chain without restoring it: chunk checksums, row counts and pk bounds, '
+        'and that every foreign key points to a row of the backup'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backup-file',
+            type=str,
+            help='Backup to check (e.g., app_20241217_143022). If not specified, checks the latest backup.',
+        )
+        parser.add_argument(
+            '--backup-dir',
+            type=str,
+            help='Check a backup of this local directory instead of the R2 bucket',
+        )
+        parser.add_argument(
+            '--max-dangling',
+            type=int,
+            default=20,
+            help='Dangling foreign keys listed per model and field (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            store = backup_store(options['backup_dir'])
+            name = options['backup_file']
+            if not name:
+                backups = list_backups(store)
+                if not backups:
+                    raise CommandError('No backups found')
+                name = backups[-1][0]
+            self.stdout.write(f'[{datetime.now()}] Verifying backup {name}...')
+            result = verify(store, name, max_dangling=options['max_dangling'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        except (ClientError, BotoCoreError, FileNotFoundError) as e:
+            raise CommandError(f'Backup "{options["backup_file"] or "latest"}" or its chain is incomplete: {e}')
+
+        self.stdout.write(
+            f'  {" + ".join(result.backups)}: {result.rows} rows after replay, {result.chunks} chunks'
+        )
+        for issue in result.issues:
+            self.stdout.write(self.style.ERROR(f'  {issue.backup} {issue.model}: {issue.message}'))
+        if result.issues:
+            raise CommandError(f'Backup {name} failed verification with {len(result.issues)} issues')
+        self.stdout.write(self.style.SUCCESS(f'[{datetime.now()}] Backup {name} verified'))
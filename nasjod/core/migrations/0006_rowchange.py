@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-19 15:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RowChange",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("table_name", models.CharField(max_length=63)),
+                ("row_id", models.CharField(max_length=255)),
+                (
+                    "op",
+                    models.CharField(
+                        choices=[("I", "Insert"), ("U", "Update"), ("D", "Delete")], max_length=1
+                    ),
+                ),
+                ("changed_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["table_name", "changed_at"], name="rowchange_table_changed_idx"),
+                ],
+            },
+        ),
+    ]
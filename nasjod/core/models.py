@@ -1,6 +1,7 @@
 import uuid
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.gis.db import models as geomodels
 
 
@@ -49,3 +50,111 @@ class ObjectBase(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by the `run_worker` command (see core/jobs.py).
+    Queued jobs with the same dedup_key are collapsed into one.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.SmallIntegerField(default=0)  # Higher runs first
+    dedup_key = models.CharField(max_length=255, blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-priority', 'run_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_queued_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status='queued'),
+                name='unique_queued_job_dedup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class Checkpoint(models.Model):
+    """
+    How far a long management command got through one input (a file, a date range...),
+    so that a rerun on the same input resumes there (see core/commands.py).
+    """
+    command = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    position = models.JSONField(default=dict, blank=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['command', 'key'], name='unique_checkpoint_per_input'),
+        ]
+
+    def __str__(self):
+        return f"{self.command} {self.key}"
+
+    def advance(self, **position):
+        """Records `position`. Call it in the transaction writing the work it covers."""
+        self.position.update(position)
+        self.save(update_fields=['position', 'updated_at'])
+
+    def complete(self):
+        self.completed_at = timezone.now()
+        self.save(update_fields=['completed_at', 'updated_at'])
+
+
+class RowChange(models.Model):
+    """
+    A row inserted, updated or deleted, recorded by the change tracking triggers (see
+    core/changes.py) for the incremental backups.
+    """
+    INSERT = 'I'
+    UPDATE = 'U'
+    DELETE = 'D'
+    OP_CHOICES = (
+        (INSERT, 'Insert'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    )
+
+    table_name = models.CharField(max_length=63)
+    row_id = models.CharField(max_length=255)
+    op = models.CharField(max_length=1, choices=OP_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['table_name', 'changed_at'], name='rowchange_table_changed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.op} {self.table_name} #{self.row_id}"
@@ -0,0 +1,42 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class DownloadRenderer(BaseRenderer):
+    """
+    Renderer of a body the view builds itself (iCalendar feed, CSV export, binary pack...),
+    returned as an HttpResponse or StreamingHttpResponse. It takes part in the content
+    negotiation and the schema; the error responses (throttled, invalid parameters...)
+    it is given are rendered as JSON.
+    """
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class ICalendarRenderer(DownloadRenderer):
+    media_type = 'text/calendar'
+    format = 'ics'
+
+
+class CSVRenderer(DownloadRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(DownloadRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class TimetablePackRenderer(DownloadRenderer):
+    media_type = 'application/vnd.nasjod.timetable'
+    format = 'njtp'
+
+
+class TimetableDeltaRenderer(DownloadRenderer):
+    media_type = 'application/vnd.nasjod.timetable-delta'
+    format = 'njtd'
@@ -0,0 +1,334 @@
+"""
+Restores the backups written by core/backups.py.
+
+Restoring a backup replays its chain: the full backup is loaded into emptied tables,
+then each incremental deletes its tombstones and replaces the rows it holds. The read
+models left out of the backups (EXCLUDED_MODELS) that reference the restored tables
+are emptied with them, for the caller to rebuild. Rows are
+streamed chunk by chunk and inserted with bulk_create in batches, so Model.save(),
+clean() and the signals do not run, auto_now timestamps keep their backed up values,
+and the change tracking triggers are off for the restoring connections.
+
+The full backup is loaded by dependency level: the models of a level only reference
+models of earlier levels, so they are loaded in parallel threads, each on its own
+connection, one transaction per model (the deferred foreign keys are checked at its
+commit). The chain is verified (core/verify.py) before any table is emptied; a restore
+failing after that leaves the tables partly loaded and running it again starts
+over. Incrementals are small and applied one transaction each. Finally the id
+sequences are moved past the restored ids.
+
+A selective restore (restore_selection) writes only some rows, with the rows related
+to them (see core/verify.py), in one transaction: into the live tables, replacing
+the rows with the same pks, or into empty copies of the tables in a scratch schema
+to look at them before copying anything back.
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+from django.apps import apps
+from django.core.serializers.python import Deserializer
+from django.db import connection, connections, transaction
+
+from . import changes
+from .backups import chain_manifests, dependency_order, excluded_models, iter_chunks
+from .seeds import batched, reset_sequences
+from .verify import replay, select, verify
+
+BATCH_SIZE = 1000
+WORKERS = 4
+
+SCHEMA_NAME = re.compile(r'^[a-z_][a-z0-9_]{0,62}$')
+
+RestoreResult = namedtuple('RestoreResult', ['backups', 'rows', 'deleted'])
+SelectionResult = namedtuple('SelectionResult', ['backups', 'rows'])
+
+
+def dependency_levels(models):
+    """`models` grouped in levels whose models only reference models of earlier levels."""
+    models = dependency_order(models)
+    levels, level_of = [], {}
+    for model in models:
+        level = 1 + max((
+            level_of[field.related_model] for field in model._meta.concrete_fields
+            if field.is_relation and field.related_model in level_of and field.related_model is not model
+        ), default=-1)
+        level_of[model] = level
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(model)
+    return levels
+
+
+@contextmanager
+def preserved_timestamps(models, touch=False):
+    """
+    Stops the auto_now and auto_now_add fields of `models` from overwriting the restored
+    values. With `touch`, auto_now fields still get the current time.
+    """
+    fields = [
+        (field, field.auto_now, field.auto_now_add) for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    for field, auto_now, _ in fields:
+        field.auto_now = auto_now and touch
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def truncate(models):
+    """Empties the tables of `models`, which must include every model referencing them."""
+    tables = ', '.join(_quote(model._meta.db_table) for model in models)
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {tables}')
+
+
+def referencing_excluded(models):
+    """The models left out of the backups with a foreign key to one of `models`."""
+    return [
+        model for model in excluded_models()
+        if any(field.related_model in models for field in model._meta.concrete_fields if field.is_relation)
+    ]
+
+
+def unchecked_references(model):
+    """Foreign keys to `model` the database does not check (db_constraint=False)."""
+    return [
+        rel.field for rel in model._meta.get_fields(include_hidden=True)
+        if rel.one_to_many and rel.auto_created and not rel.concrete and not rel.field.db_constraint
+    ]
+
+
+def delete_rows(model, pks, cascade=False):
+    """
+    Deletes the rows of `model` with `pks` in SQL: nothing cascades, rows referencing them
+    must be deleted or restored in the same transaction. With `cascade`, the rows
+    referencing them through a foreign key the database does not check (the masjid
+    links of the partitioned PrayerTime) are deleted first, as nothing would catch them.
+    """
+    pk = model._meta.pk
+    values = [pk.get_db_prep_value(value, connection) for value in pks]
+    with connection.cursor() as cursor:
+        for field in unchecked_references(model) if cascade else ():
+            cursor.execute(
+                f'DELETE FROM {_quote(field.model._meta.db_table)} WHERE {_quote(field.column)} = ANY(%s)',
+                [values],
+            )
+        cursor.execute(
+            f'DELETE FROM {_quote(model._meta.db_table)} WHERE {_quote(pk.column)} = ANY(%s)', [values],
+        )
+
+
+def load_rows(model, rows, replace=False, batch_size=BATCH_SIZE):
+    """Inserts `rows` (python serializer format) into `model` in batches, replacing existing pks with `replace`."""
+    count = 0
+    objects = (item.object for item in Deserializer(rows, ignorenonexistent=True))
+    for batch in batched(objects, batch_size):
+        if replace:
+            delete_rows(model, [obj.pk for obj in batch])
+        model._base_manager.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+class _Restore:
+    def __init__(self, store, workers, batch_size, progress):
+        self.store = store
+        self.workers = workers
+        self.batch_size = batch_size
+        self.progress = progress
+        self.lock = threading.Lock()
+
+    def _advance(self, count):
+        if self.progress is not None:
+            with self.lock:
+                self.progress(count)
+
+    def load_model(self, manifest, model):
+        count = 0
+        with changes.untracked(), transaction.atomic():
+            for _, _, rows in iter_chunks(self.store, manifest, models={model._meta.label_lower}):
+                loaded = load_rows(model, rows, batch_size=self.batch_size)
+                count += loaded
+                self._advance(loaded)
+        return count
+
+    def _load_in_thread(self, manifest, model):
+        try:
+            return self.load_model(manifest, model)
+        finally:
+            connections.close_all()
+
+    def load_full(self, manifest, models):
+        with changes.untracked():
+            truncate(models + referencing_excluded(models))
+        count = 0
+        for level in dependency_levels(models):
+            if self.workers > 1 and len(level) > 1:
+                with ThreadPoolExecutor(min(self.workers, len(level))) as executor:
+                    count += sum(executor.map(lambda model: self._load_in_thread(manifest, model), level))
+            else:
+                count += sum(self.load_model(manifest, model) for model in level)
+        return count
+
+    def apply_incremental(self, manifest):
+        models = {entry['model']: apps.get_model(entry['model']) for entry in manifest['models']}
+        count = deleted = 0
+        with changes.untracked(), transaction.atomic():
+            # Tombstones of the rows referencing others come first
+            for entry in reversed(manifest['models']):
+                if entry.get('deleted'):
+                    delete_rows(models[entry['model']], entry['deleted'], cascade=True)
+                    deleted += len(entry['deleted'])
+            for entry in manifest['models']:
+                model = models[entry['model']]
+                for _, _, rows in iter_chunks(self.store, manifest, models={entry['model']}):
+                    loaded = load_rows(model, rows, replace=True, batch_size=self.batch_size)
+                    count += loaded
+                    self._advance(loaded)
+        return count, deleted
+
+
+class BackupVerificationError(Exception):
+    """Raised instead of restoring a backup that fails verification. Nothing was written."""
+
+    def __init__(self, name, issues):
+        self.issues = issues
+        super().__init__(f"Backup {name} failed verification with {len(issues)} issues")
+
+
+class PartialRestoreError(Exception):
+    """Raised when a restore fails after emptying the tables, leaving them partly loaded."""
+
+
+def restore_rows(manifests):
+    """The number of rows the restore of `manifests` writes."""
+    return sum(manifest['rows'] for manifest in manifests)
+
+
+def restore(store, name, workers=WORKERS, batch_size=BATCH_SIZE, progress=None):
+    """
+    Restores the backup `name` of `store` over the database: the chain of the backup is
+    verified, then its tables are emptied and the chain replayed. `progress(rows)` is
+    called after each chunk. Raises BackupVerificationError, with the database untouched,
+    when the chain is not sound, and PartialRestoreError when the restore fails later.
+    """
+    issues = verify(store, name).issues
+    if issues:
+        raise BackupVerificationError(name, issues)
+    manifests = chain_manifests(store, name)
+    models = [apps.get_model(entry['model']) for entry in manifests[0]['models']]
+    engine = _Restore(store, workers, batch_size, progress)
+    rows = deleted = 0
+    try:
+        with preserved_timestamps(models):
+            rows += engine.load_full(manifests[0], models)
+            for manifest in manifests[1:]:
+                written, removed = engine.apply_incremental(manifest)
+                rows += written
+                deleted += removed
+        reset_sequences(*models)
+    except Exception as e:
+        raise PartialRestoreError(f"Restoring {name} failed, the database is now partially restored: {e}") from e
+    return RestoreResult([manifest['name'] for manifest in manifests], rows, deleted)
+
+
+@contextmanager
+def scratch_schema(schema, models):
+    """
+    Creates empty copies of the tables of `models` in `schema`, without foreign keys nor
+    triggers, and puts `schema` first in the search_path of this connection meanwhile.
+    """
+    if not SCHEMA_NAME.match(schema):
+        raise ValueError(f"Invalid schema name: {schema}")
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT current_schema()")
+        source = cursor.fetchone()[0]
+        if schema == source:
+            raise ValueError(f"The scratch schema cannot be the schema of the database ({source})")
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {_quote(schema)}')
+        for model in models:
+            table = _quote(model._meta.db_table)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {_quote(schema)}.{table} (LIKE {_quote(source)}.{table} INCLUDING ALL)'
+            )
+        cursor.execute(f'SET search_path TO {_quote(schema)}, {_quote(source)}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("RESET search_path")
+
+
+def _spans(pks):
+    """Whether a chunk may hold one of `pks`, going by its pk bounds."""
+    ordered = sorted(pks)
+
+    def wanted(label, chunk):
+        index = bisect_left(ordered, chunk['first_pk'])
+        return index < len(ordered) and ordered[index] <= chunk['last_pk']
+    return wanted
+
+
+def _missing(model, pks):
+    """The `pks` (as serialized) without a row in the live table of `model`."""
+    pk_field = model._meta.pk
+    values = {pk_field.to_python(pk): pk for pk in pks}
+    existing = set(model._base_manager.filter(pk__in=list(values)).values_list('pk', flat=True))
+    return {pk for value, pk in values.items() if value not in existing}
+
+
+def write_selection(store, manifests, selected, required, schema=None, batch_size=BATCH_SIZE):
+    """
+    Writes the `selected` and `required` rows ({label: pks}, see core.verify.select) of
+    the chain `manifests`, as of its last backup, in one transaction.
+
+    Without `schema`, they are written over the live tables: the selected rows replace the
+    rows with the same pks, the required rows are only added when missing. The restored
+    rows keep their created_at but get a new updated_at and go through the change tracking,
+    so the next incremental backup holds them. With `schema`, all the rows are written to
+    copies of the tables in that schema, as they were backed up. Returns the rows written.
+    """
+    labels = [label for label in {**selected, **required} if selected.get(label) or required.get(label)]
+    models = {label: apps.get_model(label) for label in labels}
+    rows = 0
+    with preserved_timestamps(models.values(), touch=schema is None), \
+            (scratch_schema(schema, models.values()) if schema else nullcontext()), transaction.atomic():
+        writes = {}
+        for label, model in models.items():
+            references = required.get(label, set())
+            writes[label] = selected.get(label, set()) | (references if schema else _missing(model, references))
+        for manifest in manifests:
+            for entry in manifest['models']:
+                pks = writes.get(entry['model'])
+                if not pks:
+                    continue
+                for _, _, chunk_rows in iter_chunks(store, manifest, {entry['model']}, wanted=_spans(pks)):
+                    wanted_rows = [row for row in chunk_rows if row['pk'] in pks]
+                    rows += load_rows(models[entry['model']], wanted_rows, replace=True, batch_size=batch_size)
+        if schema is None:
+            reset_sequences(*models.values())
+    return rows
+
+
+def restore_selection(store, name, seeds, related=True, schema=None, batch_size=BATCH_SIZE):
+    """
+    Restores the rows `seeds` ({label: pks, or None for all}) of the backup `name`, with
+    the rows cascading from them when `related` and the rows they reference, into the live
+    tables or the scratch `schema` (see write_selection).
+    """
+    manifests = chain_manifests(store, name)
+    selected, required = select(replay(store, manifests), seeds, related)
+    rows = write_selection(store, manifests, selected, required, schema=schema, batch_size=batch_size)
+    return SelectionResult([manifest['name'] for manifest in manifests], rows)
@@ -0,0 +1,70 @@
+"""
+Streaming loaders of the fixture files (dumpdata format) seeding the database, such as
+address.json and masjid.json.
+
+Entries are read one at a time with core._json_stream.iter_array and upserted by primary
+key in batches of INSERT ... ON CONFLICT (id) DO UPDATE, so a seed of any size is
+loaded in constant memory and a few queries per batch. Model.save(), clean() and the
+signals are skipped: callers check the loaded rows set-based once everything is in,
+then reset_sequences() moves the id sequences past the pks of the fixture.
+"""
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.core.serializers.python import Deserializer
+from django.db import connection
+
+from ._json_stream import iter_array
+
+BATCH_SIZE = 1000
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert_fields(model):
+    """Fields written over existing rows: all but the pk, uuid and creation date."""
+    return [
+        field.name for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in ('uuid', 'created_at')
+    ]
+
+
+def load_fixture(fileobj, model, prepare=None, batch_size=BATCH_SIZE):
+    """
+    Upserts by pk the `model` entries of the fixture `fileobj`, other models being skipped.
+    `prepare(entries)` receives each batch of entries and returns the ones to load,
+    possibly edited. Many-to-many values are added to the existing links.
+    Returns the pks loaded.
+    """
+    label = model._meta.label_lower
+    fields = upsert_fields(model)
+    loaded = []
+    entries = (entry for entry in iter_array(fileobj) if entry.get('model') == label)
+    for batch in batched(entries, batch_size):
+        if prepare is not None:
+            batch = prepare(batch)
+        deserialized = list(Deserializer(batch, ignorenonexistent=True))
+        model.objects.bulk_create(
+            [item.object for item in deserialized],
+            update_conflicts=True, unique_fields=['id'], update_fields=fields,
+        )
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+            through.objects.bulk_create([
+                through(**{source: item.object.pk, target: pk})
+                for item in deserialized for pk in item.m2m_data.get(field.name, [])
+            ], ignore_conflicts=True)
+        loaded.extend(item.object.pk for item in deserialized)
+    return loaded
+
+
+def reset_sequences(*models):
+    """Sets the id sequences of `models` past their highest id, as loaddata does."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
@@ -0,0 +1,17 @@
+"""
+Keeps the change tracking triggers of the incremental backups (core/changes.py) in
+place on every table after each migrate.
+"""
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from . import changes
+from .backups import backup_models, excluded_models
+
+
+@receiver(post_migrate)
+def install_change_tracking(sender, **kwargs):
+    # post_migrate is sent once per app; the triggers only need installing once
+    if sender.name == 'core':
+        changes.install(backup_models())
+        changes.uninstall(excluded_models())
@@ -0,0 +1 @@
+from core.tests.fixtures import address, manager_user  # noqa: F401
@@ -0,0 +1,161 @@
+import gzip
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from masjid.models import Masjid
+from ..backups import (
+    EXCLUDED_MODELS, LocalStore, backup_models, chain_manifests, decode_chunk, dependency_order, excluded_models,
+    incremental_parent, iter_chunks, list_backups, prune_chains, read_manifest, write_backup,
+)
+from ..models import Address, Checkpoint, RowChange
+
+
+def add_address(city):
+    return Address.objects.create(city=city, country="tunisia", coordinates="POINT (10 34)")
+
+
+def test_dependency_order_puts_referenced_models_first():
+    ordered = backup_models()
+
+    assert ordered.index(Address) < ordered.index(Masjid)
+    assert ordered.index(Masjid) < ordered.index(Masjid.managers.through)
+    assert dependency_order([Masjid, Address]) == [Address, Masjid]
+
+
+def test_backup_models_leave_out_the_job_queue_checkpoints_and_read_models():
+    assert not {model._meta.label for model in backup_models()} & EXCLUDED_MODELS
+    assert {model._meta.label for model in excluded_models()} == EXCLUDED_MODELS
+
+
+def test_decode_chunk_rejects_a_corrupted_chunk():
+    data = gzip.compress(b'{"pk": 1}\n', mtime=0)
+
+    assert decode_chunk(data) == [{'pk': 1}]
+    with pytest.raises(ValueError):
+        decode_chunk(data, sha256='0' * 64)
+
+
+@pytest.mark.django_db
+def test_write_backup_streams_chunks_and_writes_the_manifest_last(tmp_path, address, manager_user):
+    for number in range(4):
+        add_address(f"city {number}")
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    masjid.managers.add(manager_user)
+    store = LocalStore(tmp_path)
+    reported = []
+
+    manifest = write_backup(store, 'nasjod_1', models=[Masjid, Address, Masjid.managers.through],
+                            chunk_rows=2, progress=reported.append)
+
+    assert [entry['model'] for entry in manifest['models']] == [
+        'core.address', 'masjid.masjid', 'masjid.masjid_managers',
+    ]
+    addresses = manifest['models'][0]
+    assert addresses['rows'] == Address.objects.count() == 5
+    assert [chunk['rows'] for chunk in addresses['chunks']] == [2, 2, 1]
+    assert sum(reported) == manifest['rows'] == 7
+    assert read_manifest(store, 'nasjod_1') == json.loads(json.dumps(manifest))
+    assert [name for name, _ in list_backups(store)] == ['nasjod_1']
+
+    rows = {label: rows for label, _, rows in iter_chunks(store, manifest, models={'masjid.masjid'})}
+    assert rows['masjid.masjid'][0]['fields']['name'] == "Kasbah Mosque"
+    assert rows['masjid.masjid'][0]['fields']['address'] == address.pk
+    assert 'managers' not in rows['masjid.masjid'][0]['fields']
+    # The concatenated chunks are a plain gzip file of NDJSON
+    lines = gzip.decompress((tmp_path / 'nasjod_1' / 'data.ndjson.gz').read_bytes()).splitlines()
+    assert len(lines) == 7
+
+
+@pytest.mark.django_db
+def test_incremental_backup_holds_the_changes_and_tombstones_since_its_parent(tmp_path, address):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    gone = add_address("gone")
+    store = LocalStore(tmp_path)
+    full = write_backup(store, 'nasjod_1', models=[Address, Masjid])
+    # Make everything written so far older than the full backup
+    long_ago = timezone.now() - timedelta(days=1)
+    RowChange.objects.update(changed_at=long_ago)
+    Masjid.objects.update(updated_at=long_ago)
+
+    masjid.name = "Kasbah Great Mosque"
+    masjid.save()
+    added = add_address("new")
+    gone_pk = gone.pk
+    gone.delete()
+
+    parent = incremental_parent(store)
+    assert parent == full
+    manifest = write_backup(store, 'nasjod_2', models=[Address, Masjid], parent=parent)
+
+    entries = {entry['model']: entry for entry in manifest['models']}
+    rows = {label: [row['pk'] for row in rows] for label, _, rows in iter_chunks(store, manifest)}
+    assert manifest['kind'] == 'incremental' and manifest['parent'] == manifest['base'] == 'nasjod_1'
+    assert rows == {'core.address': [added.pk], 'masjid.masjid': [masjid.pk]}
+    assert entries['core.address']['deleted'] == [gone_pk]
+    assert entries['masjid.masjid']['deleted'] == []
+    assert [backup['name'] for backup in chain_manifests(store, 'nasjod_2')] == ['nasjod_1', 'nasjod_2']
+    assert incremental_parent(store, max_length=2) is None
+
+
+@pytest.mark.django_db
+def test_incremental_backup_holds_the_rows_set_null_by_a_deletion(tmp_path, address):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1', models=[Address, Masjid])
+    long_ago = timezone.now() - timedelta(days=1)
+    RowChange.objects.update(changed_at=long_ago)
+    Masjid.objects.update(updated_at=long_ago)
+
+    # on_delete=SET_NULL: an UPDATE of masjid_masjid that leaves its updated_at alone
+    address.delete()
+
+    manifest = write_backup(store, 'nasjod_2', models=[Address, Masjid], parent=incremental_parent(store))
+    rows = {label: rows for label, _, rows in iter_chunks(store, manifest)}
+    [row] = rows['masjid.masjid']
+    assert row['pk'] == masjid.pk and row['fields']['address'] is None
+
+
+@pytest.mark.django_db
+def test_prune_chains_keeps_the_newest_chains_and_the_changes_they_need(tmp_path, address):
+    store = LocalStore(tmp_path)
+    first = write_backup(store, 'nasjod_1', models=[Address])
+    write_backup(store, 'nasjod_2', models=[Address], parent=first)
+    write_backup(store, 'nasjod_3', models=[Address])
+    RowChange.objects.create(table_name='core_address', row_id='1', op=RowChange.DELETE,
+                             changed_at=timezone.now() - timedelta(days=1))
+
+    assert prune_chains(store, keep=1) == ['nasjod_1', 'nasjod_2']
+    assert [name for name, _ in list_backups(store)] == ['nasjod_3']
+    assert not (tmp_path / 'chains' / 'nasjod_1.json').exists()
+    assert not RowChange.objects.filter(row_id='1').exists()
+
+
+@pytest.mark.django_db
+def test_backup_command_discards_the_upload_of_an_interrupted_run(tmp_path, address):
+    partial = tmp_path / 'nasjod_0' / 'data.ndjson.gz.part'
+    partial.parent.mkdir()
+    partial.write_bytes(b'interrupted')
+    Checkpoint.objects.create(
+        command='backup_db_to_r2', key=f'dir:{tmp_path}', position={'backup': 'nasjod_0', 'upload_id': None},
+    )
+
+    call_command('backup_db_to_r2', output_dir=str(tmp_path))
+
+    assert not partial.exists()
+    [(name, _)] = list_backups(LocalStore(tmp_path))
+    checkpoint = Checkpoint.objects.get(command='backup_db_to_r2')
+    assert checkpoint.completed_at is not None and checkpoint.position['backup'] == name
+
+
+@pytest.mark.django_db
+def test_backup_command_prunes_the_changes_older_than_the_backup(tmp_path, address):
+    RowChange.objects.create(table_name='core_address', row_id='1', op=RowChange.DELETE,
+                             changed_at=timezone.now() - timedelta(days=1))
+
+    call_command('backup_db_to_r2', output_dir=str(tmp_path))
+
+    assert not RowChange.objects.filter(row_id='1').exists()
@@ -0,0 +1,54 @@
+import pytest
+
+from ..commands import CheckpointedCommand, Progress, advisory_lock, file_key
+from ..models import Checkpoint
+
+
+class Command(CheckpointedCommand):
+    def run(self, *args, **options):
+        checkpoint = self.checkpoint('input')
+        checkpoint.advance(row=checkpoint.position.get('row', 0) + 10)
+        if options.get('finish'):
+            checkpoint.complete()
+        return str(checkpoint.position['row'])
+
+
+@pytest.mark.django_db
+def test_checkpoint_resumes_interrupted_runs_only():
+    command = Command()
+
+    assert command.handle(restart=False) == '10'
+    assert command.handle(restart=False) == '20'
+    assert command.handle(restart=True) == '10'
+    assert command.handle(restart=False, finish=True) == '20'
+    # A completed run starts over
+    assert command.handle(restart=False) == '10'
+    assert Checkpoint.objects.get().command == 'test_commands'
+
+
+@pytest.mark.django_db
+def test_advisory_lock_is_released_on_exit():
+    with advisory_lock('test-lock') as acquired:
+        assert acquired
+    with advisory_lock('test-lock') as acquired:
+        assert acquired
+
+
+def test_progress_reports_throughput_and_eta(monkeypatch):
+    clock = iter([0.0, 10.0, 10.0])
+    monkeypatch.setattr('core.commands.monotonic', lambda: next(clock))
+    lines = []
+    progress = Progress(1000, lines.append, done=100, interval=5)
+
+    progress.advance(200)
+
+    assert lines == ['300/1000 rows (30%), 20.0 rows/s, ETA 0m35s']
+
+
+def test_file_key_changes_with_the_content(tmp_path):
+    path = tmp_path / 'mosques.csv'
+    path.write_text('a;b\n')
+    key = file_key(path)
+    path.write_text('a;c\n')
+
+    assert key.startswith('mosques.csv:') and file_key(path) != key
@@ -0,0 +1,97 @@
+import pytest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.utils import timezone
+
+from .. import jobs
+from ..models import Job
+
+calls = []
+
+
+@jobs.task(name='tests.record', dedup_key='record:{value}')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task(name='tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError("boom")
+
+
+@jobs.task(name='tests.hourly', every=timedelta(hours=1))
+def hourly():
+    calls.append('hourly')
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+@pytest.mark.django_db
+def test_delay_deduplicates_queued_jobs():
+    first = record.delay(value=1)
+    second = record.delay(value=1)
+    record.delay(value=2)
+
+    assert first.pk == second.pk
+    assert Job.objects.filter(status=Job.QUEUED).count() == 2
+
+
+@pytest.mark.django_db
+def test_claim_orders_by_priority_and_runs_jobs():
+    low = jobs.enqueue('tests.record', {'value': 'low'})
+    high = jobs.enqueue('tests.record', {'value': 'high'}, priority=5)
+
+    claimed = jobs.claim('test-worker', limit=2)
+    assert [job.pk for job in claimed] == [high.pk, low.pk]
+    assert jobs.claim('test-worker') == []
+
+    for job in claimed:
+        assert jobs.execute(job)
+    assert calls == ['high', 'low']
+    assert Job.objects.filter(status=Job.DONE).count() == 2
+
+
+@pytest.mark.django_db
+def test_failed_job_is_retried_then_marked_failed():
+    job = explode.delay()
+
+    [claimed] = jobs.claim('test-worker')
+    assert not jobs.execute(claimed)
+    job.refresh_from_db()
+    assert job.status == Job.QUEUED
+    assert job.run_at > timezone.now()
+
+    Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+    [claimed] = jobs.claim('test-worker')
+    assert not jobs.execute(claimed)
+    job.refresh_from_db()
+    assert job.status == Job.FAILED
+    assert "boom" in job.last_error
+
+
+@pytest.mark.django_db
+def test_heartbeat_keeps_running_jobs_from_going_stale():
+    record.delay(value=1)
+    [claimed] = jobs.claim('test-worker')
+    Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - jobs.STALE_AFTER * 2)
+
+    assert jobs.heartbeat('test-worker') == 1
+    assert jobs.recover_stale() == 0
+
+    Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - jobs.STALE_AFTER * 2)
+    assert jobs.recover_stale() == 1
+    assert Job.objects.get(pk=claimed.pk).status == Job.QUEUED
+
+
+@pytest.mark.django_db
+def test_periodic_tasks_are_queued_once_for_their_next_period():
+    now = datetime(2025, 3, 1, 10, 20, tzinfo=dt_timezone.utc)
+
+    jobs.schedule_periodic(now)
+    jobs.schedule_periodic(now + timedelta(minutes=5))
+
+    job = Job.objects.get(name='tests.hourly')
+    assert job.run_at == datetime(2025, 3, 1, 11, 0, tzinfo=dt_timezone.utc)
+    assert job.dedup_key == 'periodic:tests.hourly'
@@ -0,0 +1,24 @@
+import io
+import json
+
+import pytest
+
+from .._json_stream import iter_array
+
+
+def test_iter_array_reads_keyed_array_in_small_chunks():
+    entries = [{"date": f"2024-12-{day:02d} 00:00", "sobh": "05:41", "city": "Béja"} for day in range(1, 32)]
+    payload = json.dumps({"prayer_times": entries}, indent=4, ensure_ascii=False).encode('utf-8')
+
+    assert list(iter_array(io.BytesIO(payload), 'prayer_times', chunk_size=7)) == entries
+
+
+def test_iter_array_top_level_scalars_split_across_chunks():
+    payload = b'[12345, "abc", null, 6789]'
+
+    assert list(iter_array(io.BytesIO(payload), chunk_size=3)) == [12345, "abc", None, 6789]
+
+
+def test_iter_array_rejects_truncated_document():
+    with pytest.raises(ValueError):
+        list(iter_array(io.BytesIO(b'{"prayer_times": [{"date": "2024'), 'prayer_times'))
@@ -0,0 +1,69 @@
+import pytest
+
+from masjid.models import Masjid
+from ..backups import LocalStore, write_backup
+from ..models import Address, RowChange
+from ..restore import BackupVerificationError, dependency_levels, restore
+
+
+def test_dependency_levels_only_reference_earlier_levels():
+    levels = dependency_levels([Masjid.managers.through, Masjid, Address])
+
+    assert levels[0] == [Address]
+    assert Masjid in levels[1]
+    assert Masjid.managers.through in levels[2]
+
+
+@pytest.mark.django_db
+def test_restore_replays_the_chain_without_saves_and_keeps_timestamps(tmp_path, address, manager_user):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    masjid.managers.add(manager_user)
+    store = LocalStore(tmp_path)
+    full = write_backup(store, 'nasjod_1')
+    masjid.name = "Kasbah Great Mosque"
+    masjid.save()
+    added = Address.objects.create(city="new", country="tunisia", coordinates="POINT (10 34)")
+    write_backup(store, 'nasjod_2', parent=full)
+    masjid.refresh_from_db()
+
+    Masjid.objects.all().delete()
+    added.delete()
+    changes = RowChange.objects.count()
+    result = restore(store, 'nasjod_2', workers=1, batch_size=2)
+
+    restored = Masjid.objects.get(pk=masjid.pk)
+    assert result.backups == ['nasjod_1', 'nasjod_2']
+    assert restored.name == "Kasbah Great Mosque"
+    assert (restored.created_at, restored.updated_at) == (masjid.created_at, masjid.updated_at)
+    assert list(restored.managers.all()) == [manager_user]
+    assert Address.objects.filter(pk=added.pk).exists()
+    assert RowChange.objects.count() == changes
+    assert Address.objects.create(country="tunisia", coordinates="POINT (10 34)").pk > added.pk
+
+
+@pytest.mark.django_db(transaction=True)
+def test_restore_loads_the_levels_in_parallel_threads(tmp_path, address, manager_user):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    masjid.managers.add(manager_user)
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1')
+    Masjid.objects.all().delete()
+
+    result = restore(store, 'nasjod_1', workers=4, batch_size=2)
+
+    assert result.backups == ['nasjod_1']
+    assert Masjid.objects.get(pk=masjid.pk).address == address
+    assert list(Masjid.objects.get(pk=masjid.pk).managers.all()) == [manager_user]
+
+
+@pytest.mark.django_db
+def test_restore_verifies_the_chain_before_emptying_the_tables(tmp_path, address):
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1')
+    data = tmp_path / 'nasjod_1' / 'data.ndjson.gz'
+    data.write_bytes(bytes([data.read_bytes()[0] ^ 0xff]) + data.read_bytes()[1:])
+
+    with pytest.raises(BackupVerificationError):
+        restore(store, 'nasjod_1', workers=1)
+
+    assert Address.objects.filter(pk=address.pk).exists()
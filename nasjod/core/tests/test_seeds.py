@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+
+from masjid.models import Masjid
+from ..models import Address
+from ..seeds import load_fixture, reset_sequences
+
+
+def fixture(*entries):
+    return io.BytesIO(json.dumps(list(entries)).encode('utf-8'))
+
+
+def address_entry(pk, city):
+    return {"model": "core.address", "pk": pk, "fields": {
+        "street": "sidi elakhmi", "city": city, "state": "sfax", "country": "tunisia",
+        "coordinates": "SRID=4326;POINT (10.7798 34.7905)",
+    }}
+
+
+@pytest.mark.django_db
+def test_load_fixture_upserts_by_pk_in_batches_and_resets_the_sequence():
+    Address.objects.create(pk=40, city="old", country="tunisia", coordinates="POINT (10 34)")
+
+    loaded = load_fixture(
+        fixture(address_entry(40, "sfax"), {"model": "masjid.masjid", "pk": 1, "fields": {}}, address_entry(41, "$")),
+        Address,
+        prepare=lambda entries: [entry for entry in entries if entry['fields']['city'] != '$'],
+        batch_size=1,
+    )
+    reset_sequences(Address)
+
+    assert loaded == [40]
+    assert Address.objects.get(pk=40).city == "sfax"
+    assert Address.objects.create(country="tunisia", coordinates="POINT (10 34)").pk > 40
+
+
+@pytest.mark.django_db
+def test_load_fixture_links_many_to_many_values(address, manager_user):
+    loaded = load_fixture(fixture({"model": "masjid.masjid", "pk": 7, "fields": {
+        "name": "Kasbah Mosque", "address": address.pk, "managers": [manager_user.pk],
+    }}), Masjid)
+
+    masjid = Masjid.objects.get(pk=7)
+    assert loaded == [7]
+    assert masjid.address == address
+    assert list(masjid.managers.all()) == [manager_user]
@@ -0,0 +1,92 @@
+from datetime import date
+
+import pytest
+from django.db import connection
+
+from masjid.models import Masjid
+from prayertime.models import IqamaTime
+from ..backups import LocalStore, write_backup
+from ..models import Address
+from ..restore import restore_selection
+from ..verify import State, select, verify
+
+
+def state(**rows):
+    state = State()
+    for label in ('core.address', 'masjid.masjid', 'prayertime.iqamatime'):
+        state.add(label, rows.get(label.split('.')[1], []))
+    return state
+
+
+def row(pk, **fields):
+    return {'pk': pk, 'fields': fields}
+
+
+def test_dangling_foreign_keys_are_found():
+    replayed = state(address=[row(1)], masjid=[row(5, address=1), row(6, address=2), row(7, address=None)])
+
+    assert list(replayed.dangling()) == [('masjid.masjid', 6, 'address', 'core.address', 2)]
+
+
+def test_select_follows_cascades_then_references():
+    replayed = state(
+        address=[row(1), row(2)],
+        masjid=[row(5, address=1), row(6, address=2)],
+        iqamatime=[row(9, masjid=5), row(10, masjid=6)],
+    )
+
+    assert select(replayed, {'masjid.masjid': [5, 404]}) == (
+        {'masjid.masjid': {5}, 'prayertime.iqamatime': {9}}, {'core.address': {1}},
+    )
+    assert select(replayed, {'masjid.masjid': [5]}, related=False) == (
+        {'masjid.masjid': {5}}, {'core.address': {1}},
+    )
+
+
+@pytest.mark.django_db
+def test_verify_reports_corrupted_chunks(tmp_path, address):
+    Masjid.objects.create(name="Kasbah Mosque", address=address)
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1', models=[Masjid, Address])
+
+    result = verify(store, 'nasjod_1')
+    assert (result.backups, result.rows, result.issues) == (['nasjod_1'], 2, [])
+
+    data = tmp_path / 'nasjod_1' / 'data.ndjson.gz'
+    data.write_bytes(data.read_bytes()[:-1] + b'\0')
+    issue, = verify(store, 'nasjod_1').issues
+    assert issue.model == 'masjid.masjid' and 'checksum mismatch' in issue.message
+
+
+@pytest.mark.django_db
+def test_restore_selection_brings_a_masjid_back_with_its_rows(tmp_path, address, manager_user):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    masjid.managers.add(manager_user)
+    iqama = IqamaTime.objects.create(masjid=masjid, date=date(2024, 12, 1), fajr_iqama=20)
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1')
+    masjid_pk, created_at = masjid.pk, masjid.created_at
+    masjid.delete()
+
+    result = restore_selection(store, 'nasjod_1', {'masjid.masjid': [masjid_pk]})
+
+    restored = Masjid.objects.get(pk=masjid_pk)
+    assert result.rows >= 4
+    assert restored.created_at == created_at
+    assert list(restored.managers.all()) == [manager_user]
+    assert iqama.pk in restored.iqamas.values_list('pk', flat=True)
+
+
+@pytest.mark.django_db
+def test_restore_selection_into_a_scratch_schema_leaves_the_live_tables_alone(tmp_path, address):
+    masjid = Masjid.objects.create(name="Kasbah Mosque", address=address)
+    store = LocalStore(tmp_path)
+    write_backup(store, 'nasjod_1')
+    Masjid.objects.filter(pk=masjid.pk).update(name="Renamed")
+
+    restore_selection(store, 'nasjod_1', {'masjid.masjid': [masjid.pk]}, related=False, schema='scratch_test')
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM scratch_test.masjid_masjid")
+        assert cursor.fetchall() == [("Kasbah Mosque",)]
+    assert Masjid.objects.get(pk=masjid.pk).name == "Renamed"
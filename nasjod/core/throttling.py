@@ -1,4 +1,4 @@
-from rest_framework.throttling import AnonRateThrottle
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 
 
 class CreateMasjidAnonThrottle(AnonRateThrottle):
@@ -7,3 +7,17 @@ class CreateMasjidAnonThrottle(AnonRateThrottle):
 class CreateSuggestionMasjidModificationAnonThrottle(AnonRateThrottle):
     scope = 'anon_create_suggestion_masjid_modification'
 
+class OptionalRateMixin:
+    """Lets every request through when no rate is set for the scope, as when throttling is disabled."""
+
+    def get_rate(self):
+        return self.THROTTLE_RATES.get(self.scope)
+
+class CalendarThrottle(OptionalRateMixin, UserRateThrottle):
+    scope = 'calendar'
+
+class ExportThrottle(OptionalRateMixin, UserRateThrottle):
+    scope = 'export'
+
+class OfflinePackThrottle(OptionalRateMixin, UserRateThrottle):
+    scope = 'offline_pack'
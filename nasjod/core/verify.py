@@ -0,0 +1,190 @@
+"""
+Checks of the backups written by core/backups.py, and the row selection of the
+selective restores (core/restore.py), both made from the backup alone, without reading
+or writing the tables.
+
+The chain of a backup is replayed into a State: for each model, the foreign key values
+of each of its rows by pk, as a restore would leave them. verify() checks each chunk
+against the manifest while it is streamed (sha256, row count, pk bounds and order),
+then that every foreign key of the State points to a row of the backup.
+
+select() expands the rows chosen for a selective restore: the rows deleted along with
+them (on_delete=CASCADE: the iqamas, jumuah times and links of a masjid...), then the
+rows all of those reference (its address...), so the selection restores on its own.
+"""
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import models as db_models
+
+from .backups import chain_manifests, decode_chunk, iter_chunks
+
+Issue = namedtuple('Issue', ['backup', 'model', 'message'])
+VerifyResult = namedtuple('VerifyResult', ['backups', 'rows', 'chunks', 'issues'])
+
+
+def foreign_keys(model):
+    """The concrete foreign keys of `model` to the pk of another model, with the label of that model."""
+    return [
+        (field, field.related_model._meta.label_lower) for field in model._meta.concrete_fields
+        if field.is_relation and field.target_field.primary_key
+    ]
+
+
+class State:
+    """The rows of a replayed chain of backups: {label: {pk: (foreign key values)}}, labels in dependency order."""
+
+    def __init__(self):
+        self.rows = {}
+        self.keys = {}
+
+    def model_keys(self, label):
+        if label not in self.keys:
+            self.keys[label] = foreign_keys(apps.get_model(label))
+            self.rows[label] = {}
+        return self.keys[label]
+
+    def add(self, label, rows):
+        keys = self.model_keys(label)
+        table = self.rows[label]
+        for row in rows:
+            table[row['pk']] = tuple(row['fields'].get(field.name) for field, _ in keys)
+
+    def delete(self, label, pks):
+        self.model_keys(label)
+        for pk in pks:
+            self.rows[label].pop(pk, None)
+
+    def dangling(self):
+        """Yields (label, pk, field name, target label, value) for the foreign keys pointing to no row."""
+        for label, keys in self.keys.items():
+            for index, (field, target) in enumerate(keys):
+                if target not in self.rows:
+                    continue
+                existing = self.rows[target]
+                for pk, values in self.rows[label].items():
+                    value = values[index]
+                    if value is not None and value not in existing:
+                        yield label, pk, field.name, target, value
+
+
+def _check_chunk(manifest, label, chunk, rows):
+    """The issues of a chunk whose rows do not match what the manifest says of it."""
+    issues = []
+    if len(rows) != chunk['rows']:
+        issues.append(f"chunk at {chunk['offset']} holds {len(rows)} rows, the manifest says {chunk['rows']}")
+    pks = [row.get('pk') for row in rows]
+    if rows and (pks[0] != chunk['first_pk'] or pks[-1] != chunk['last_pk']):
+        issues.append(f"chunk at {chunk['offset']} spans pks {pks[0]}-{pks[-1]}, "
+                      f"the manifest says {chunk['first_pk']}-{chunk['last_pk']}")
+    if pks != sorted(pks):
+        issues.append(f"chunk at {chunk['offset']} is not in pk order")
+    if any(row.get('model') != label for row in rows):
+        issues.append(f"chunk at {chunk['offset']} holds rows of other models")
+    return [Issue(manifest['name'], label, message) for message in issues]
+
+
+def _stream(store, manifest, label, chunks, issues):
+    """Yields the rows of the chunks of `label`, reporting the chunks that cannot be read instead of raising."""
+    key = f"{manifest['name']}/{manifest['data']}"
+    for chunk in chunks:
+        try:
+            data = store.read(key, chunk['offset'], chunk['length'])
+            rows = decode_chunk(data, chunk['sha256'])
+        except (ValueError, OSError, EOFError) as e:
+            # Checksum mismatch, corrupted gzip data or truncated file
+            issues.append(Issue(manifest['name'], label, f"chunk at {chunk['offset']}: {e}"))
+            continue
+        yield chunk, rows
+
+
+def replay(store, manifests, issues=None, check=False):
+    """
+    The State of the database after restoring `manifests`, in chain order. With `check`,
+    the chunks are compared with their manifest and the problems added to `issues`.
+    """
+    state = State()
+    issues = [] if issues is None else issues
+    for manifest in manifests:
+        for entry in reversed(manifest['models']):
+            state.delete(entry['model'], entry.get('deleted', []))
+        for entry in manifest['models']:
+            state.model_keys(entry['model'])
+            count = 0
+            for chunk, rows in _stream(store, manifest, entry['model'], entry['chunks'], issues):
+                if check:
+                    issues.extend(_check_chunk(manifest, entry['model'], chunk, rows))
+                state.add(entry['model'], rows)
+                count += len(rows)
+            if check and count != entry['rows'] and not any(
+                issue.backup == manifest['name'] and issue.model == entry['model'] for issue in issues
+            ):
+                issues.append(Issue(manifest['name'], entry['model'], f"{count} rows, the manifest says {entry['rows']}"))
+    return state
+
+
+def verify(store, name, max_dangling=20):
+    """
+    Checks the backup `name` and its chain without writing anything. Returns a
+    VerifyResult whose `issues` is empty when the backup is sound. At most
+    `max_dangling` dangling foreign keys are reported per model and field.
+    """
+    manifests = chain_manifests(store, name)
+    issues = []
+    state = replay(store, manifests, issues, check=True)
+    reported = {}
+    for label, pk, field, target, value in state.dangling():
+        count = reported[label, field] = reported.get((label, field), 0) + 1
+        if count <= max_dangling:
+            issues.append(Issue(name, label, f"row {pk}: {field} points to missing {target} {value}"))
+    for (label, field), count in reported.items():
+        if count > max_dangling:
+            issues.append(Issue(name, label, f"{count - max_dangling} more rows with a dangling {field}"))
+    return VerifyResult(
+        [manifest['name'] for manifest in manifests],
+        sum(len(rows) for rows in state.rows.values()),
+        sum(len(entry['chunks']) for manifest in manifests for entry in manifest['models']),
+        issues,
+    )
+
+
+def find(store, manifests, label, field, value):
+    """The pks of the rows of `label` whose `field` was `value` in any backup of `manifests`."""
+    return {
+        row['pk'] for manifest in manifests for _, _, rows in iter_chunks(store, manifest, models={label})
+        for row in rows if row['fields'].get(field) == value
+    }
+
+
+def select(state, seeds, related=True):
+    """
+    Expands `seeds` ({label: pks, or None for all the rows}) into the rows to restore.
+    Returns (selected, required): the seeds with, when `related`, the rows cascading from
+    them, and the rows those reference, which only need to exist. Both are {label: set
+    of pks} of rows in `state`.
+    """
+    selected = {
+        label: set(state.rows.get(label, {})) if pks is None else set(pks) & state.rows.get(label, {}).keys()
+        for label, pks in seeds.items()
+    }
+    labels = list(state.keys)  # Dependency order
+    if related:
+        for label in labels:
+            for index, (field, target) in enumerate(state.keys[label]):
+                if field.remote_field.on_delete is not db_models.CASCADE or not selected.get(target):
+                    continue
+                parents = selected[target]
+                children = {pk for pk, values in state.rows[label].items() if values[index] in parents}
+                if children:
+                    selected.setdefault(label, set()).update(children)
+
+    required = {}
+    for label in reversed(labels):
+        pks = selected.get(label, set()) | required.get(label, set())
+        for index, (field, target) in enumerate(state.keys[label]):
+            existing = state.rows.get(target, {})
+            references = {state.rows[label][pk][index] for pk in pks} - {None}
+            missing = {value for value in references if value in existing} - selected.get(target, set())
+            if missing:
+                required.setdefault(target, set()).update(missing)
+    return selected, required
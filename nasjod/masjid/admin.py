@@ -1,10 +1,12 @@
 from django import forms
-from django.db import models, transaction
+from django.db import models
 from django.contrib import admin, messages
 from django.contrib.gis import admin as geoadmin
 from core.admin import export_to_csv
 from .models import Masjid, SuggestionMasjidModification
-from prayertime.models import IqamaTime, JumuahPrayerTime, PrayerTime
+from .tasks import accept_suggestion
+from prayertime.linking import set_prayer_times, zone_location_ids
+from prayertime.models import PrayerTime
 
 
 class MasjidAdminForm(forms.ModelForm):
@@ -38,8 +40,8 @@ class MasjidAdminForm(forms.ModelForm):
                 default_location = f"{linked_prayer_time.location.country}, {linked_prayer_time.location.state}, {linked_prayer_time.location.city}"
                 self.fields['prayer_times_location'].initial = default_location
 
-    def save(self, commit=True):
-        instance = super().save(commit=False)
+    def _save_m2m(self):
+        super()._save_m2m()
 
         # Get the selected location string
         location = self.cleaned_data.get('prayer_times_location')
@@ -48,18 +50,9 @@ class MasjidAdminForm(forms.ModelForm):
             # Split the selected location into country, state, and city
             country, state, city = location.split(", ")
             
-            # Link prayer times based on the selected location trio
-            matching_prayer_times = PrayerTime.objects.filter(
-                location__country=country,
-                location__state=state,
-                location__city=city
-            )
-            with transaction.atomic():
-                instance.prayertime_set.set(matching_prayer_times)
-
-        if commit:
-            instance.save()
-        return instance
+            # Link prayer times based on the selected location trio, keeping links that are already correct
+            location_ids = zone_location_ids(country=country, state=state, city=city)
+            set_prayer_times([self.instance.pk], location_ids)
 
 
 class MasjidAdmin(geoadmin.GISModelAdmin):
@@ -126,79 +119,25 @@ class SuggestionMasjidModificationAdmin(admin.ModelAdmin):
 
     @admin.action(description="Accept Suggestion and Update Masjid")
     def accept_suggestion(self, request, queryset):
+        queued = 0
         for suggestion in queryset:
-            try:
-                masjid = suggestion.suggestion_masjid
-                if not masjid:
-                    self.message_user(
-                        request,
-                        f"Suggestion {suggestion.name} does not have a linked Masjid.",
-                        messages.ERROR,
-                    )
-                    continue
-
-                # Update Masjid fields
-                masjid_fields = {
-                    'name': suggestion.name,
-                    'telephone': suggestion.telephone,
-                    'size': suggestion.size,
-                    'cover': suggestion.cover,
-                    'parking': suggestion.parking,
-                    'disabled_access': suggestion.disabled_access,
-                    'ablution_room': suggestion.ablution_room,
-                    'woman_space': suggestion.woman_space,
-                    'adult_courses': suggestion.adult_courses,
-                    'children_courses': suggestion.children_courses,
-                    'salat_al_eid': suggestion.salat_al_eid,
-                    'salat_al_janaza': suggestion.salat_al_janaza,
-                    'iftar_ramadhan': suggestion.iftar_ramadhan,
-                    'itikef': suggestion.itikef,
-                }
-                # Only update fields that are not empty
-                for field, value in masjid_fields.items():
-                    if value not in [None, '', False]:
-                        setattr(masjid, field, value)
-                masjid.save()
-
-                # Update IqamaTime
-                if suggestion.fajr_iqama or suggestion.dhuhr_iqama or suggestion.asr_iqama or suggestion.maghrib_iqama or suggestion.isha_iqama:
-                    iqama_time, created = IqamaTime.objects.get_or_create(
-                        masjid=masjid,
-                    )
-                    iqama_fields = {
-                        'fajr_iqama': suggestion.fajr_iqama,
-                        'dhuhr_iqama': suggestion.dhuhr_iqama,
-                        'asr_iqama': suggestion.asr_iqama,
-                        'maghrib_iqama': suggestion.maghrib_iqama,
-                        'isha_iqama': suggestion.isha_iqama,
-                    }
-                    for field, value in iqama_fields.items():
-                        if value is not None:
-                            setattr(iqama_time, field, value)
-                    iqama_time.save()
-
-                # # Update JumuahPrayerTime
-                if suggestion.jumuah_time or suggestion.first_timeslot_jumuah:
-                    jumuah_prayer_time, created = JumuahPrayerTime.objects.get_or_create(
-                        masjid=masjid,
-                    )
-                    if suggestion.jumuah_time:
-                        jumuah_prayer_time.jumuah_time = suggestion.jumuah_time
-                    if suggestion.first_timeslot_jumuah is not None:
-                        jumuah_prayer_time.first_timeslot_jumuah = suggestion.first_timeslot_jumuah
-                    jumuah_prayer_time.save()
-
+            if not suggestion.suggestion_masjid_id:
                 self.message_user(
                     request,
-                    f"Successfully accepted suggestion for Masjid: {masjid.name} ",
-                    messages.SUCCESS,
-                )
-            except Exception as e:
-                self.message_user(
-                    request,
-                    f"Error processing suggestion {suggestion.name}: {e}",
+                    f"Suggestion {suggestion.name} does not have a linked Masjid.",
                     messages.ERROR,
                 )
+                continue
+            # Applied by the background worker, see masjid/tasks.py
+            accept_suggestion.delay(suggestion_id=suggestion.pk)
+            queued += 1
+
+        if queued:
+            self.message_user(
+                request,
+                f"Queued {queued} suggestions, the masjids will be updated shortly.",
+                messages.SUCCESS,
+            )
 
     actions = ['accept_suggestion']
 
@@ -0,0 +1,87 @@
+"""
+Image download and re-encoding for masjid photos and covers.
+"""
+import io
+from collections import namedtuple
+
+from PIL import Image
+
+DOWNLOAD_TIMEOUT = 30
+JPEG_QUALITY = 85
+HASH_SIZE = 8
+
+ProcessedImage = namedtuple('ProcessedImage', 'jpeg phash width height')
+
+
+async def fetch_image(client, url):
+    """Downloads `url` with an httpx.AsyncClient and returns its bytes. Raises ValueError when it is not an image."""
+    response = await client.get(url)
+    response.raise_for_status()
+    content_type = response.headers.get('content-type', '')
+    if not content_type.startswith('image/'):
+        raise ValueError(f"URL does not point to an image: {url}")
+    return response.content
+
+
+def _to_jpeg(image, quality):
+    # Convert to RGB if necessary (handles RGBA, P mode, etc.)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def encode_jpeg(image_data, quality=JPEG_QUALITY):
+    """Validates `image_data` with PIL and re-encodes it as an optimized JPEG."""
+    return _to_jpeg(Image.open(io.BytesIO(image_data)), quality)
+
+
+def difference_hash(image, size=HASH_SIZE):
+    """
+    Perceptual hash of a PIL image: one bit per pair of horizontally adjacent pixels of
+    its grayscale thumbnail, set when the left one is brighter. Resized or re-encoded
+    copies of an image get hashes a few bits apart.
+    """
+    thumbnail = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = list(thumbnail.getdata())
+    bits = 0
+    for row in range(size):
+        for column in range(size):
+            offset = row * (size + 1) + column
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return bits
+
+
+def hash_distance(first, second):
+    """Number of bits differing between two hex encoded perceptual hashes."""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+def hash_bands(phash, count):
+    """
+    Splits a hex encoded perceptual hash into `count` bands tagged with their position.
+    Hashes differing in fewer than `count` bits share at least one band.
+    """
+    size, extra = divmod(len(phash), count) if phash else (0, 0)
+    bands, start = [], 0
+    for index in range(count if phash else 0):
+        end = start + size + (index < extra)
+        bands.append(f'{index}:{phash[start:end]}')
+        start = end
+    return bands
+
+
+def process_image(image_data, quality=JPEG_QUALITY):
+    """
+    Decodes `image_data` once and returns its ProcessedImage: the optimized JPEG, the
+    perceptual hash as 16 hex digits and the dimensions. Runs in worker processes.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    return ProcessedImage(
+        jpeg=_to_jpeg(image, quality),
+        phash=f'{difference_hash(image):016x}',
+        width=image.width,
+        height=image.height,
+    )
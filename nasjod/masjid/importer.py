@@ -0,0 +1,290 @@
+"""
+Staged import of mosques from CSV files.
+
+1. Parse: every row is parsed and validated without touching the database, in
+   worker processes when asked. Invalid rows are reported and left out.
+2. Prefetch: existing addresses (by coordinates), their masjids and the iqama rules
+   in force are read with a few set-based queries.
+3. Diff: each row is classified as created, updated or unchanged.
+4. Apply: the diff is written with bulk operations in one transaction.
+
+Bulk writes bypass Address.save (lowercasing) and Masjid.save (uniqueness check),
+so both are done here: addresses are normalized when built and a masjid is never
+created at an address that already has one.
+"""
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import time
+
+from django.contrib.gis.geos import Point, Polygon
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Address
+from prayertime.iqamas import IQAMA_FIELDS
+from prayertime.models import IqamaTime, hijri_date_for
+from prayertime.tasks import rebuild_masjid_schedules
+from .models import Masjid
+from .tasks import import_cover_images
+
+REQUIRED_FIELDS = ('name_en', 'governorate', 'lat', 'lon')
+BATCH_SIZE = 500
+PARSE_CHUNK_SIZE = 200
+IMAGE_JOB_SIZE = 1000
+
+ParsedRow = namedtuple('ParsedRow', 'row_num name name_ar telephone image_url lon lat address iqama')
+RowError = namedtuple('RowError', 'row_num name error')
+
+
+def parse_iqama_value(value):
+    """Minutes of an iqama offset such as "15" or "+10", None when empty or invalid."""
+    if not value or value.strip() == '':
+        return None
+    try:
+        return int(value.strip())
+    except ValueError:
+        return None
+
+
+def parse_dhuhr_iqama(value):
+    """
+    Dhuhr iqama as {'type', 'value'}: a time of day ("13:00"), a positive offset from the
+    adhan ("+10") or a negative one, meaning minutes before Asr ("-15").
+    """
+    if not value or value.strip() == '':
+        return {'type': None, 'value': None}
+    value = value.strip()
+
+    time_match = re.match(r'^(\d{1,2}):(\d{2})(?::(\d{2}))?$', value)
+    if time_match:
+        hour, minute = int(time_match.group(1)), int(time_match.group(2))
+        second = int(time_match.group(3)) if time_match.group(3) else 0
+        if 0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 59:
+            return {'type': 'time', 'value': time(hour, minute, second)}
+
+    try:
+        int_value = int(value)
+    except ValueError:
+        return {'type': None, 'value': None}
+    return {'type': 'positive_int' if int_value > 0 else 'negative_int', 'value': int_value}
+
+
+def parse_iqama(row):
+    """IqamaTime field values of a row, without the empty ones."""
+    iqama = {
+        'fajr_iqama': parse_iqama_value(row.get('fajr_iqama', '')),
+        'asr_iqama': parse_iqama_value(row.get('asr_iqama', '')),
+        'maghrib_iqama': parse_iqama_value(row.get('maghrib_iqama', '')),
+        'isha_iqama': parse_iqama_value(row.get('isha_iqama', '')),
+    }
+    dhuhr = parse_dhuhr_iqama(row.get('dhuhr_iqama', ''))
+    if dhuhr['type'] == 'positive_int':
+        iqama['dhuhr_iqama'] = dhuhr['value']
+    elif dhuhr['type'] == 'negative_int':
+        iqama['dhuhr_iqama_from_asr'] = abs(dhuhr['value'])
+    elif dhuhr['type'] == 'time':
+        iqama['dhuhr_iqama_hour'] = dhuhr['value']
+    return {field: value for field, value in iqama.items() if value is not None}
+
+
+def parse_row(row_num, row):
+    """Validates a CSV row and returns its ParsedRow. Raises ValidationError."""
+    for field in REQUIRED_FIELDS:
+        if not (row.get(field) or '').strip():
+            raise ValidationError(f'Missing required field: {field}')
+    try:
+        lat, lon = float(row['lat']), float(row['lon'])
+    except (ValueError, TypeError):
+        raise ValidationError('Invalid coordinates')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValidationError('Invalid coordinates')
+
+    def text(field):
+        return (row.get(field) or '').strip() or None
+
+    return ParsedRow(
+        row_num=row_num,
+        name=text('name_en'),
+        name_ar=text('name_ar'),
+        telephone=text('phone'),
+        image_url=text('image1'),
+        lon=lon,
+        lat=lat,
+        # Address.save normalization, bulk_create skips it
+        address={
+            'country': 'tunisia',
+            'city': row['governorate'].strip().lower(),
+            'zip_code': text('zipcode'),
+            'additional_info': text('address_mawaqit'),
+        },
+        iqama=parse_iqama(row),
+    )
+
+
+def _parse_chunk(chunk):
+    parsed, errors = [], []
+    for row_num, row in chunk:
+        try:
+            parsed.append(parse_row(row_num, row))
+        except ValidationError as e:
+            errors.append(RowError(row_num, row.get('name_en') or 'Unknown', '; '.join(e.messages)))
+    return parsed, errors
+
+
+def parse_rows(rows, workers=1):
+    """
+    Parses (row number, CSV row dict) pairs, in `workers` processes when more than one.
+    Rows repeating the coordinates of an earlier row are rejected. Returns (parsed, errors).
+    """
+    rows = list(rows)
+    chunks = [rows[start:start + PARSE_CHUNK_SIZE] for start in range(0, len(rows), PARSE_CHUNK_SIZE)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_parse_chunk, chunks))
+    else:
+        results = [_parse_chunk(chunk) for chunk in chunks]
+
+    parsed, errors, seen = [], [], {}
+    for chunk_parsed, chunk_errors in results:
+        errors.extend(chunk_errors)
+        for row in chunk_parsed:
+            first = seen.setdefault((row.lon, row.lat), row.row_num)
+            if first != row.row_num:
+                errors.append(RowError(row.row_num, row.name, f'Same coordinates as row {first}'))
+                continue
+            parsed.append(row)
+    errors.sort()
+    return parsed, errors
+
+
+class Import:
+    """The diff of parsed rows against the database, applied with `apply()`."""
+
+    def __init__(self, rows, skip_images=False, today=None, similar_images=False):
+        self.rows = rows
+        self.skip_images = skip_images
+        self.similar_images = similar_images
+        self.today = today or timezone.localdate()
+        self.errors = []
+        self.created = []  # ParsedRow
+        self.updated = []  # (ParsedRow, Masjid, changed fields)
+        self.unchanged = []  # (ParsedRow, Masjid)
+        self._diff()
+
+    def masjid_values(self, row):
+        values = {'name': row.name, 'name_ar': row.name_ar, 'telephone': row.telephone}
+        # Covers are otherwise downloaded by the background image jobs
+        if self.skip_images:
+            values['cover'] = row.image_url
+        return {field: value for field, value in values.items() if value is not None}
+
+    def _prefetch(self):
+        if not self.rows:
+            return {}, {}
+        xs, ys = [row.lon for row in self.rows], [row.lat for row in self.rows]
+        epsilon = 1e-9
+        box = Polygon.from_bbox((min(xs) - epsilon, min(ys) - epsilon, max(xs) + epsilon, max(ys) + epsilon))
+        box.srid = 4326
+
+        addresses = {}
+        for address in Address.objects.filter(coordinates__contained=box).order_by('id'):
+            addresses.setdefault((address.coordinates.x, address.coordinates.y), address)
+        masjids = {
+            masjid.address_id: masjid
+            for masjid in Masjid.objects.filter(address_id__in=[address.pk for address in addresses.values()])
+        }
+        return addresses, masjids
+
+    def _prefetch_rules(self, masjid_ids):
+        """IqamaTime rule in force today of each masjid, resolved like prayertime.iqamas.rule_in_force."""
+        rules = IqamaTime.objects.filter(masjid_id__in=masjid_ids)
+        in_force = {
+            rule.masjid_id: rule
+            for rule in rules.filter(date__lte=self.today).order_by('masjid_id', '-date', '-id').distinct('masjid_id')
+        }
+        for rule in rules.exclude(masjid_id__in=in_force).order_by('masjid_id', 'date', '-id').distinct('masjid_id'):
+            in_force[rule.masjid_id] = rule
+        return in_force
+
+    def _diff(self):
+        addresses, masjids = self._prefetch()
+        self.addresses = {}
+        for row in self.rows:
+            address = addresses.get((row.lon, row.lat))
+            masjid = masjids.get(address.pk) if address else None
+            self.addresses[row.row_num] = address
+            if masjid is None:
+                self.created.append(row)
+                continue
+            if masjid.name != row.name:
+                self.errors.append(RowError(row.row_num, row.name, 'A Masjid with this address already exists.'))
+                continue
+            changed = [field for field, value in self.masjid_values(row).items() if getattr(masjid, field) != value]
+            if changed:
+                self.updated.append((row, masjid, changed))
+            else:
+                self.unchanged.append((row, masjid))
+        self.rules = self._prefetch_rules([masjid.pk for _, masjid, *_ in self.updated + self.unchanged])
+
+    def _iqama_changes(self, pairs):
+        """IqamaTime rows to create and to update so that each masjid's rule in force matches its row."""
+        created, updated = [], []
+        for row, masjid in pairs:
+            rule = self.rules.get(masjid.pk)
+            if rule is not None and all(getattr(rule, field) == row.iqama.get(field) for field in IQAMA_FIELDS):
+                continue
+            if rule is not None and rule.date == self.today:
+                for field in IQAMA_FIELDS:
+                    if field in row.iqama:
+                        setattr(rule, field, row.iqama[field])
+                updated.append(rule)
+            else:
+                created.append(IqamaTime(
+                    masjid=masjid, date=self.today, hijri_date=hijri_date_for(self.today), **row.iqama
+                ))
+        return created, updated
+
+    def apply(self):
+        """Writes the diff in one transaction and queues the follow-up jobs. Returns the number of covers queued."""
+        now = timezone.now()
+        with transaction.atomic():
+            new_addresses = []
+            for row in self.created:
+                if self.addresses[row.row_num] is None:
+                    address = Address(coordinates=Point(row.lon, row.lat, srid=4326), **row.address)
+                    self.addresses[row.row_num] = address
+                    new_addresses.append(address)
+            Address.objects.bulk_create(new_addresses, batch_size=BATCH_SIZE)
+
+            new_masjids = [
+                Masjid(address=self.addresses[row.row_num], **self.masjid_values(row)) for row in self.created
+            ]
+            Masjid.objects.bulk_create(new_masjids, batch_size=BATCH_SIZE)
+
+            fields = set()
+            for row, masjid, changed in self.updated:
+                for field in changed:
+                    setattr(masjid, field, self.masjid_values(row)[field])
+                masjid.updated_at = now
+                fields.update(changed)
+            if self.updated:
+                Masjid.objects.bulk_update(
+                    [masjid for _, masjid, _ in self.updated], [*sorted(fields), 'updated_at'], batch_size=BATCH_SIZE
+                )
+
+            pairs = list(zip(self.created, new_masjids))
+            pairs += [(row, masjid) for row, masjid, _ in self.updated] + self.unchanged
+            iqamas_created, iqamas_updated = self._iqama_changes(pairs)
+            IqamaTime.objects.bulk_create(iqamas_created, batch_size=BATCH_SIZE)
+            if iqamas_updated:
+                IqamaTime.objects.bulk_update(iqamas_updated, IQAMA_FIELDS, batch_size=BATCH_SIZE)
+            changed_ids = sorted({rule.masjid_id for rule in iqamas_created + iqamas_updated})
+            if changed_ids:
+                rebuild_masjid_schedules.delay(masjid_ids=changed_ids)
+
+            images = [] if self.skip_images else [[masjid.pk, row.image_url] for row, masjid in pairs if row.image_url]
+            for start in range(0, len(images), IMAGE_JOB_SIZE):
+                import_cover_images.delay(items=images[start:start + IMAGE_JOB_SIZE], similar=self.similar_images)
+        return len(images)
@@ -0,0 +1,237 @@
+"""
+Concurrent ingestion of masjid cover images from URLs.
+
+Each batch of URLs goes through three stages:
+
+1. Download: one pooled httpx client with at most `download_concurrency` requests
+   in flight.
+2. Decode: images not stored yet are validated, re-encoded as JPEG and perceptually
+   hashed in a process pool.
+3. Upload: the JPEGs are written to the default storage from a thread pool.
+
+Images are deduplicated by the sha256 of the downloaded bytes and, when `phash` is
+set, by their perceptual hash, so a cover served at several URLs or re-encoded by its
+source is stored once (StoredImage). Only the stored images with the hashes of a
+batch are read: by sha256, and by the indexed bands of their perceptual hash for near
+duplicates. Storage names derive from the hash, so a rerun never uploads a second copy.
+
+Every URL ingested is recorded as an ImageSource at the end of its batch. A rerun
+skips them without downloading, which makes an interrupted ingestion resumable.
+"""
+import asyncio
+import hashlib
+import os
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import httpx
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .images import DOWNLOAD_TIMEOUT, fetch_image, hash_bands, hash_distance, process_image
+from .models import ImageSource, Masjid, StoredImage
+
+DOWNLOAD_CONCURRENCY = 8
+UPLOAD_CONCURRENCY = 8
+BATCH_SIZE = 200
+PHASH_DISTANCE = 4
+# Hashes within PHASH_DISTANCE bits share one of PHASH_DISTANCE + 1 bands
+PHASH_BANDS = PHASH_DISTANCE + 1
+STORAGE_PREFIX = 'upload/masjid/covers'
+
+IngestResult = namedtuple('IngestResult', 'covers downloaded stored reused failed')
+
+
+def storage_name(sha256):
+    return f'{STORAGE_PREFIX}/{sha256[:2]}/{sha256}.jpg'
+
+
+def _upload(name, data):
+    # Left over by an interrupted run: the content is the same
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data, name=name))
+    return name
+
+
+class _Batch:
+    """
+    Downloads, decodes and uploads the images of `urls`. Only the StoredImage rows with
+    the hashes downloaded, or near duplicates of the images decoded, are read.
+    """
+
+    def __init__(self, urls, decoders, uploaders, download_concurrency, phash):
+        self.urls = urls
+        self.decoders = decoders
+        self.uploaders = uploaders
+        self.download_concurrency = download_concurrency
+        self.phash = phash
+        self.images = {}  # {sha256: StoredImage}, saved or not
+        self.resolved = {}  # {url: sha256}
+        self.failed = []  # (url, error)
+        self.downloaded = 0
+        self.new = []
+
+    def run(self):
+        downloads = asyncio.run(self._download())
+        self.images = StoredImage.objects.in_bulk(list(downloads), field_name='sha256')
+        processed = self._decode({
+            sha256: data for sha256, data in downloads.items() if sha256 not in self.images
+        })
+        similar = self._similar(processed) if self.phash else {}
+        uploads = {}
+        for sha256, image in processed.items():
+            if sha256 in similar:
+                continue
+            self.images[sha256] = StoredImage(
+                sha256=sha256, phash=image.phash, phash_bands=hash_bands(image.phash, PHASH_BANDS),
+                path=storage_name(sha256), width=image.width, height=image.height,
+            )
+            uploads[sha256] = self.uploaders.submit(_upload, self.images[sha256].path, image.jpeg)
+        for sha256, upload in uploads.items():
+            try:
+                upload.result()
+                self.new.append(self.images[sha256])
+            except Exception as e:
+                self._fail(sha256, f'{type(e).__name__}: {e}')
+        for url, sha256 in list(self.resolved.items()):
+            self.resolved[url] = similar.get(sha256, sha256)
+            # Near duplicates of an image whose upload failed
+            if self.resolved[url] not in self.images:
+                del self.resolved[url]
+                self.failed.append((url, 'Similar image failed to upload'))
+        return self
+
+    def _fail(self, sha256, error):
+        self.images.pop(sha256, None)
+        for url in [url for url, resolved in self.resolved.items() if resolved == sha256]:
+            del self.resolved[url]
+            self.failed.append((url, error))
+
+    async def _download(self):
+        """Downloads the URLs and resolves them to the sha256 of their content. Returns {sha256: bytes}."""
+        limits = httpx.Limits(
+            max_connections=self.download_concurrency, max_keepalive_connections=self.download_concurrency
+        )
+        slots = asyncio.Semaphore(self.download_concurrency)
+        downloads = {}
+
+        async def download(url):
+            try:
+                async with slots:
+                    data = await fetch_image(client, url)
+                self.downloaded += 1
+                sha256 = hashlib.sha256(data).hexdigest()
+                # URLs serving the same bytes share one decode and upload
+                downloads.setdefault(sha256, data)
+                self.resolved[url] = sha256
+            except Exception as e:
+                self.failed.append((url, f'{type(e).__name__}: {e}'))
+
+        async with httpx.AsyncClient(limits=limits, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True) as client:
+            await asyncio.gather(*(download(url) for url in self.urls))
+        return downloads
+
+    def _decode(self, downloads):
+        """Decodes the images in the decoder pool. Returns {sha256: ProcessedImage} of those that decoded."""
+        futures = {sha256: self.decoders.submit(process_image, data) for sha256, data in downloads.items()}
+        processed = {}
+        for sha256, future in futures.items():
+            try:
+                processed[sha256] = future.result()
+            except Exception as e:
+                self._fail(sha256, f'{type(e).__name__}: {e}')
+        return processed
+
+    def _similar(self, processed):
+        """
+        Maps the sha256 of each processed image having a near duplicate to the sha256 of
+        that duplicate: a stored image sharing a band of its phash, or an earlier image of
+        the batch. Stored candidates are added to `images`.
+        """
+        bands = {band for image in processed.values() for band in hash_bands(image.phash, PHASH_BANDS)}
+        candidates = list(StoredImage.objects.filter(phash_bands__overlap=sorted(bands))) if bands else []
+        self.images.update((image.sha256, image) for image in candidates)
+        candidates = [(image.sha256, image.phash) for image in candidates]
+        similar = {}
+        for sha256, image in processed.items():
+            match = next(
+                (other for other, phash in candidates if hash_distance(phash, image.phash) <= PHASH_DISTANCE),
+                None,
+            )
+            if match is None:
+                candidates.append((sha256, image.phash))
+            else:
+                similar[sha256] = match
+        return similar
+
+
+def _save(batch, masjids_by_url):
+    """Records the images and sources of a batch and sets the covers. Returns the ids of the masjids updated."""
+    with transaction.atomic():
+        StoredImage.objects.bulk_create(batch.new, ignore_conflicts=True)
+        ids = dict(StoredImage.objects.filter(sha256__in=set(batch.resolved.values())).values_list('sha256', 'id'))
+        ImageSource.objects.bulk_create(
+            [ImageSource(url=url, image_id=ids[sha256]) for url, sha256 in batch.resolved.items()],
+            update_conflicts=True, unique_fields=['url'], update_fields=['image'],
+        )
+        covers = {
+            masjid_id: batch.images[sha256].path
+            for url, sha256 in batch.resolved.items()
+            for masjid_id in masjids_by_url[url]
+        }
+        return _set_covers(covers)
+
+
+def _set_covers(covers):
+    """Sets {masjid id: storage name} as covers, skipping masjids already using them. Returns their ids."""
+    now = timezone.now()
+    masjids = []
+    for masjid in Masjid.objects.filter(pk__in=covers).only('id', 'cover'):
+        if masjid.cover.name != covers[masjid.pk]:
+            masjid.cover = covers[masjid.pk]
+            masjid.updated_at = now
+            masjids.append(masjid)
+    Masjid.objects.bulk_update(masjids, ['cover', 'updated_at'], batch_size=BATCH_SIZE)
+    return [masjid.pk for masjid in masjids]
+
+
+def ingest_covers(items, phash=False, download_concurrency=DOWNLOAD_CONCURRENCY, decode_workers=None,
+                  upload_concurrency=UPLOAD_CONCURRENCY, batch_size=BATCH_SIZE):
+    """
+    Sets the image at each URL of (masjid id, URL) `items` as the masjid cover.
+    Images are decoded in `decode_workers` processes (one per CPU by default, in a
+    thread when 1). URLs already ingested are not downloaded again.
+    Returns an IngestResult; `covers` lists the ids of the masjids whose cover changed and
+    `failed` (URL, error) pairs, left to a later run.
+    """
+    masjids_by_url = defaultdict(list)
+    for masjid_id, url in items:
+        masjids_by_url[url].append(masjid_id)
+
+    sources = dict(
+        ImageSource.objects.filter(url__in=masjids_by_url).values_list('url', 'image__path')
+    )
+    covers = _set_covers({
+        masjid_id: sources[url] for url, masjid_ids in masjids_by_url.items() if url in sources
+        for masjid_id in masjid_ids
+    })
+    pending = [url for url in masjids_by_url if url not in sources]
+    downloaded, stored, reused, failed = 0, 0, len(sources), []
+    if not pending:
+        return IngestResult(covers, downloaded, stored, reused, failed)
+
+    decode_workers = decode_workers or os.cpu_count() or 1
+    decoders = ProcessPoolExecutor(decode_workers) if decode_workers > 1 else ThreadPoolExecutor(1)
+    with decoders, ThreadPoolExecutor(upload_concurrency) as uploaders:
+        for start in range(0, len(pending), batch_size):
+            batch = _Batch(
+                pending[start:start + batch_size], decoders, uploaders, download_concurrency, phash
+            ).run()
+            covers += _save(batch, masjids_by_url)
+            downloaded += batch.downloaded
+            stored += len(batch.new)
+            reused += len(batch.resolved) - len(batch.new)
+            failed += batch.failed
+    return IngestResult(covers, downloaded, stored, reused, failed)
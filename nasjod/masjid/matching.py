@@ -0,0 +1,67 @@
+"""
+Matching of points, such as the rows of a CSV file, to the masjids around them.
+
+All the points are matched in one query: they are sent as arrays, unnested on the
+server and joined to the addresses whose bounding box overlaps theirs, which uses the
+spatial index on core_address.coordinates. The distance is then checked in meters on
+the geography type, so the radius does not depend on the latitude.
+"""
+import math
+from collections import namedtuple
+
+from django.db import connection
+
+from core.models import Address
+from .models import Masjid
+
+Candidate = namedtuple('Candidate', 'masjid_id name distance')
+
+# Meters per degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE_LAT = 110_574
+METERS_PER_DEGREE_LON = 111_320
+
+
+def _margins(lat, radius):
+    """Half sides in degrees of a box containing the circle of `radius` meters around a point at `lat`."""
+    dy = radius / METERS_PER_DEGREE_LAT * 1.01
+    dx = radius / (METERS_PER_DEGREE_LON * max(math.cos(math.radians(lat)), 0.01)) * 1.01
+    return dx, dy
+
+
+def match_points(points, radius):
+    """
+    Masjids within `radius` meters of each (key, lon, lat) point, keys being integers.
+    Returns {key: [Candidate, nearest first]}; points without any masjid are left out.
+    """
+    points = list(points)
+    if not points:
+        return {}
+    keys, lons, lats, dxs, dys = [], [], [], [], []
+    for key, lon, lat in points:
+        dx, dy = _margins(lat, radius)
+        keys.append(key)
+        lons.append(lon)
+        lats.append(lat)
+        dxs.append(dx)
+        dys.append(dy)
+
+    quote = connection.ops.quote_name
+    sql = f"""
+        WITH points AS (
+            SELECT key, ST_SetSRID(ST_MakePoint(lon, lat), 4326) AS geom, dx, dy
+            FROM unnest(%s::bigint[], %s::float8[], %s::float8[], %s::float8[], %s::float8[])
+                AS p(key, lon, lat, dx, dy)
+        )
+        SELECT p.key, m.id, m.name, ST_Distance(a.coordinates::geography, p.geom::geography) AS distance
+        FROM points p
+        JOIN {quote(Address._meta.db_table)} a ON a.coordinates && ST_Expand(p.geom, p.dx, p.dy)
+        JOIN {quote(Masjid._meta.db_table)} m ON m.address_id = a.id
+        WHERE ST_DWithin(a.coordinates::geography, p.geom::geography, %s)
+        ORDER BY p.key, distance, m.id
+    """
+    matches = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [keys, lons, lats, dxs, dys, radius])
+        for key, masjid_id, name, distance in cursor.fetchall():
+            matches.setdefault(key, []).append(Candidate(masjid_id, name, distance))
+    return matches
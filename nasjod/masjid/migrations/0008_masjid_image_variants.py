@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("masjid", "0007_storedimage_imagesource"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="masjid",
+            name="cover_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="masjid",
+            name="photo_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0 on 2026-10-19 21:10
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+from masjid.images import hash_bands
+
+# PHASH_DISTANCE + 1 in masjid/ingest.py when this migration was written
+PHASH_BANDS = 5
+
+
+def fill_phash_bands(apps, schema_editor):
+    StoredImage = apps.get_model("masjid", "StoredImage")
+    images = list(StoredImage.objects.exclude(phash="").only("id", "phash"))
+    for image in images:
+        image.phash_bands = hash_bands(image.phash, PHASH_BANDS)
+    StoredImage.objects.bulk_update(images, ["phash_bands"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("masjid", "0008_masjid_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storedimage",
+            name="phash_bands",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=20),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="storedimage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["phash_bands"], name="storedimage_phash_bands_idx"
+            ),
+        ),
+        migrations.RunPython(fill_phash_bands, migrations.RunPython.noop),
+    ]
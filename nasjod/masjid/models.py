@@ -2,6 +2,8 @@ import phonenumbers
 from hijri_converter import Gregorian
 
 from django.db import models, transaction
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db.models.signals import m2m_changed, post_delete
@@ -29,6 +31,9 @@ class Masjid(ObjectBase):
     telephone = models.CharField(max_length=20, null=True, blank=True)
     photo = models.ImageField(null=True, blank=True, upload_to=image_path_upload)
     cover = models.ImageField(null=True, blank=True, upload_to=image_path_upload)
+    # Derivatives of the photo and cover, see masjid/variants.py
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     size = models.CharField(max_length=1, choices=SIZE_CHOICES, default='M')
 
     # Boolean fields
@@ -161,3 +166,35 @@ class SuggestionMasjidModification(ObjectBase):
 
     def __str__(self):
         return self.name
+
+
+class StoredImage(models.Model):
+    """
+    An image stored once in the default storage, under a name derived from its content
+    hash, however many masjids or source URLs use it (see masjid/ingest.py).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    # 64 bit difference hash as 16 hex digits, to find near duplicates
+    phash = models.CharField(max_length=16, blank=True, default='')
+    # Bands of the phash (see masjid.images.hash_bands), indexed to look up near duplicates
+    phash_bands = ArrayField(models.CharField(max_length=20), blank=True, default=list, editable=False)
+    path = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [GinIndex(fields=['phash_bands'], name='storedimage_phash_bands_idx')]
+
+    def __str__(self):
+        return self.path
+
+
+class ImageSource(models.Model):
+    """A URL already ingested, so that later imports reuse its StoredImage without downloading it."""
+    url = models.URLField(max_length=1000, unique=True)
+    image = models.ForeignKey(StoredImage, related_name='sources', on_delete=models.CASCADE)
+    fetched_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.url
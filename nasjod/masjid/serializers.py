@@ -1,17 +1,17 @@
 from datetime import date, timedelta
 
-from django.db import transaction
 from django.contrib.auth import get_user_model
-from core._consts import TUNISIA_PRAYER_TIMES_CITIES
-from django.conf import settings
 from core._helpers import get_next_friday
 from rest_framework import serializers
 
 from .models import Masjid, SuggestionMasjidModification
+from .tasks import relink_prayer_times
+from .variants import is_stale, variant_urls
 from core.models import Address
 from core.serializers import AddressSerializer
-from prayertime.models import EidPrayerTime, IqamaTime, JumuahPrayerTime, PrayerTime
-from prayertime.serializers import EidPrayerTimeSerializer, IqamaTimeMasjidSerializer, IqamaTimeSerializer, JumuahPrayerTimeMasjidSerializer, JumuahPrayerTimeSerializer, PrayerTimeMasjidSerializer
+from prayertime import timetable
+from prayertime.models import DailySchedule, EidPrayerTime, IqamaTime, JumuahPrayerTime, PrayerTime
+from prayertime.serializers import CurrentIqamaListSerializer, DailyScheduleSerializer, EidPrayerTimeSerializer, IqamaTimeMasjidSerializer, IqamaTimeSerializer, JumuahPrayerTimeMasjidSerializer, JumuahPrayerTimeSerializer, PrayerTimeMasjidSerializer
 
 
 User = get_user_model()
@@ -31,8 +31,11 @@ class MasjidSerializer(serializers.ModelSerializer):
     jumuah_prayer_times = JumuahPrayerTimeMasjidSerializer(many=True, required=False)
     eid_prayer_times = EidPrayerTimeSerializer(many=True, read_only=True)
     today_prayer_times = serializers.SerializerMethodField()
-    iqamas = IqamaTimeMasjidSerializer(many=True, required=False)
+    today_schedule = serializers.SerializerMethodField()
+    iqamas = CurrentIqamaListSerializer(child=IqamaTimeMasjidSerializer(), required=False)
     jumuah_prayer_time_this_week = serializers.SerializerMethodField()
+    cover_sizes = serializers.SerializerMethodField()
+    cover_lqip = serializers.SerializerMethodField()
 
     class Meta:
         model = Masjid
@@ -43,6 +46,8 @@ class MasjidSerializer(serializers.ModelSerializer):
             'are_infos_complete',
             'address',
             'cover',
+            'cover_sizes',
+            'cover_lqip',
             'size',
             'parking',
             'disabled_access',
@@ -57,6 +62,7 @@ class MasjidSerializer(serializers.ModelSerializer):
             'jumuah_prayer_times',
             'eid_prayer_times',
             'today_prayer_times',
+            'today_schedule',
             'iqamas',
             'jumuah_prayer_time_this_week',
         ]
@@ -65,11 +71,29 @@ class MasjidSerializer(serializers.ModelSerializer):
             'are_infos_complete',
         ]
 
+    def get_cover_sizes(self, obj):
+        # thumbnail, card and full renditions of the cover in WebP and JPEG, None until rendered
+        if not obj.cover or is_stale(obj, 'cover'):
+            return None
+        request = self.context.get('request')
+        return variant_urls(obj.cover_variants, request.build_absolute_uri if request else None)
+
+    def get_cover_lqip(self, obj):
+        if not obj.cover or is_stale(obj, 'cover'):
+            return None
+        return obj.cover_variants.get('lqip')
+
     def get_today_prayer_times(self, obj):
         today = date.today()
-        prayer_times = PrayerTime.objects.filter(masjids=obj, date=today)
+        # Read from the memory-mapped timetable shared by the workers, Postgres when it is missing or stale
+        mapped = timetable.masjid_prayer_times([obj.pk], [today])
+        prayer_times = mapped[obj.pk] if mapped is not None else PrayerTime.objects.filter(masjids=obj, date=today)
         return PrayerTimeMasjidSerializer(prayer_times, many=True).data
 
+    def get_today_schedule(self, obj):
+        schedule = DailySchedule.objects.filter(masjid=obj, date=date.today()).first()
+        return DailyScheduleSerializer(schedule).data if schedule else None
+
     def get_jumuah_prayer_time_this_week(self, obj):
 
         # Filter JumuahPrayerTime for this mosque and the calculated upcoming Friday
@@ -123,16 +147,9 @@ class MasjidSerializer(serializers.ModelSerializer):
 
         # Now create the Masjid with the retrieved or newly created address
         
-        # If the address has a city, update the prayer times based on city changes
+        # If the address has a city, link the Masjid to the PrayerTimes of its city in the background
         if masjid.address and masjid.address.city:
-            # 2. Link the Masjid to PrayerTimes in the new city
-            city_to_use = masjid.address.city
-            # Special handling to use main cities for prayer times
-            if settings.USE_MAIN_CITY_FOR_PRAYER_TIMES:
-                city_to_use = TUNISIA_PRAYER_TIMES_CITIES.get(masjid.address.state.lower())
-            matching_prayer_times = PrayerTime.objects.filter(location__city__iexact=city_to_use)
-            with transaction.atomic():
-                masjid.prayertime_set.add(*matching_prayer_times)
+            relink_prayer_times.delay(masjid_id=masjid.pk)
         return masjid
 
     def update(self, instance, validated_data):
@@ -143,22 +160,10 @@ class MasjidSerializer(serializers.ModelSerializer):
                 setattr(address, attr, value)
             address.save()
 
-         # If the address has a city, update the prayer times based on city changes
+        # If the address has a city, relink the prayer times in the background: links to
+        # the old city are removed and the new city linked
         if instance.address and instance.address.city:
-            # 1. Find mismatched PrayerTimes (old city)
-            mismatched_prayer_times = PrayerTime.objects.filter(
-                masjids=instance
-            ).exclude(location__city=instance.address.city)
-
-            # Bulk remove using `remove(*mismatched_prayer_times)`
-            if mismatched_prayer_times:
-                with transaction.atomic():
-                    instance.prayertime_set.remove(*mismatched_prayer_times)
-
-            # 2. Link the Masjid to PrayerTimes in the new city
-            matching_prayer_times = PrayerTime.objects.filter(location__city__iexact=instance.address.city)
-            with transaction.atomic():
-                instance.prayertime_set.add(*matching_prayer_times)
+            relink_prayer_times.delay(masjid_id=instance.pk)
         return super().update(instance, validated_data)
 
 
@@ -0,0 +1,17 @@
+"""
+Queues the rendering of cover and photo derivatives when a masjid image changes
+through the ORM. Bulk writes that bypass signals (masjid.ingest) queue it themselves.
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Masjid
+from .tasks import generate_image_variants
+from .variants import IMAGE_FIELDS, is_stale
+
+
+@receiver(post_save, sender=Masjid)
+def render_variants_on_image_change(sender, instance, update_fields=None, **kwargs):
+    fields = IMAGE_FIELDS if update_fields is None else [field for field in IMAGE_FIELDS if field in update_fields]
+    if any(is_stale(instance, field) for field in fields):
+        generate_image_variants.delay(masjid_ids=[instance.pk])
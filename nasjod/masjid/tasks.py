@@ -0,0 +1,107 @@
+"""
+Background tasks for masjids, run by `manage.py run_worker` (see core/jobs.py).
+"""
+from django.utils import timezone
+
+from core._helpers import get_next_friday
+from core.jobs import task
+from prayertime.iqamas import IQAMA_FIELDS, bulk_upsert, rule_in_force
+from prayertime.linking import prayer_times_city, set_prayer_times, zone_location_ids
+from prayertime.models import JumuahPrayerTime
+
+from .ingest import ingest_covers
+from .variants import generate
+from .models import Masjid, SuggestionMasjidModification
+
+
+@task(priority=10, dedup_key='relink-prayer-times:{masjid_id}')
+def relink_prayer_times(masjid_id):
+    """Links the masjid to the prayer times of its city, removing links to any other city."""
+    masjid = Masjid.objects.select_related('address').filter(pk=masjid_id).first()
+    if masjid is None or masjid.address is None or not masjid.address.city:
+        return
+    set_prayer_times([masjid.pk], zone_location_ids(city__iexact=prayer_times_city(masjid.address)))
+
+
+def _finish_ingest(result):
+    # The covers were set with bulk_update, which sends no post_save
+    if result.covers:
+        generate_image_variants.delay(masjid_ids=result.covers)
+    # Retried with backoff; the images already ingested are not downloaded again
+    if result.failed:
+        raise RuntimeError('; '.join(f'{url}: {error}' for url, error in result.failed))
+
+
+@task(max_attempts=5, dedup_key='import-cover-image:{masjid_id}')
+def import_cover_image(masjid_id, url):
+    """Downloads the image at `url`, re-encodes it as JPEG and sets it as the masjid cover."""
+    _finish_ingest(ingest_covers([(masjid_id, url)], decode_workers=1))
+
+
+@task(max_attempts=5)
+def import_cover_images(items, similar=False):
+    """
+    import_cover_image for many [masjid id, URL] pairs, through the concurrent pipeline of
+    masjid/ingest.py. With `similar`, covers looking like a stored image reuse it.
+    """
+    _finish_ingest(ingest_covers(items, phash=similar))
+
+
+@task(priority=-5)
+def generate_image_variants(masjid_ids):
+    """Renders the responsive derivatives of the masjids' cover and photo when stale (see masjid/variants.py)."""
+    generate(Masjid.objects.filter(pk__in=masjid_ids))
+
+
+@task(priority=20, dedup_key='accept-suggestion:{suggestion_id}')
+def accept_suggestion(suggestion_id):
+    """Applies a SuggestionMasjidModification to its masjid, its iqama rules and its jumuah times."""
+    suggestion = SuggestionMasjidModification.objects.select_related('suggestion_masjid').get(pk=suggestion_id)
+    masjid = suggestion.suggestion_masjid
+    if not masjid:
+        raise ValueError(f"Suggestion {suggestion.name} does not have a linked Masjid.")
+
+    # Update Masjid fields
+    masjid_fields = {
+        'name': suggestion.name,
+        'telephone': suggestion.telephone,
+        'size': suggestion.size,
+        'cover': suggestion.cover,
+        'parking': suggestion.parking,
+        'disabled_access': suggestion.disabled_access,
+        'ablution_room': suggestion.ablution_room,
+        'woman_space': suggestion.woman_space,
+        'adult_courses': suggestion.adult_courses,
+        'children_courses': suggestion.children_courses,
+        'salat_al_eid': suggestion.salat_al_eid,
+        'salat_al_janaza': suggestion.salat_al_janaza,
+        'iftar_ramadhan': suggestion.iftar_ramadhan,
+        'itikef': suggestion.itikef,
+    }
+    # Only update fields that are not empty
+    for field, value in masjid_fields.items():
+        if value not in [None, '', False]:
+            setattr(masjid, field, value)
+    masjid.save()
+
+    # Iqama times are effective-dated rules: the suggested times take effect today, the
+    # other times of the rule in force are kept, and a rule already dated today is updated
+    suggested = {
+        field: getattr(suggestion, field)
+        for field in ('fajr_iqama', 'dhuhr_iqama', 'asr_iqama', 'maghrib_iqama', 'isha_iqama')
+        if getattr(suggestion, field) is not None
+    }
+    if suggested:
+        today = timezone.localdate()
+        rule = rule_in_force(masjid.pk, today)
+        values = {field: getattr(rule, field) for field in IQAMA_FIELDS} if rule else {}
+        bulk_upsert([{'masjid': masjid.uuid, 'date': today, **values, **suggested}], {masjid.uuid: masjid.pk})
+
+    # Jumuah times are dated rows too: the suggested time is set on the coming Friday
+    if suggestion.jumuah_time:
+        JumuahPrayerTime.objects.update_or_create(
+            masjid=masjid,
+            date=get_next_friday(),
+            jumuah_time=suggestion.jumuah_time,
+            defaults={'first_timeslot_jumuah': suggestion.first_timeslot_jumuah},
+        )
@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+from core.models import Address
+from prayertime.models import IqamaTime
+from ..importer import Import, parse_dhuhr_iqama, parse_rows
+from ..models import Masjid
+
+TODAY = date(2025, 3, 1)
+
+
+def csv_row(**values):
+    row = {'name_en': 'Kasbah Mosque', 'governorate': 'Tunis', 'lat': '36.7992', 'lon': '10.1686',
+           'fajr_iqama': '20', 'dhuhr_iqama': '-15', 'image1': ''}
+    row.update(values)
+    return row
+
+
+def test_parse_rows_reports_invalid_and_duplicate_rows():
+    parsed, errors = parse_rows([
+        (2, csv_row()),
+        (3, csv_row(name_en='Qods Mosque', lat='north')),
+        (4, csv_row(name_en='Copy')),
+        (5, csv_row(name_en='', lat='36.8', lon='10.2')),
+    ])
+
+    assert [row.row_num for row in parsed] == [2]
+    assert parsed[0].address['city'] == 'tunis'
+    assert parsed[0].iqama == {'fajr_iqama': 20, 'dhuhr_iqama_from_asr': 15}
+    assert [(error.row_num, error.error) for error in errors] == [
+        (3, 'Invalid coordinates'), (4, 'Same coordinates as row 2'), (5, 'Missing required field: name_en'),
+    ]
+
+
+def test_parse_dhuhr_iqama_formats():
+    assert parse_dhuhr_iqama('13:05')['type'] == 'time'
+    assert parse_dhuhr_iqama('+10') == {'type': 'positive_int', 'value': 10}
+    assert parse_dhuhr_iqama('-10') == {'type': 'negative_int', 'value': -10}
+    assert parse_dhuhr_iqama('soon') == {'type': None, 'value': None}
+
+
+@pytest.mark.django_db
+def test_import_diffs_and_applies_in_bulk():
+    parsed, _ = parse_rows([(2, csv_row()), (3, csv_row(name_en='Qods Mosque', lat='36.8', lon='10.2'))])
+    Import(parsed, skip_images=True, today=TODAY).apply()
+
+    assert Masjid.objects.count() == 2
+    assert Address.objects.get(address_masjid__name='Kasbah Mosque').city == 'tunis'
+    assert IqamaTime.objects.filter(date=TODAY).count() == 2
+
+    parsed, _ = parse_rows([(2, csv_row(phone='71000000')), (3, csv_row(name_en='Qods Mosque', lat='36.8', lon='10.2'))])
+    staged = Import(parsed, skip_images=True, today=TODAY)
+    assert [row.row_num for row, _, _ in staged.updated] == [2]
+    assert [row.row_num for row, _ in staged.unchanged] == [3]
+    staged.apply()
+
+    assert Masjid.objects.get(name='Kasbah Mosque').telephone == '71000000'
+    assert IqamaTime.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_import_rejects_another_name_at_an_existing_address():
+    parsed, _ = parse_rows([(2, csv_row())])
+    Import(parsed, skip_images=True).apply()
+
+    parsed, _ = parse_rows([(2, csv_row(name_en='Renamed Mosque'))])
+    staged = Import(parsed, skip_images=True)
+
+    assert [error.error for error in staged.errors] == ['A Masjid with this address already exists.']
+    assert not staged.created and not staged.updated
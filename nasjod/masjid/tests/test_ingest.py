@@ -0,0 +1,112 @@
+import io
+
+import pytest
+from PIL import Image
+from django.core.files.storage import FileSystemStorage
+
+from core.models import Address
+from .. import ingest
+from ..images import hash_bands, hash_distance, process_image
+from ..models import ImageSource, Masjid, StoredImage
+
+
+def png(kind, size=(64, 48)):
+    if kind == 'radial':
+        image = Image.radial_gradient('L')
+    else:
+        image = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100)
+    output = io.BytesIO()
+    image.resize(size).convert('RGB').save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def images(monkeypatch, tmp_path):
+    served, fetched = {}, []
+
+    async def fetch_image(client, url):
+        fetched.append(url)
+        if url not in served:
+            raise ValueError(f"URL does not point to an image: {url}")
+        return served[url]
+
+    monkeypatch.setattr(ingest, 'fetch_image', fetch_image)
+    monkeypatch.setattr(ingest, 'default_storage', FileSystemStorage(location=tmp_path))
+    return served, fetched
+
+
+@pytest.fixture
+def masjids(address):
+    other = Address.objects.create(city="Sfax", country="Tunisia", coordinates="POINT (10.76 34.74)")
+    return [
+        Masjid.objects.create(name="Sakiet Eddayer Mosque", address=address),
+        Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=other),
+    ]
+
+
+def test_process_image_reencodes_and_hashes():
+    processed = process_image(png('radial'))
+
+    assert processed.jpeg.startswith(b'\xff\xd8')
+    assert (processed.width, processed.height) == (64, 48)
+    assert hash_distance(processed.phash, process_image(png('radial', (128, 96))).phash) <= ingest.PHASH_DISTANCE
+    assert hash_distance(processed.phash, process_image(png('mandelbrot')).phash) > ingest.PHASH_DISTANCE
+
+
+def test_hash_bands_are_shared_by_near_duplicates():
+    phash = process_image(png('radial')).phash
+    bands = set(hash_bands(phash, ingest.PHASH_BANDS))
+
+    assert len(bands) == ingest.PHASH_BANDS
+    assert bands & set(hash_bands(process_image(png('radial', (128, 96))).phash, ingest.PHASH_BANDS))
+    flipped = f'{int(phash, 16) ^ 0b1000100010001:016x}'
+    assert bands & set(hash_bands(flipped, ingest.PHASH_BANDS))
+
+
+@pytest.mark.django_db
+def test_ingest_covers_stores_identical_images_once(images, masjids, tmp_path):
+    served, fetched = images
+    served['https://example.com/a.png'] = served['https://example.com/b.png'] = png('radial')
+
+    result = ingest.ingest_covers(
+        [(masjids[0].pk, 'https://example.com/a.png'), (masjids[1].pk, 'https://example.com/b.png')],
+        decode_workers=1,
+    )
+
+    assert (len(result.covers), result.downloaded, result.stored, result.reused) == (2, 2, 1, 1)
+    image = StoredImage.objects.get()
+    assert (tmp_path / image.path).exists()
+    assert {masjid.cover.name for masjid in Masjid.objects.all()} == {image.path}
+    assert ImageSource.objects.filter(image=image).count() == 2
+
+
+@pytest.mark.django_db
+def test_ingest_covers_resumes_without_downloading_again(images, masjids):
+    served, fetched = images
+    served['https://example.com/a.png'] = png('radial')
+    items = [(masjids[0].pk, 'https://example.com/a.png'), (masjids[1].pk, 'https://example.com/b.png')]
+
+    result = ingest.ingest_covers(items, decode_workers=1)
+    assert [url for url, _ in result.failed] == ['https://example.com/b.png']
+
+    served['https://example.com/b.png'] = png('mandelbrot')
+    fetched.clear()
+    result = ingest.ingest_covers(items, decode_workers=1)
+
+    assert fetched == ['https://example.com/b.png']
+    assert (result.stored, result.reused, result.failed) == (1, 1, [])
+    assert StoredImage.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_ingest_covers_reuses_similar_images_with_phash(images, masjids):
+    served, _ = images
+    served['https://example.com/a.png'] = png('radial')
+    served['https://example.com/a-large.png'] = png('radial', (128, 96))
+
+    ingest.ingest_covers([(masjids[0].pk, 'https://example.com/a.png')], decode_workers=1)
+    result = ingest.ingest_covers([(masjids[1].pk, 'https://example.com/a-large.png')], phash=True, decode_workers=1)
+
+    assert (result.stored, result.reused) == (0, 1)
+    assert StoredImage.objects.count() == 1
+    assert Masjid.objects.get(pk=masjids[1].pk).cover.name == StoredImage.objects.get().path
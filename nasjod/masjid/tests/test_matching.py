@@ -0,0 +1,47 @@
+from datetime import date, time
+
+import pytest
+
+from core.models import Address
+from prayertime.jumuah import add_times
+from prayertime.models import JumuahPrayerTime
+from ..matching import match_points
+from ..models import Masjid
+
+FRIDAY = date(2025, 3, 7)
+
+
+@pytest.fixture
+def neighbour(masjid):
+    # About 50m east of the masjid fixture
+    address = Address.objects.create(city="Sakiet Eddaier", country="Tunisia",
+                                     coordinates="POINT (10.7806 34.79051319533724)")
+    return Masjid.objects.create(name="Masjid Ennour", address=address)
+
+
+@pytest.mark.django_db
+def test_match_points_in_meters_nearest_first(masjid, neighbour):
+    matches = match_points([
+        (2, 10.780081214495699, 34.79051319533724),
+        (3, 10.7812, 34.7905),
+        (4, 10.9, 34.9),
+    ], radius=100)
+
+    assert [candidate.masjid_id for candidate in matches[2]] == [masjid.pk, neighbour.pk]
+    assert matches[2][0].distance < 1 and 40 < matches[2][1].distance < 60
+    assert [candidate.masjid_id for candidate in matches[3]] == [neighbour.pk]
+    assert 4 not in matches
+
+
+@pytest.mark.django_db
+def test_add_times_creates_missing_times_and_clears_first_timeslot(masjid, neighbour):
+    JumuahPrayerTime.objects.create(masjid=masjid, date=FRIDAY, jumuah_time=time(13), first_timeslot_jumuah=True)
+
+    created, updated = add_times({masjid.pk: [time(13), time(14)], neighbour.pk: [time(12, 45)]}, FRIDAY)
+
+    assert (created, updated) == (2, 1)
+    rows = JumuahPrayerTime.objects.filter(date=FRIDAY).order_by('jumuah_time')
+    assert [(row.masjid_id, row.jumuah_time, row.first_timeslot_jumuah) for row in rows] == [
+        (neighbour.pk, time(12, 45), False), (masjid.pk, time(13), False), (masjid.pk, time(14), False),
+    ]
+    assert rows[0].hijri_date
@@ -0,0 +1,27 @@
+import pytest
+from datetime import date, time
+
+from django.utils import timezone
+
+from core._helpers import get_next_friday
+from prayertime.models import IqamaTime, JumuahPrayerTime
+from ..models import SuggestionMasjidModification
+from ..tasks import accept_suggestion
+
+
+@pytest.mark.django_db
+def test_accept_suggestion_adds_rules_dated_from_today(masjid):
+    IqamaTime.objects.create(masjid=masjid, date=date(2024, 1, 1), fajr_iqama=20, isha_iqama=10)
+    IqamaTime.objects.create(masjid=masjid, date=date(2024, 6, 1), fajr_iqama=25, isha_iqama=15)
+    suggestion = SuggestionMasjidModification.objects.create(
+        name="Sakiet Eddayer Mosque", suggestion_masjid=masjid, fajr_iqama=30, jumuah_time=time(13, 0),
+    )
+
+    accept_suggestion(suggestion_id=suggestion.pk)
+    accept_suggestion(suggestion_id=suggestion.pk)
+
+    rule = IqamaTime.objects.get(masjid=masjid, date=timezone.localdate())
+    assert (rule.fajr_iqama, rule.isha_iqama) == (30, 15)
+    assert IqamaTime.objects.filter(masjid=masjid).count() == 3
+    jumuah = JumuahPrayerTime.objects.get(masjid=masjid)
+    assert (jumuah.date, jumuah.jumuah_time) == (get_next_friday(), time(13, 0))
@@ -0,0 +1,90 @@
+import io
+
+import pytest
+from PIL import Image
+from django.core.files.storage import FileSystemStorage
+
+from core.models import Address, Job
+from .. import variants
+from ..models import Masjid
+from ..serializers import MasjidSerializer
+from ..tasks import generate_image_variants
+
+COVER = 'upload/masjid/cover.jpg'
+
+
+def jpeg(size=(2000, 1500)):
+    output = io.BytesIO()
+    Image.radial_gradient('L').resize(size).convert('RGB').save(output, format='JPEG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    storage = FileSystemStorage(location=tmp_path)
+    monkeypatch.setattr(variants, 'default_storage', storage)
+    storage.save(COVER, io.BytesIO(jpeg()))
+    return storage
+
+
+def test_render_fits_sizes_and_makes_a_tiny_placeholder():
+    renditions, lqip = variants.render(jpeg())
+
+    assert {size: (width, height) for size, (width, height, _) in renditions.items()} == {
+        'thumbnail': (160, 120), 'card': (480, 360), 'full': (1280, 960),
+    }
+    assert set(renditions['card'][2]) == {'webp', 'jpeg'}
+    assert lqip.startswith('data:image/jpeg;base64,') and len(lqip) < 1000
+
+
+def test_render_never_enlarges():
+    renditions, _ = variants.render(jpeg((300, 200)))
+
+    assert renditions['card'][:2] == (300, 200)
+
+
+@pytest.mark.django_db
+def test_generate_stores_derivatives_and_serializer_exposes_them(storage, masjid):
+    Masjid.objects.filter(pk=masjid.pk).update(cover=COVER)
+    masjid.refresh_from_db()
+
+    assert variants.generate([masjid]) == 1
+    masjid.refresh_from_db()
+    card = masjid.cover_variants['sizes']['card']
+    assert masjid.cover_variants['source'] == COVER
+    assert card['webp'] == 'upload/masjid/cover_card.webp'
+    assert storage.exists(card['jpeg'])
+    assert variants.generate([masjid]) == 0
+
+    data = MasjidSerializer(masjid).data
+    assert data['cover_sizes']['card']['webp'].endswith('upload/masjid/cover_card.webp')
+    assert data['cover_lqip'] == masjid.cover_variants['lqip']
+
+
+@pytest.mark.django_db
+def test_generate_skips_images_that_cannot_be_rendered(storage, masjid):
+    storage.save('upload/masjid/broken.jpg', io.BytesIO(b'not an image'))
+    other = Masjid.objects.create(name="Masjid El Kasbah", address=Address.objects.create(
+        city="Sfax Ville", state="Sfax", country="Tunisia", coordinates="POINT (10.762000 34.741000)"
+    ))
+    Masjid.objects.filter(pk=masjid.pk).update(cover=COVER, photo='https://example.com/photo.jpg')
+    Masjid.objects.filter(pk=other.pk).update(cover='upload/masjid/broken.jpg')
+    masjid.refresh_from_db()
+    other.refresh_from_db()
+
+    assert variants.generate([masjid, other]) == 1
+    masjid.refresh_from_db()
+    assert masjid.cover_variants['source'] == COVER
+    assert masjid.photo_variants == {}
+
+
+@pytest.mark.django_db
+def test_changing_the_cover_queues_the_rendering(masjid):
+    Job.objects.all().delete()
+
+    masjid.save()
+    assert not Job.objects.filter(name=generate_image_variants.task_name).exists()
+
+    masjid.cover = COVER
+    masjid.save(update_fields=['cover'])
+    assert Job.objects.get(name=generate_image_variants.task_name).payload == {'masjid_ids': [masjid.pk]}
@@ -11,5 +11,7 @@ router.register(r'suggestions-modification-masjid', SuggestionMasjidModification
 
 
 urlpatterns = [
+    # Calendar apps subscribe to the feed without the trailing slash of the router's URL
+    path('masajid/<uuid:uuid>/calendar.ics', MasjidViewSet.as_view({'get': 'calendar'}), name='masjid-calendar'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,172 @@
+"""
+Responsive derivatives of the masjid cover and photo.
+
+Each image is rendered at SIZES (longest edge in pixels, never enlarged) in WebP and
+JPEG, stored next to the original as `<name>_<size>.<ext>`, and described on the
+masjid row (`cover_variants`, `photo_variants`):
+
+    {"source": "upload/masjid/covers/ab/ab12....jpg",
+     "lqip": "data:image/jpeg;base64,...",
+     "sizes": {"thumbnail": {"width": 160, "height": 120, "webp": "...", "jpeg": "..."}, ...}}
+
+`source` is the image the derivatives were rendered from: they are stale once the
+field points elsewhere. `lqip` is a blurred placeholder of a few hundred bytes shown
+while a size loads. Rendering runs in the worker (generate_image_variants), never in
+a request. An image that cannot be read or decoded is logged and skipped, its masjid
+keeping its previous derivatives.
+"""
+import base64
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageFilter, ImageOps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Masjid
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = ('cover', 'photo')
+SIZES = {'thumbnail': 160, 'card': 480, 'full': 1280}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+LQIP_SIZE = 16
+BATCH_SIZE = 50
+
+
+def variants_field(field):
+    return f'{field}_variants'
+
+
+def variant_name(source, size, fmt):
+    root, _ = os.path.splitext(source)
+    return f'{root}_{size}.{EXTENSIONS[fmt]}'
+
+
+def is_stale(masjid, field):
+    """Whether the derivatives of `field` were not rendered from its current image."""
+    return (getattr(masjid, field).name or '') != getattr(masjid, variants_field(field)).get('source', '')
+
+
+def _encode(image, fmt):
+    pil_format, options = FORMATS[fmt]
+    output = io.BytesIO()
+    image.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def render(image_data):
+    """
+    Renders the derivatives of an image. Returns ({size: (width, height, {format: bytes})},
+    lqip data URI). Pure, so it runs in worker processes.
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_data)))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    renditions = {}
+    for size, edge in SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        renditions[size] = (resized.width, resized.height, {fmt: _encode(resized, fmt) for fmt in FORMATS})
+
+    placeholder = image.copy()
+    placeholder.thumbnail((LQIP_SIZE, LQIP_SIZE))
+    placeholder = placeholder.filter(ImageFilter.GaussianBlur(1))
+    output = io.BytesIO()
+    placeholder.save(output, format='JPEG', quality=40)
+    lqip = 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+    return renditions, lqip
+
+
+def _store(source, renditions, lqip):
+    sizes = {}
+    for size, (width, height, encoded) in renditions.items():
+        sizes[size] = {'width': width, 'height': height}
+        for fmt, data in encoded.items():
+            name = variant_name(source, size, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            sizes[size][fmt] = default_storage.save(name, ContentFile(data, name=name))
+    return {'source': source, 'lqip': lqip, 'sizes': sizes}
+
+
+def _read(source):
+    with default_storage.open(source, 'rb') as file:
+        return file.read()
+
+
+def generate(masjids, force=False, workers=1):
+    """
+    Renders and stores the stale derivatives of `masjids` (all of them with `force`),
+    in `workers` processes when more than one. Masjids sharing an image render it once.
+    Images that cannot be read or rendered (missing files, URLs left by an import with
+    --skip-images, corrupt data) are logged and skipped. Returns the number of masjids updated.
+    """
+    masjids = list(masjids)
+    sources = set()
+    for masjid in masjids:
+        for field in IMAGE_FIELDS:
+            if getattr(masjid, field).name and (force or is_stale(masjid, field)):
+                sources.add(getattr(masjid, field).name)
+
+    rendered = {}
+    sources = sorted(sources)
+    executor = ProcessPoolExecutor(workers) if workers > 1 and len(sources) > 1 else None
+    try:
+        for start in range(0, len(sources), BATCH_SIZE):
+            data = {}
+            for source in sources[start:start + BATCH_SIZE]:
+                try:
+                    data[source] = _read(source)
+                except Exception as e:
+                    logger.warning("Cannot read image %s, skipping its variants: %s", source, e)
+            futures = {source: executor.submit(render, image) for source, image in data.items()} if executor else {}
+            for source, image in data.items():
+                try:
+                    renditions, lqip = futures[source].result() if executor else render(image)
+                except Exception as e:
+                    logger.warning("Cannot render image %s, skipping its variants: %s", source, e)
+                    continue
+                rendered[source] = _store(source, renditions, lqip)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    now = timezone.now()
+    updated = []
+    for masjid in masjids:
+        changed = False
+        for field in IMAGE_FIELDS:
+            name = getattr(masjid, field).name
+            if name in rendered or (not name and getattr(masjid, variants_field(field))):
+                setattr(masjid, variants_field(field), rendered.get(name, {}))
+                changed = True
+        if changed:
+            masjid.updated_at = now
+            updated.append(masjid)
+    Masjid.objects.bulk_update(
+        updated, [*map(variants_field, IMAGE_FIELDS), 'updated_at'], batch_size=BATCH_SIZE
+    )
+    return len(updated)
+
+
+def variant_urls(variants, build_url=None):
+    """The `sizes` of a variants dict with storage names replaced by URLs, None without derivatives."""
+    if not variants.get('sizes'):
+        return None
+    build_url = build_url or (lambda url: url)
+    return {
+        size: {
+            key: build_url(default_storage.url(value)) if key in FORMATS else value
+            for key, value in description.items()
+        }
+        for size, description in variants['sizes'].items()
+    }
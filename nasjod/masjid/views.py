@@ -1,12 +1,20 @@
+from datetime import date
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
-from core.throttling import CreateMasjidAnonThrottle, CreateSuggestionMasjidModificationAnonThrottle
+from core.renderers import ICalendarRenderer
+from core.throttling import CalendarThrottle, CreateMasjidAnonThrottle, CreateSuggestionMasjidModificationAnonThrottle
 
 import logging
 
@@ -16,6 +24,9 @@ from .models import Masjid, SuggestionMasjidModification
 from .serializers import (MasjidSerializer, MasjidMapSerializer, SuggestionMasjidModificationSerializer)
 from .filters import MasjidFilter
 from core.permissions import IsManagerOfMasjid
+from prayertime import ical
+from prayertime.models import DailySchedule
+from prayertime.serializers import DailyScheduleSerializer
 
 
 class MasjidViewSet(viewsets.ModelViewSet):
@@ -37,6 +48,8 @@ class MasjidViewSet(viewsets.ModelViewSet):
     def get_throttles(self):
         if self.action == 'create':
             return [CreateMasjidAnonThrottle()]
+        if self.action == 'calendar':
+            return [*super().get_throttles(), CalendarThrottle()]
         return super().get_throttles()
     
     def create(self, request, *args, **kwargs):
@@ -62,6 +75,49 @@ class MasjidViewSet(viewsets.ModelViewSet):
         
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], url_path='today')
+    def today(self, request, uuid=None):
+        """
+        Get the adhan and iqama times of the mosque for today, or for `?date=YYYY-MM-DD`,
+        from the DailySchedule read model.
+        """
+        try:
+            day = parse_date(request.query_params.get('date', '')) or date.today()
+        except ValueError:
+            raise ValidationError({'date': "Invalid date."})
+        schedule = DailySchedule.objects.filter(masjid__uuid=uuid, date=day).first()
+        if schedule is None:
+            raise NotFound("No schedule for this masjid and date.")
+        return Response(DailyScheduleSerializer(schedule).data)
+
+    @action(detail=True, methods=['get'], url_path='calendar.ics', renderer_classes=[ICalendarRenderer])
+    def calendar(self, request, uuid=None):
+        """
+        iCalendar feed of a mosque's prayer times, for phone calendar subscriptions.
+
+        Query parameters:
+        - prayers: comma separated subset of fajr,dhuhr,asr,maghrib,isha (default: all)
+        - time: "adhan" (default) or "iqama"
+        - months: number of months from the current one, 1 to 12 (default: 3)
+        """
+        masjid = get_object_or_404(Masjid, uuid=uuid)
+        try:
+            prayers, kind, months = ical.parse_options(request.query_params)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        etag = f'"{ical.feed_etag(masjid, months, prayers, kind)}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(
+                ical.stream_feed(masjid, months, prayers, kind),
+                content_type='text/calendar; charset=utf-8',
+            )
+            response['Content-Disposition'] = f'inline; filename="{masjid.uuid}.ics"'
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=3600)
+        return response
+
 class SuggestionMasjidModificationViewSet(viewsets.ModelViewSet):
     """
     A viewset for viewing and editing SuggestionMasjidModification instances.
@@ -218,6 +218,32 @@ if S3_STORAGE_BACKEND is True:
     # AWS_S3_REGION_NAME = os.environ.get("S3_STORAGE_BUCKET_REGION", "us-east-1")
     # AWS_QUERYSTRING_AUTH = False
 
+# On-disk cache for upstream prayer time responses (see core/_http_cache.py)
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', '/vol/web/cache/http')
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', 30 * 24 * 3600))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by the uwsgi workers and the background worker (same /vol/web volume)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_DIR', '/vol/web/cache/django'),
+        # Calendar months of every masjid and zone (culled at random past this)
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 20000))},
+    },
+}
+# Cache holding the iCalendar month blocks (see prayertime/ical.py)
+CALENDAR_CACHE = 'shared'
+
+# Days ahead covered by the DailySchedule read model (see prayertime/schedules.py)
+DAILY_SCHEDULE_HORIZON_DAYS = int(os.getenv('DAILY_SCHEDULE_HORIZON_DAYS', 30))
+
+# Memory-mapped timetable shared by the web and worker processes (see prayertime/timetable.py)
+TIMETABLE_PATH = os.getenv('TIMETABLE_PATH', '/vol/web/cache/timetable.bin')
+
 # If throttling is disabled, set an empty tuple for throttle classes
 DEFAULT_THROTTLE_CLASSES = ()
 DEFAULT_THROTTLE_RATES = {}
@@ -237,6 +263,10 @@ if THROTTLE_ENABLED:
         'anon': '1000/day',
         'anon_create_masjid': '5/min',
         'anon_create_suggestion_masjid_modification': '5/min',
+        # Per user, or per IP address for anonymous requests
+        'calendar': '60/hour',
+        'export': '10/hour',
+        'offline_pack': '120/hour',
     }
 
 REST_FRAMEWORK = {
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PrayerTime, JumuahPrayerTime, EidPrayerTime, IqamaTime
+from .models import DailySchedule, OfflinePack, PrayerTime, JumuahPrayerTime, EidPrayerTime, IqamaTime
 
 
 @admin.register(PrayerTime)
@@ -28,3 +28,17 @@ class eidPrayerTimeAdmin(admin.ModelAdmin):
 class IqamaTimeAdmin(admin.ModelAdmin):
     list_display = ('masjid', 'fajr_iqama', 'dhuhr_iqama', 'asr_iqama', 'maghrib_iqama', 'isha_iqama')
     list_filter = ('masjid',)
+
+@admin.register(DailySchedule)
+class DailyScheduleAdmin(admin.ModelAdmin):
+    list_display = ('masjid', 'date', 'fajr', 'fajr_iqama', 'dhuhr', 'dhuhr_iqama', 'asr', 'asr_iqama',
+                    'maghrib', 'maghrib_iqama', 'isha', 'isha_iqama', 'jumuah', 'built_at')
+    list_filter = ('date',)
+    search_fields = ('masjid__name',)
+
+@admin.register(OfflinePack)
+class OfflinePackAdmin(admin.ModelAdmin):
+    list_display = ('location', 'year', 'sha256', 'size', 'created_at')
+    list_filter = ('year',)
+    search_fields = ('location__city', 'location__state', 'sha256')
+    exclude = ('data',)
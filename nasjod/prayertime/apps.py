@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PrayertimeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "prayertime"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,66 @@
+"""
+Streaming exports of PrayerTime rows.
+
+Rows are read through a server-side cursor and encoded in batches, so memory stays
+constant whatever the size of the export.
+"""
+import csv
+import io
+import json
+
+from .models import PrayerTime
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+COLUMNS = ('governorate', 'city', 'date', 'hijri_date', 'fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
+FIELDS = ('location__state', 'location__city', 'date', 'hijri_date', 'fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
+
+
+def export_queryset(year, zone=None):
+    """PrayerTime rows of `year`, optionally of one zone (city name), in (location, date) index order."""
+    queryset = PrayerTime.objects.filter(date__year=year, location__isnull=False)
+    if zone:
+        queryset = queryset.filter(location__city__iexact=zone)
+    return queryset.order_by('location_id', 'date').values_list(*FIELDS)
+
+
+def _batches(queryset, chunk_size):
+    batch = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _values(row):
+    return [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+
+def iter_csv(queryset, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in _batches(queryset, chunk_size):
+        writer.writerows(_values(row) for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    for batch in _batches(queryset, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, _values(row))), ensure_ascii=False) + '\n' for row in batch
+        )
+
+
+def iter_export(fmt, queryset, chunk_size=CHUNK_SIZE):
+    return (iter_csv if fmt == 'csv' else iter_ndjson)(queryset, chunk_size)
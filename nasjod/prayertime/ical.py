@@ -0,0 +1,264 @@
+"""
+iCalendar (RFC 5545) feeds of prayer times, per masjid (adhan or iqama) and per zone
+(the adhan times of a PrayerTime location).
+
+A feed is streamed one month at a time. Each month's events are built from a
+single range query (schedules.iter_schedules for a masjid, PrayerTime for a zone)
+and kept in the shared cache under the feed's CalendarVersion, which the rebuild
+tasks bump whenever its prayer times, iqamas or Jumuah change. The version lives in
+the database, so cache eviction can only drop months, never bring back stale ones.
+The feed ETag derives from that version and the options, so conditional requests
+are answered without reading any prayer time.
+"""
+import calendar
+import hashlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+
+from .models import CalendarVersion, PrayerTime
+from .schedules import iter_schedules
+
+PRAYERS = ('fajr', 'dhuhr', 'asr', 'maghrib', 'isha')
+PRAYER_NAMES = {
+    'fajr': 'Fajr',
+    'dhuhr': 'Dhuhr',
+    'asr': 'Asr',
+    'maghrib': 'Maghrib',
+    'isha': 'Isha',
+}
+KINDS = ('adhan', 'iqama')
+MAX_MONTHS = 12
+EVENT_DURATION = 'PT15M'
+CACHE_TIMEOUT = 7 * 24 * 3600
+PRODID = '-//Nasjod//Prayer Times//EN'
+
+# Prayer times are local Tunisian times (UTC+1, no daylight saving time)
+TZID = 'Africa/Tunis'
+VTIMEZONE = (
+    'BEGIN:VTIMEZONE',
+    f'TZID:{TZID}',
+    'BEGIN:STANDARD',
+    'DTSTART:19700101T000000',
+    'TZOFFSETFROM:+0100',
+    'TZOFFSETTO:+0100',
+    'TZNAME:CET',
+    'END:STANDARD',
+    'END:VTIMEZONE',
+)
+
+
+def _cache():
+    return caches[settings.CALENDAR_CACHE]
+
+
+def _version_key(scope, pk):
+    return f'{scope}:{pk}'
+
+
+def version(key):
+    """Current version of the feed `key` ("masjid:<id>" or "zone:<location id>")."""
+    return CalendarVersion.objects.filter(key=key).values_list('version', flat=True).first() or 0
+
+
+def _bump(keys):
+    if not keys:
+        return
+    table = connection.ops.quote_name(CalendarVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (key, version) SELECT unnest(%s::varchar[]), 1 "
+            f"ON CONFLICT (key) DO UPDATE SET version = {table}.version + 1",
+            [sorted(keys)],
+        )
+
+
+def invalidate(masjid_ids):
+    """Bumps the calendar version of each masjid, so their cached months are rebuilt."""
+    _bump({_version_key('masjid', masjid_id) for masjid_id in masjid_ids})
+
+
+def invalidate_zones(location_ids):
+    """Bumps the calendar version of each zone, so their cached months are rebuilt."""
+    _bump({_version_key('zone', location_id) for location_id in location_ids if location_id is not None})
+
+
+def parse_options(params, kinds=KINDS):
+    """
+    Reads the prayers, time and months query parameters of a feed request.
+    Returns (prayers, kind, months), prayers in canonical order. Raises ValueError.
+    """
+    prayers = [p.strip().lower() for p in params.get('prayers', ','.join(PRAYERS)).split(',') if p.strip()]
+    kind = params.get('time', 'adhan').lower()
+    try:
+        months = int(params.get('months', 3))
+    except ValueError:
+        months = 0
+    if not prayers or any(prayer not in PRAYERS for prayer in prayers):
+        raise ValueError(f"prayers must be a comma separated subset of {','.join(PRAYERS)}")
+    if kind not in kinds:
+        raise ValueError(f"time must be {' or '.join(kinds)}")
+    if not 1 <= months <= MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {MAX_MONTHS}")
+    # Keep the canonical prayer order so equivalent requests share cache entries
+    return [prayer for prayer in PRAYERS if prayer in prayers], kind, months
+
+
+def escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line):
+    """Folds a content line into chunks of at most 75 octets, continuation lines starting with a space."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Do not split a multi-byte UTF-8 character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74  # The leading space counts
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def add_months(month, count):
+    index = month.month - 1 + count
+    return month.replace(year=month.year + index // 12, month=index % 12 + 1, day=1)
+
+
+def _event(uid, place, day, prayer, kind, value, stamp):
+    name = 'Jumuah' if prayer == 'jumuah' else PRAYER_NAMES[prayer]
+    summary = f"{name} iqama" if kind == 'iqama' and prayer != 'jumuah' else name
+    start = datetime.combine(day, value)
+    return (
+        'BEGIN:VEVENT',
+        f'UID:{uid}-{day:%Y%m%d}-{prayer}-{kind}@nasjod',
+        f'DTSTAMP:{stamp}',
+        f'DTSTART;TZID={TZID}:{start:%Y%m%dT%H%M%S}',
+        f'DURATION:{EVENT_DURATION}',
+        f'SUMMARY:{escape(summary)}',
+        f'LOCATION:{escape(place)}',
+        'TRANSP:TRANSPARENT',
+        'END:VEVENT',
+    )
+
+
+def _month_end(month):
+    return month.replace(day=calendar.monthrange(month.year, month.month)[1])
+
+
+def _cached(key, build):
+    """The body cached under `key`, built and cached when missing."""
+    cache = _cache()
+    body = cache.get(key)
+    if body is None:
+        body = build()
+        cache.set(key, body, CACHE_TIMEOUT)
+    return body
+
+
+def month_events(masjid, month, prayers, kind, calendar_version):
+    """Returns the folded VEVENT lines of one month of a masjid, from the cache when possible."""
+    def build():
+        # DTSTAMP is fixed per month so that the output only changes with the data
+        stamp = f'{month:%Y%m%d}T000000Z'
+        lines = []
+        for schedule in iter_schedules([masjid.pk], month, _month_end(month)):
+            for prayer in prayers:
+                if prayer == 'dhuhr' and schedule.jumuah is not None:
+                    lines.extend(_event(masjid.uuid, masjid.name, schedule.date, 'jumuah', kind, schedule.jumuah, stamp))
+                    continue
+                value = getattr(schedule, prayer if kind == 'adhan' else f'{prayer}_iqama')
+                if value is not None:
+                    lines.extend(_event(masjid.uuid, masjid.name, schedule.date, prayer, kind, value, stamp))
+        return ''.join(fold(line) for line in lines)
+
+    key = f"calendar:{masjid.pk}:{calendar_version}:{month:%Y-%m}:{kind}:{','.join(prayers)}"
+    return _cached(key, build)
+
+
+def zone_name(location):
+    return ', '.join(part for part in (location.city, location.state) if part) or f'Zone {location.pk}'
+
+
+def zone_month_events(location, month, prayers, calendar_version):
+    """Returns the folded adhan VEVENT lines of one month of a zone, from the cache when possible."""
+    def build():
+        stamp = f'{month:%Y%m%d}T000000Z'
+        place = zone_name(location)
+        rows = PrayerTime.objects.filter(
+            location_id=location.pk, date__range=(month, _month_end(month))
+        ).order_by('date').values_list('date', *prayers)
+        lines = []
+        for day, *times in rows:
+            for prayer, value in zip(prayers, times):
+                lines.extend(_event(f'zone-{location.pk}', place, day, prayer, 'adhan', value, stamp))
+        return ''.join(fold(line) for line in lines)
+
+    key = f"calendar-zone:{location.pk}:{calendar_version}:{month:%Y-%m}:{','.join(prayers)}"
+    return _cached(key, build)
+
+
+def _etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def feed_etag(masjid, months, prayers, kind, start=None):
+    start = start or timezone.localdate().replace(day=1)
+    return _etag(
+        masjid.pk, version(_version_key('masjid', masjid.pk)), masjid.updated_at, f'{start:%Y-%m}',
+        months, kind, ','.join(prayers),
+    )
+
+
+def zone_feed_etag(location, months, prayers, start=None):
+    start = start or timezone.localdate().replace(day=1)
+    return _etag(
+        'zone', location.pk, version(_version_key('zone', location.pk)), zone_name(location), f'{start:%Y-%m}',
+        months, ','.join(prayers),
+    )
+
+
+def _stream(name, start, months, month_body):
+    header = (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape(name)}',
+        f'X-WR-TIMEZONE:{TZID}',
+        'REFRESH-INTERVAL;VALUE=DURATION:P1D',
+        'X-PUBLISHED-TTL:P1D',
+        *VTIMEZONE,
+    )
+    yield ''.join(fold(line) for line in header)
+    for index in range(months):
+        yield month_body(add_months(start, index))
+    yield 'END:VCALENDAR\r\n'
+
+
+def stream_feed(masjid, months, prayers, kind, start=None):
+    """Yields the calendar of a masjid for `months` months from the current one, month by month."""
+    start = start or timezone.localdate().replace(day=1)
+    calendar_version = version(_version_key('masjid', masjid.pk))
+    return _stream(
+        masjid.name, start, months, lambda month: month_events(masjid, month, prayers, kind, calendar_version),
+    )
+
+
+def stream_zone_feed(location, months, prayers, start=None):
+    """Yields the adhan calendar of a zone for `months` months from the current one, month by month."""
+    start = start or timezone.localdate().replace(day=1)
+    calendar_version = version(_version_key('zone', location.pk))
+    return _stream(
+        zone_name(location), start, months, lambda month: zone_month_events(location, month, prayers, calendar_version),
+    )
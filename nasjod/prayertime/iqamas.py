@@ -0,0 +1,122 @@
+"""
+IqamaTime rules of masjids.
+
+A rule applies from its date until the next rule of the masjid; the rule in force on
+a day is the latest one dated on or before it, found through the (masjid, -date)
+index, or the earliest one when every rule is later. Of several rules sharing a date,
+the last created wins.
+
+Bulk writes serve managers adjusting many masjids at once. Permissions for every masjid of a batch are checked with one query and the rows are
+written with bulk_create/bulk_update in one transaction. Those bypass the model
+signals, so a single rebuild of the batch's DailySchedule and calendars is queued.
+"""
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from masjid.models import Masjid
+from .models import IqamaTime, hijri_date_for
+from .tasks import rebuild_masjid_schedules
+
+IQAMA_FIELDS = (
+    'fajr_iqama', 'dhuhr_iqama', 'dhuhr_iqama_hour', 'dhuhr_iqama_from_asr', 'asr_iqama', 'maghrib_iqama', 'isha_iqama',
+)
+MAX_BATCH = 1000
+BATCH_SIZE = 500
+
+
+def rule_in_force(masjid_id, day=None):
+    """IqamaTime rule of a masjid in force on `day` (today by default), or None."""
+    day = day or timezone.localdate()
+    rules = IqamaTime.objects.filter(masjid_id=masjid_id)
+    rule = rules.filter(date__lte=day).order_by('-date', '-id').first()
+    return rule or rules.order_by('date', '-id').first()
+
+
+def next_change(masjid_id, day=None):
+    """First IqamaTime rule of a masjid taking effect after `day` (today by default), or None."""
+    day = day or timezone.localdate()
+    return IqamaTime.objects.filter(masjid_id=masjid_id, date__gt=day).order_by('date', '-id').first()
+
+
+def current_rules(masjid_id, day=None):
+    """The rule in force on `day` followed by the next scheduled change, when they exist."""
+    day = day or timezone.localdate()
+    active = rule_in_force(masjid_id, day)
+    if active is None:
+        return []
+    # When every rule is later than `day`, the earliest applies and the change is the one after it
+    upcoming = next_change(masjid_id, max(day, active.date))
+    return [active, upcoming] if upcoming else [active]
+
+
+def redundant_rules(masjid_ids=None):
+    """
+    Yields the ids of rules that never apply: rules shadowed by a later one of the same
+    date, and rules repeating the values of the rule they follow.
+    """
+    rows = IqamaTime.objects.order_by('masjid_id', 'date', 'id')
+    if masjid_ids is not None:
+        rows = rows.filter(masjid_id__in=masjid_ids)
+    rows = rows.values_list('masjid_id', 'id', 'date', *IQAMA_FIELDS)
+
+    for _, masjid_rows in groupby(rows.iterator(chunk_size=2000), key=lambda row: row[0]):
+        kept = []
+        for _, rule_id, day, *values in masjid_rows:
+            if kept and kept[-1][1] == day:
+                yield kept.pop()[0]
+            if kept and kept[-1][2] == values:
+                yield rule_id
+                continue
+            kept.append((rule_id, day, values))
+
+
+def editable_masjids(user, uuids):
+    """{uuid: id} of the masjids among `uuids` that `user` may edit: staff edit all, managers and assistants their own."""
+    masjids = Masjid.objects.filter(uuid__in=uuids)
+    if not user.is_staff:
+        masjids = masjids.filter(Q(managers=user) | Q(assistants=user))
+    return dict(masjids.values_list('uuid', 'id').distinct())
+
+
+def bulk_upsert(entries, masjid_ids):
+    """
+    Writes validated entries (masjid uuid, date and iqama fields). An entry updates the
+    fields it provides on the rule of its masjid and date when there is one, else it
+    creates the rule; the last entry of a masjid and date wins. `masjid_ids` maps the
+    uuids to ids. Returns (created, updated).
+    """
+    by_key = {}
+    for entry in entries:
+        by_key[(masjid_ids[entry['masjid']], entry['date'])] = entry
+    if not by_key:
+        return 0, 0
+
+    existing = {}
+    rows = IqamaTime.objects.filter(
+        masjid_id__in={masjid_id for masjid_id, _ in by_key}, date__in={day for _, day in by_key}
+    ).order_by('id')
+    for row in rows:
+        # Keep the most recent rule when a day has several
+        existing[(row.masjid_id, row.date)] = row
+
+    created, updated, fields = [], [], set()
+    for (masjid_id, day), entry in by_key.items():
+        values = {field: entry[field] for field in IQAMA_FIELDS if field in entry}
+        row = existing.get((masjid_id, day))
+        if row is None:
+            created.append(IqamaTime(masjid_id=masjid_id, date=day, hijri_date=hijri_date_for(day), **values))
+            continue
+        for field, value in values.items():
+            setattr(row, field, value)
+        fields.update(values)
+        updated.append(row)
+
+    with transaction.atomic():
+        IqamaTime.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        if updated and fields:
+            IqamaTime.objects.bulk_update(updated, sorted(fields), batch_size=BATCH_SIZE)
+        rebuild_masjid_schedules.delay(masjid_ids=sorted({masjid_id for masjid_id, _ in by_key}))
+    return len(created), len(updated)
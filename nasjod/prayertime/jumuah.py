@@ -0,0 +1,47 @@
+"""
+Bulk writes of JumuahPrayerTime rows.
+"""
+from django.db import transaction
+
+from .models import JumuahPrayerTime, hijri_date_for
+from .tasks import rebuild_masjid_schedules
+
+BATCH_SIZE = 500
+
+
+def add_times(times_by_masjid, day):
+    """
+    Adds the jumuah times {masjid id: [time]} on `day` like update_or_create would one by
+    one: missing (masjid, day, time) rows are created and the existing ones are no longer
+    marked as first timeslot. Bulk writes skip the signals, so the schedules of the
+    masjids changed are rebuilt by one job. Returns (created, updated).
+    """
+    existing = {
+        (masjid_id, jumuah_time): (pk, first_timeslot)
+        for pk, masjid_id, jumuah_time, first_timeslot in JumuahPrayerTime.objects.filter(
+            masjid_id__in=times_by_masjid, date=day
+        ).values_list('pk', 'masjid_id', 'jumuah_time', 'first_timeslot_jumuah')
+    }
+
+    created, updated, first_timeslots = [], 0, []
+    changed = set()
+    for masjid_id, times in times_by_masjid.items():
+        for jumuah_time in times:
+            row = existing.get((masjid_id, jumuah_time))
+            if row is None:
+                created.append(JumuahPrayerTime(
+                    masjid_id=masjid_id, date=day, hijri_date=hijri_date_for(day), jumuah_time=jumuah_time
+                ))
+                changed.add(masjid_id)
+                continue
+            updated += 1
+            if row[1]:
+                first_timeslots.append(row[0])
+                changed.add(masjid_id)
+
+    with transaction.atomic():
+        JumuahPrayerTime.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        JumuahPrayerTime.objects.filter(pk__in=first_timeslots).update(first_timeslot_jumuah=False)
+        if changed:
+            rebuild_masjid_schedules.delay(masjid_ids=sorted(changed))
+    return len(created), updated
@@ -0,0 +1,105 @@
+"""
+Set-based linking of masjids to PrayerTime rows.
+
+Links live in the PrayerTime.masjids through table. Instead of adding rows one
+PrayerTime at a time, a zone (the Address locations holding its prayer times)
+is linked to any number of masjids with a single INSERT ... SELECT, and stale
+links are removed with a single DELETE against the set of locations to keep.
+These statements bypass m2m signals, so they queue the DailySchedule and timetable
+rebuilds, one job for all the masjids of a statement.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+from core._consts import TUNISIA_PRAYER_TIMES_CITIES
+from core.models import Address
+from .models import PrayerTime
+from .tasks import rebuild_masjid_schedules, timetable_changed
+
+
+def _tables():
+    field = PrayerTime._meta.get_field('masjids')
+    return {
+        'through': connection.ops.quote_name(field.remote_field.through._meta.db_table),
+        'prayertime': connection.ops.quote_name(PrayerTime._meta.db_table),
+        'prayertime_id': connection.ops.quote_name(field.m2m_column_name()),
+        'masjid_id': connection.ops.quote_name(field.m2m_reverse_name()),
+    }
+
+
+def prayer_times_city(address):
+    """
+    City whose prayer times apply at `address`: the governorate's main city when
+    USE_MAIN_CITY_FOR_PRAYER_TIMES is set, otherwise the address city.
+    """
+    if address is None:
+        return None
+    if settings.USE_MAIN_CITY_FOR_PRAYER_TIMES and address.state:
+        return TUNISIA_PRAYER_TIMES_CITIES.get(address.state.lower(), address.city)
+    return address.city
+
+
+def zone_location_ids(**address_filters):
+    """Ids of the addresses holding prayer times that match the Address lookups, e.g. city__iexact="Sfax"."""
+    return list(
+        Address.objects.filter(id__in=PrayerTime.objects.values('location_id'), **address_filters)
+        .values_list('id', flat=True)
+    )
+
+
+def link_prayer_times(masjid_ids, location_ids):
+    """
+    Links every masjid in `masjid_ids` to every PrayerTime of `location_ids` in one statement.
+    Existing links are left untouched. Returns the number of links created.
+    """
+    masjid_ids, location_ids = list(masjid_ids), list(location_ids)
+    if not masjid_ids or not location_ids:
+        return 0
+    sql = (
+        "INSERT INTO {through} ({prayertime_id}, {masjid_id}) "
+        "SELECT pt.id, m.id FROM {prayertime} pt CROSS JOIN unnest(%s::bigint[]) AS m(id) "
+        "WHERE pt.location_id = ANY(%s) "
+        "ON CONFLICT DO NOTHING"
+    ).format(**_tables())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [masjid_ids, location_ids])
+        linked = cursor.rowcount
+    if linked:
+        rebuild_masjid_schedules.delay(masjid_ids=sorted(masjid_ids))
+        timetable_changed()
+    return linked
+
+
+def unlink_prayer_times(masjid_ids, keep_location_ids=()):
+    """
+    Removes, in one statement, the links of `masjid_ids` to prayer times that are
+    not located in `keep_location_ids`. Returns the number of links removed.
+    """
+    masjid_ids = list(masjid_ids)
+    if not masjid_ids:
+        return 0
+    sql = (
+        "DELETE FROM {through} t USING {prayertime} pt "
+        "WHERE t.{prayertime_id} = pt.id AND t.{masjid_id} = ANY(%s) "
+        "AND (pt.location_id IS NULL OR pt.location_id <> ALL(%s::bigint[]))"
+    ).format(**_tables())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [masjid_ids, list(keep_location_ids)])
+        unlinked = cursor.rowcount
+    if unlinked:
+        rebuild_masjid_schedules.delay(masjid_ids=sorted(masjid_ids))
+        timetable_changed()
+    return unlinked
+
+
+def set_prayer_times(masjid_ids, location_ids):
+    """
+    Makes the prayer times of `location_ids` the only ones linked to `masjid_ids`:
+    links that are already correct are kept, missing ones added, others removed.
+    Returns (added, removed).
+    """
+    masjid_ids, location_ids = list(masjid_ids), list(location_ids)
+    with transaction.atomic():
+        removed = unlink_prayer_times(masjid_ids, location_ids)
+        added = link_prayer_times(masjid_ids, location_ids)
+    return added, removed
@@ -0,0 +1,216 @@
+"""
+Shared loader for the prayer time ingestion commands.
+
+Entries use the meteo.tn layout written by the fetch commands:
+{"date": "2024-12-15 00:00", "sobh": "05:41", "sunrise": "07:09", "dhohr": "12:14",
+ "aser": "14:50", "magreb": "17:11", "isha": "18:37"}
+"""
+from datetime import date, time
+from functools import lru_cache
+from time import monotonic
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Address
+from .models import PrayerTime, hijri_date_for
+from .tasks import rebuild_location_schedules, timetable_changed
+
+BATCH_SIZE = 1000
+# Delegation centres are several kilometres apart; the same delegation is placed within this
+LOCATION_RADIUS = 1000  # meters
+
+# meteo.tn key -> PrayerTime field
+ENTRY_FIELDS = {
+    'sobh': 'fajr',
+    'sunrise': 'sunrise',
+    'dhohr': 'dhuhr',
+    'aser': 'asr',
+    'magreb': 'maghrib',
+    'isha': 'isha',
+}
+TIME_FIELDS = tuple(ENTRY_FIELDS.values())
+
+
+@lru_cache(maxsize=2048)
+def parse_time(value):
+    """Parse "HH:MM" or "HH:MM:SS". A whole year only uses a few hundred distinct values."""
+    parts = value.strip().split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid time '{value}'")
+    return time(*(int(part) for part in parts))
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    """Parse "YYYY-MM-DD" or "YYYY-MM-DD HH:MM"."""
+    return date.fromisoformat(value.strip()[:10])
+
+
+def parse_entry(entry):
+    """Returns the PrayerTime field values for a single meteo.tn entry."""
+    row = {'date': parse_date(entry['date'])}
+    for key, field in ENTRY_FIELDS.items():
+        value = entry.get(key)
+        if not value:
+            raise ValueError(f"Missing '{key}'")
+        row[field] = parse_time(value)
+    return row
+
+
+def _location_addresses():
+    """Addresses that can hold zone prayer times: not owned by a masjid or a suggestion."""
+    return Address.objects.filter(
+        address_masjid__isnull=True,
+        address_suggestion_masjid_modification__isnull=True,
+    )
+
+
+def resolve_location(governorate, city, latitude=None, longitude=None, rename=False):
+    """
+    Returns the Address prayer times of (governorate, city) are attached to.
+    An existing address is reused so reruns do not create a new location each time;
+    addresses owned by a masjid or a suggestion are never picked.
+
+    Files written before every fetcher used the zone names of governorats-meteo-ids.json
+    name delegations as meteo.tn does ("Sfax" for "Sfax ville"), so an address within
+    LOCATION_RADIUS of the coordinates is reused too. With `rename`, for callers passing
+    zone names, that address takes (governorate, city) so the planner finds it by zone.
+    """
+    addresses = _location_addresses().filter(state__iexact=governorate, city__iexact=city).order_by('id')
+    address = addresses.filter(prayertime__isnull=False).first() or addresses.first()
+    if address:
+        return address
+
+    if latitude is None or longitude is None:
+        raise ValueError(f"No existing address for {city}, {governorate} and no coordinates to create one.")
+    point = Point(float(longitude), float(latitude), srid=4326)  # Longitude first
+    nearby = _location_addresses().filter(coordinates__distance_lte=(point, D(m=LOCATION_RADIUS))).order_by('id')
+    address = nearby.filter(prayertime__isnull=False).first() or nearby.first()
+    if address:
+        if rename:
+            address.state, address.city = governorate, city
+            address.save(update_fields=['state', 'city'])
+        return address
+
+    return Address.objects.create(
+        city=city,
+        state=governorate,
+        country="Tunisia",
+        coordinates=point,
+    )
+
+
+def prefetch_locations(pairs):
+    """
+    Returns {(governorate, city): Address} for the pairs that already have prayer times,
+    read in one query with the same preference as resolve_location (lowest id first).
+    Pairs that were never loaded are left out.
+    """
+    wanted = {(governorate.lower(), city.lower()): (governorate, city) for governorate, city in pairs}
+    addresses = _location_addresses().filter(
+        id__in=PrayerTime.objects.values('location_id')
+    ).order_by('-id')
+
+    locations = {}
+    for address in addresses:
+        pair = wanted.get(((address.state or '').lower(), (address.city or '').lower()))
+        if pair is not None:
+            locations[pair] = address
+    return locations
+
+
+class PrayerTimeLoader:
+    """
+    Upserts prayer time entries per location with `bulk_create(update_conflicts=True)`
+    on the (location, date) unique constraint. Rows whose times did not change are
+    not rewritten, only their `fetched_at` is refreshed in a single UPDATE.
+    Counters accumulate across `load` calls. A DailySchedule rebuild is queued for
+    the location, and a timetable rebuild, when any of its days changed.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows(self):
+        return self.created + self.updated + self.unchanged
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.rows} rows in {self.elapsed:.2f}s ({self.rate:.0f} rows/s): "
+            f"{self.created} created, {self.updated} updated, {self.unchanged} unchanged"
+        )
+
+    def load(self, location, entries):
+        """
+        Parse and upsert `entries` for `location`.
+        Returns a list of (date, error) for the entries that could not be parsed.
+        """
+        started = monotonic()
+        errors = []
+        rows = {}
+        for entry in entries:
+            try:
+                row = parse_entry(entry)
+            except (KeyError, TypeError, ValueError) as e:
+                errors.append((entry.get('date') if isinstance(entry, dict) else entry, str(e)))
+                continue
+            rows[row['date']] = row
+
+        if rows:
+            self.upsert(location, rows)
+        self.elapsed += monotonic() - started
+        return errors
+
+    def upsert(self, location, rows):
+        """Write `rows` ({date: field values}) for `location`, skipping unchanged ones."""
+        existing = {
+            values[0]: values[1:]
+            for values in PrayerTime.objects.filter(
+                location=location, date__range=(min(rows), max(rows))
+            ).values_list('date', *TIME_FIELDS)
+        }
+
+        now = timezone.now()
+        pending = []
+        unchanged = []
+        created = 0
+        for day, row in rows.items():
+            current = existing.get(day)
+            if current == tuple(row[field] for field in TIME_FIELDS):
+                unchanged.append(day)
+                continue
+            if current is None:
+                created += 1
+            pending.append(PrayerTime(location=location, hijri_date=hijri_date_for(day), fetched_at=now, **row))
+
+        with transaction.atomic():
+            if pending:
+                PrayerTime.objects.bulk_create(
+                    pending,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=['location', 'date'],
+                    update_fields=[*TIME_FIELDS, 'hijri_date', 'fetched_at'],
+                )
+            if unchanged:
+                PrayerTime.objects.filter(location=location, date__in=unchanged).update(fetched_at=now)
+        self.created += created
+        self.updated += len(pending) - created
+        self.unchanged += len(unchanged)
+
+        # Changed days invalidate the linked masjids' DailySchedule, calendars and the timetable
+        if pending:
+            rebuild_location_schedules.delay(location_id=location.pk)
+            timetable_changed()
@@ -0,0 +1,286 @@
+"""
+Async client for the meteo.tn prayer time endpoints.
+
+All requests share one pooled keep-alive connection set, a global concurrency
+budget and a per-host rate limit. Failed requests are retried with jittered
+exponential backoff, and a per-host circuit breaker stops hammering the
+upstream once it keeps failing. Responses go through an optional on-disk
+HttpCache; in replay mode nothing is requested and only cached responses are used.
+"""
+import asyncio
+import json
+import random
+from collections import defaultdict, namedtuple
+from time import monotonic
+
+import httpx
+
+from core._helpers import static_data_path
+from core._http_cache import CacheMissError, HttpCache
+
+BASE_URL = "https://www.meteo.tn/horaire_gouvernorat/{date}/{state_id}/{city_id}"
+BASE_URL_SUNRISE = "https://www.meteo.tn/lever_coucher_gouvernorat/{date}/{state_id}/{city_id}"
+ZONES_FILE = 'governorats-meteo-ids.json'
+
+CONCURRENCY = 10
+RATE_PER_HOST = 5.0  # requests per second
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+TIMEOUT = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+Zone = namedtuple('Zone', ['governorate', 'city', 'state_id', 'city_id'])
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the host's circuit is open."""
+
+
+def load_zones(governorates=None):
+    """
+    Returns a Zone per delegation listed in governorats-meteo-ids.json,
+    optionally restricted to the given governorate names (case insensitive).
+    """
+    with open(static_data_path(ZONES_FILE), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    wanted = {name.lower() for name in governorates} if governorates else None
+    zones = []
+    for governorate_name, governorate_info in data.items():
+        if wanted is not None and governorate_name.lower() not in wanted:
+            continue
+        state_id = governorate_info.get('id_meteo_tunisia')
+        for delegation in governorate_info.get('delegations', []):
+            city_id = delegation.get('id_meteo_tunisia')
+            if state_id and city_id:
+                zones.append(Zone(governorate_name, delegation.get('Name', 'Unknown'), state_id, city_id))
+    return zones
+
+
+class RateLimiter:
+    """Spaces out requests to a host so that at most `rate` start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `cooldown`
+    seconds. After the cooldown calls go through again (half-open); a single
+    further failure re-opens it, a success closes it.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def check(self):
+        if self.opened_at is not None and monotonic() - self.opened_at < self.cooldown:
+            raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures")
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = monotonic()
+
+
+class MeteoClient:
+    """
+    Usage:
+        async with MeteoClient() as client:
+            results = await client.fetch_all(zones, dates)
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, rate=RATE_PER_HOST, retries=MAX_RETRIES, timeout=TIMEOUT,
+                 cache=None, replay=False, transport=None):
+        if replay and cache is None:
+            raise ValueError("Replay mode needs a cache.")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.replay = replay
+        self.transport = transport
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiters = defaultdict(lambda: RateLimiter(rate))
+        self.breakers = defaultdict(CircuitBreaker)
+        self.client = None
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            transport=self.transport,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    @staticmethod
+    def backoff(attempt):
+        """Full jitter: a random delay up to the exponential cap for this attempt."""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    async def get_json(self, url):
+        if self.cache is not None:
+            content = self.cache.get(url, allow_stale=self.replay)
+            if content is not None:
+                return json.loads(content)
+        if self.replay:
+            raise CacheMissError(f"No cached response for {url}")
+
+        host = httpx.URL(url).host
+        breaker = self.breakers[host]
+        limiter = self.limiters[host]
+
+        for attempt in range(self.retries + 1):
+            breaker.check()
+            async with self.semaphore:
+                await limiter.wait()
+                try:
+                    response = await self.client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in RETRY_STATUSES:
+                        raise
+                    breaker.failure()
+                    if attempt == self.retries:
+                        raise
+                except httpx.TransportError:
+                    breaker.failure()
+                    if attempt == self.retries:
+                        raise
+                else:
+                    breaker.success()
+                    data = response.json()
+                    if self.cache is not None:
+                        self.cache.set(url, response.content)
+                    return data
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def fetch_day(self, zone, day):
+        """
+        Fetches prayer times and sunrise for one zone and day concurrently.
+        Returns None when meteo.tn has no data, otherwise:
+        {"governorate", "city", "latitude", "longitude",
+         "entry": {date, sobh, dhohr, aser, magreb, isha, sunrise}}
+        """
+        formatted_date = day.strftime("%Y-%m-%d")
+        params = {'date': formatted_date, 'state_id': zone.state_id, 'city_id': zone.city_id}
+        main, sunrise = await asyncio.gather(
+            self.get_json(BASE_URL.format(**params)),
+            self.get_json(BASE_URL_SUNRISE.format(**params)),
+        )
+
+        data = (main or {}).get("data") or {}
+        if not data:
+            return None
+        data_sunrise = (sunrise or {}).get("data") or {}
+
+        return {
+            "governorate": (data.get("gouvernorat") or {}).get("intituleAn") or zone.governorate,
+            "city": (data.get("delegation") or {}).get("intituleAn") or zone.city,
+            "latitude": data.get("lat"),
+            "longitude": data.get("lng"),
+            "entry": {
+                "date": data.get("date"),
+                "sobh": data.get("sobh"),
+                "dhohr": data.get("dhohr"),
+                "aser": data.get("aser"),
+                "magreb": data.get("magreb"),
+                "isha": data.get("isha"),
+                "sunrise": data_sunrise.get("lever"),
+            },
+        }
+
+    async def fetch_all(self, zones, dates):
+        """Returns (zone, day, record | None | exception) for every zone and day."""
+        return await self.fetch_cells((zone, day) for zone in zones for day in dates)
+
+    async def fetch_cells(self, cells):
+        """Returns (zone, day, record | None | exception) for every (zone, day) in `cells`."""
+        async def fetch(zone, day):
+            try:
+                return zone, day, await self.fetch_day(zone, day)
+            except Exception as e:
+                return zone, day, e
+
+        return await asyncio.gather(*(fetch(zone, day) for zone, day in cells))
+
+
+def add_fetch_arguments(parser):
+    """Adds the options shared by the commands fetching from meteo.tn."""
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=CONCURRENCY,
+        help='Maximum number of concurrent requests.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=RATE_PER_HOST,
+        help='Maximum number of requests per second to meteo.tn.'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=MAX_RETRIES,
+        help='Number of retries for a failed request.'
+    )
+    parser.add_argument(
+        '--replay',
+        action='store_true',
+        help='Serve responses only from the on-disk cache, without any request to meteo.tn.'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the on-disk response cache.'
+    )
+
+
+def client_options(options):
+    """Builds MeteoClient keyword arguments from the parsed command options."""
+    return {
+        'concurrency': options['max_workers'],
+        'rate': options['rate'],
+        'retries': options['retries'],
+        'cache': None if options['no_cache'] else HttpCache.from_settings(),
+        'replay': options['replay'],
+    }
+
+
+def fetch_prayer_times(zones, dates, **options):
+    """Synchronous entry point for management commands, see MeteoClient for options."""
+    return fetch_prayer_time_cells([(zone, day) for zone in zones for day in dates], **options)
+
+
+def fetch_prayer_time_cells(cells, **options):
+    """Like fetch_prayer_times, for an explicit list of (zone, day) cells."""
+    async def run():
+        async with MeteoClient(**options) as client:
+            return await client.fetch_cells(cells)
+
+    return asyncio.run(run())
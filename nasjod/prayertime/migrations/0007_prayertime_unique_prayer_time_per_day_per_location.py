@@ -0,0 +1,46 @@
+# Generated by Django 5.0 on 2026-10-19 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_prayer_times(apps, schema_editor):
+    """Keep the oldest row per (location, date) and move masjid links onto it."""
+    PrayerTime = apps.get_model("prayertime", "PrayerTime")
+    Through = PrayerTime.masjids.through
+
+    duplicates = (
+        PrayerTime.objects.filter(location__isnull=False)
+        .values("location", "date")
+        .annotate(keep_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        redundant = PrayerTime.objects.filter(
+            location=duplicate["location"], date=duplicate["date"]
+        ).exclude(id=duplicate["keep_id"])
+        masjid_ids = set(
+            Through.objects.filter(prayertime__in=redundant).values_list("masjid_id", flat=True)
+        )
+        Through.objects.bulk_create(
+            [Through(prayertime_id=duplicate["keep_id"], masjid_id=masjid_id) for masjid_id in masjid_ids],
+            ignore_conflicts=True,
+        )
+        redundant.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prayertime", "0006_iqamatime_dhuhr_iqama_hour"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_prayer_times, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="prayertime",
+            constraint=models.UniqueConstraint(
+                fields=("location", "date"), name="unique_prayer_time_per_day_per_location"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prayertime", "0007_prayertime_unique_prayer_time_per_day_per_location"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prayertime",
+            name="fetched_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
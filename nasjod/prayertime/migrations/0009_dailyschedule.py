@@ -0,0 +1,61 @@
+# Generated by Django 5.0 on 2026-10-19 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("masjid", "0006_masjid_name_ar"),
+        ("prayertime", "0008_prayertime_fetched_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySchedule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("hijri_date", models.CharField(default="", max_length=50)),
+                ("fajr", models.TimeField()),
+                ("sunrise", models.TimeField()),
+                ("dhuhr", models.TimeField()),
+                ("asr", models.TimeField()),
+                ("maghrib", models.TimeField()),
+                ("isha", models.TimeField()),
+                ("fajr_iqama", models.TimeField(blank=True, null=True)),
+                ("dhuhr_iqama", models.TimeField(blank=True, null=True)),
+                ("asr_iqama", models.TimeField(blank=True, null=True)),
+                ("maghrib_iqama", models.TimeField(blank=True, null=True)),
+                ("isha_iqama", models.TimeField(blank=True, null=True)),
+                ("jumuah", models.TimeField(blank=True, null=True)),
+                ("built_at", models.DateTimeField(auto_now=True)),
+                (
+                    "masjid",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_schedules",
+                        to="masjid.masjid",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["date"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("masjid", "date"),
+                        name="unique_daily_schedule_per_day_per_masjid",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prayertime", "0010_offlinepack"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="iqamatime",
+            index=models.Index(
+                fields=["masjid", "-date"], name="iqama_rule_lookup_idx"
+            ),
+        ),
+    ]
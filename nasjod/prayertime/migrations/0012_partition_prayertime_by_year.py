@@ -0,0 +1,178 @@
+# Converts prayertime_prayertime into a table partitioned by RANGE (date), one
+# partition per year (see prayertime/partitions.py).
+#
+# Unique constraints of a partitioned table must include the partition key, so the
+# primary key becomes (id, date) and the masjid links no longer reference prayer
+# times with a foreign key; Django deletes links itself when prayer times are deleted.
+# Ids keep coming from a sequence, so they stay unique across partitions.
+#
+# The state only records the unchecked link (PrayerTimeMasjid.prayertime has
+# db_constraint=False): Django 5.0 cannot express the (id, date) primary key, so the
+# model keeps `id` as its primary key.
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLUMNS = "id, date, hijri_date, fajr, sunrise, dhuhr, asr, maghrib, isha, location_id, fetched_at"
+
+DROP_LINK_FOREIGN_KEYS = """
+DO $$
+DECLARE
+    fk text;
+BEGIN
+    FOR fk IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'prayertime_prayertime_masjids'::regclass
+          AND confrelid = 'prayertime_prayertime'::regclass
+          AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE prayertime_prayertime_masjids DROP CONSTRAINT %I', fk);
+    END LOOP;
+END $$;
+"""
+
+PARTITION = f"""
+{DROP_LINK_FOREIGN_KEYS}
+
+CREATE TABLE prayertime_prayertime_partitioned (
+    id bigint NOT NULL,
+    date date NOT NULL,
+    hijri_date varchar(50) NOT NULL,
+    fajr time NOT NULL,
+    sunrise time NOT NULL,
+    dhuhr time NOT NULL,
+    asr time NOT NULL,
+    maghrib time NOT NULL,
+    isha time NOT NULL,
+    location_id bigint NULL,
+    fetched_at timestamp with time zone NULL
+) PARTITION BY RANGE (date);
+
+DO $$
+DECLARE
+    y int;
+BEGIN
+    FOR y IN
+        SELECT DISTINCT extract(year FROM date)::int FROM prayertime_prayertime
+        UNION SELECT extract(year FROM now())::int
+        UNION SELECT extract(year FROM now())::int + 1
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF prayertime_prayertime_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'prayertime_prayertime_y' || y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+CREATE TABLE prayertime_prayertime_default PARTITION OF prayertime_prayertime_partitioned DEFAULT;
+
+INSERT INTO prayertime_prayertime_partitioned ({COLUMNS}) SELECT {COLUMNS} FROM prayertime_prayertime;
+
+DROP TABLE prayertime_prayertime;
+ALTER TABLE prayertime_prayertime_partitioned RENAME TO prayertime_prayertime;
+
+CREATE SEQUENCE prayertime_prayertime_id_seq OWNED BY prayertime_prayertime.id;
+SELECT setval('prayertime_prayertime_id_seq', COALESCE((SELECT max(id) FROM prayertime_prayertime), 0) + 1, false);
+ALTER TABLE prayertime_prayertime ALTER COLUMN id SET DEFAULT nextval('prayertime_prayertime_id_seq');
+
+ALTER TABLE prayertime_prayertime ADD CONSTRAINT prayertime_prayertime_pkey PRIMARY KEY (id, date);
+ALTER TABLE prayertime_prayertime
+    ADD CONSTRAINT unique_prayer_time_per_day_per_location UNIQUE (location_id, date);
+ALTER TABLE prayertime_prayertime
+    ADD CONSTRAINT prayertime_prayertime_location_id_fk_core_address_id
+    FOREIGN KEY (location_id) REFERENCES core_address (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+UNPARTITION = f"""
+CREATE TABLE prayertime_prayertime_plain (
+    id bigint NOT NULL PRIMARY KEY,
+    date date NOT NULL,
+    hijri_date varchar(50) NOT NULL,
+    fajr time NOT NULL,
+    sunrise time NOT NULL,
+    dhuhr time NOT NULL,
+    asr time NOT NULL,
+    maghrib time NOT NULL,
+    isha time NOT NULL,
+    location_id bigint NULL,
+    fetched_at timestamp with time zone NULL
+);
+INSERT INTO prayertime_prayertime_plain ({COLUMNS}) SELECT {COLUMNS} FROM prayertime_prayertime;
+
+DROP TABLE prayertime_prayertime CASCADE;
+ALTER TABLE prayertime_prayertime_plain RENAME TO prayertime_prayertime;
+ALTER TABLE prayertime_prayertime RENAME CONSTRAINT prayertime_prayertime_plain_pkey TO prayertime_prayertime_pkey;
+
+CREATE SEQUENCE prayertime_prayertime_id_seq OWNED BY prayertime_prayertime.id;
+SELECT setval('prayertime_prayertime_id_seq', COALESCE((SELECT max(id) FROM prayertime_prayertime), 0) + 1, false);
+ALTER TABLE prayertime_prayertime ALTER COLUMN id SET DEFAULT nextval('prayertime_prayertime_id_seq');
+
+ALTER TABLE prayertime_prayertime
+    ADD CONSTRAINT unique_prayer_time_per_day_per_location UNIQUE (location_id, date);
+ALTER TABLE prayertime_prayertime
+    ADD CONSTRAINT prayertime_prayertime_location_id_fk_core_address_id
+    FOREIGN KEY (location_id) REFERENCES core_address (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX prayertime_prayertime_location_id_idx ON prayertime_prayertime (location_id);
+
+DELETE FROM prayertime_prayertime_masjids t
+    WHERE NOT EXISTS (SELECT 1 FROM prayertime_prayertime pt WHERE pt.id = t.prayertime_id);
+ALTER TABLE prayertime_prayertime_masjids
+    ADD CONSTRAINT prayertime_prayertime_masjids_prayertime_id_fk
+    FOREIGN KEY (prayertime_id) REFERENCES prayertime_prayertime (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prayertime", "0011_iqamatime_iqama_rule_lookup_idx"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(PARTITION, UNPARTITION)],
+            state_operations=[
+                migrations.CreateModel(
+                    name="PrayerTimeMasjid",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "masjid",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="masjid.masjid",
+                            ),
+                        ),
+                        (
+                            "prayertime",
+                            models.ForeignKey(
+                                db_constraint=False,
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="prayertime.prayertime",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "prayertime_prayertime_masjids",
+                        "unique_together": {("prayertime", "masjid")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="prayertime",
+                    name="masjids",
+                    field=models.ManyToManyField(
+                        blank=True,
+                        through="prayertime.PrayerTimeMasjid",
+                        to="masjid.masjid",
+                    ),
+                ),
+            ],
+        ),
+    ]
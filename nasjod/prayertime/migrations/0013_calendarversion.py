@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prayertime", "0012_partition_prayertime_by_year"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CalendarVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from django.utils import timezone
 from core._helpers import get_next_friday
 from hijri_converter import Gregorian
@@ -9,6 +11,12 @@ from django.core.exceptions import ValidationError
 from core.models import Address
 
 
+@lru_cache(maxsize=4096)
+def hijri_date_for(day):
+    """Returns the hijri date string stored alongside a gregorian date."""
+    return str(Gregorian(day.year, day.month, day.day).to_hijri())
+
+
 class BasePrayerTime(models.Model):
     date = models.DateField()
     hijri_date = models.CharField(max_length=50, editable=False, default="")
@@ -18,7 +26,7 @@ class BasePrayerTime(models.Model):
         ordering = ['date']
 
     def save(self, *args, **kwargs):
-        self.hijri_date = str(Gregorian(self.date.year, self.date.month, self.date.day).to_hijri())
+        self.hijri_date = hijri_date_for(self.date)
         super().save(*args, **kwargs)
 
 
@@ -32,6 +40,13 @@ class IqamaTime(BasePrayerTime):
     maghrib_iqama = models.IntegerField(null=True, blank=True,)
     isha_iqama = models.IntegerField(null=True, blank=True,)
 
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            # Rule in force on a date: the latest one dated on or before it
+            models.Index(fields=['masjid', '-date'], name='iqama_rule_lookup_idx'),
+        ]
+
     @property
     def dhuhr_iqama_in_hours(self):
         """
@@ -44,17 +59,18 @@ class IqamaTime(BasePrayerTime):
         if not self.dhuhr_iqama_from_asr:
             return None
         
-        # Get the Asr prayer time for this masjid and today's date
-        prayer_time = PrayerTime.objects.filter(
-            masjids=self.masjid,
-            date=timezone.now().date()
-        ).first()
+        # Get the Asr prayer time for this masjid and today's date, from the
+        # DailySchedule key lookup when it is built
+        today = timezone.now().date()
+        asr = DailySchedule.objects.filter(masjid_id=self.masjid_id, date=today).values_list('asr', flat=True).first()
+        if asr is None:
+            asr = PrayerTime.objects.filter(masjids=self.masjid_id, date=today).values_list('asr', flat=True).first()
         
-        if not prayer_time or not prayer_time.asr:
+        if not asr:
             return None
         
         # Convert Asr time to datetime for calculation
-        asr_datetime = datetime.combine(self.date, prayer_time.asr)
+        asr_datetime = datetime.combine(self.date, asr)
         
         # Subtract the minutes using timedelta
         dhuhr_iqama_datetime = asr_datetime - timedelta(minutes=self.dhuhr_iqama_from_asr)
@@ -107,20 +123,40 @@ class BaseLocatedPrayerTime(BasePrayerTime):
 
 
 class PrayerTime(BaseLocatedPrayerTime):
+    """Adhan times of a location for one day, stored in yearly partitions (see prayertime/partitions.py)."""
     fajr = models.TimeField()
     sunrise = models.TimeField()
     dhuhr = models.TimeField()
     asr = models.TimeField()
     maghrib = models.TimeField()
     isha = models.TimeField()
+    fetched_at = models.DateTimeField(null=True, blank=True, editable=False)
+    masjids = models.ManyToManyField('masjid.Masjid', blank=True, through='PrayerTimeMasjid')
 
     class Meta:
         ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'date'], name='unique_prayer_time_per_day_per_location')
+        ]
 
     def __str__(self):
         return f"{self.date}"
 
 
+class PrayerTimeMasjid(models.Model):
+    """
+    Link of a prayer time to a masjid. The partitioned PrayerTime table has no unique
+    id to reference, so the database does not check `prayertime`: SQL deleting prayer
+    times must delete their links too (see core.restore.delete_rows).
+    """
+    prayertime = models.ForeignKey(PrayerTime, on_delete=models.CASCADE, db_constraint=False)
+    masjid = models.ForeignKey('masjid.Masjid', on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'prayertime_prayertime_masjids'
+        unique_together = [('prayertime', 'masjid')]
+
+
 class EidPrayerTime(BaseLocatedPrayerTime):
     eid_time = models.TimeField()
 
@@ -131,3 +167,79 @@ class EidPrayerTime(BaseLocatedPrayerTime):
 
     def __str__(self):
         return f"{self.date} - {self.eid_time}"
+
+
+class DailySchedule(models.Model):
+    """
+    Read model holding the resolved adhan and iqama times of a masjid for one day.
+    Rows cover a rolling horizon and are rebuilt by prayertime/schedules.py whenever
+    the PrayerTime, IqamaTime or JumuahPrayerTime they derive from change.
+    """
+    masjid = models.ForeignKey('masjid.Masjid', on_delete=models.CASCADE, related_name='daily_schedules')
+    date = models.DateField()
+    hijri_date = models.CharField(max_length=50, default="")
+
+    # Adhan
+    fajr = models.TimeField()
+    sunrise = models.TimeField()
+    dhuhr = models.TimeField()
+    asr = models.TimeField()
+    maghrib = models.TimeField()
+    isha = models.TimeField()
+
+    # Iqama
+    fajr_iqama = models.TimeField(null=True, blank=True)
+    dhuhr_iqama = models.TimeField(null=True, blank=True)
+    asr_iqama = models.TimeField(null=True, blank=True)
+    maghrib_iqama = models.TimeField(null=True, blank=True)
+    isha_iqama = models.TimeField(null=True, blank=True)
+    jumuah = models.TimeField(null=True, blank=True)
+
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['masjid', 'date'], name='unique_daily_schedule_per_day_per_masjid')
+        ]
+
+    def __str__(self):
+        return f"{self.masjid_id} - {self.date}"
+
+
+class OfflinePack(models.Model):
+    """
+    One version of the compressed timetable of a zone (PrayerTime location) for a year,
+    built by prayertime/packs.py. Older versions are kept to serve binary deltas.
+    """
+    location = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='offline_packs')
+    year = models.PositiveSmallIntegerField()
+    sha256 = models.CharField(max_length=64)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'year', 'sha256'], name='unique_offline_pack_version')
+        ]
+        indexes = [
+            models.Index(fields=['location', 'year', '-created_at'], name='offline_pack_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.location_id} - {self.year} - {self.sha256[:12]}"
+
+
+class CalendarVersion(models.Model):
+    """
+    Version of an iCalendar feed ("masjid:<id>" or "zone:<location id>"), bumped by the
+    rebuild tasks when its prayer times change. Cached months and ETags derive from it
+    (see prayertime/ical.py); a missing row is version 0.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} - {self.version}"
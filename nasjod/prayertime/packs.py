@@ -0,0 +1,168 @@
+"""
+Offline timetable packs for mobile clients.
+
+A pack holds the adhan times of a zone (a PrayerTime location) for one year, as
+minutes since midnight. Its canonical form is a small header followed by one int16
+column per prayer, each delta coded from the previous day, which zlib compresses to
+a few hundred bytes:
+
+    magic "NJTP" | format uint8 | year uint16 | days uint16 | prayers uint8
+    int16 little-endian * days, for each of fajr, sunrise, dhuhr, asr, maghrib, isha
+
+Days without prayer times hold MISSING before delta coding. The version of a pack is
+the sha256 of its canonical bytes. A delta between two versions lists the int16 slots
+that changed, so clients patch their canonical copy and check the target hash:
+
+    magic "NJTD" | base sha256 (32 bytes) | target sha256 (32 bytes) | count uint32
+    (slot uint16, value int16) * count
+
+Packs and deltas are stored and served zlib compressed.
+"""
+import hashlib
+import struct
+import sys
+import zlib
+from array import array
+from calendar import isleap
+from datetime import date
+from itertools import groupby
+
+from django.db import transaction
+
+from .models import OfflinePack, PrayerTime
+
+PRAYERS = ('fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
+MISSING = -1
+FORMAT_VERSION = 1
+PACK_MAGIC = b'NJTP'
+DELTA_MAGIC = b'NJTD'
+HEADER = struct.Struct('<4sBHHB')
+DELTA_HEADER = struct.Struct('<4s32s32sI')
+DELTA_RECORD = struct.Struct('<Hh')
+KEEP_VERSIONS = 5
+
+
+def _to_bytes(values):
+    column = array('h', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_bytes(data):
+    column = array('h')
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def encode(year, rows):
+    """Canonical pack of `year` from (date, fajr, sunrise, dhuhr, asr, maghrib, isha) rows."""
+    days = 366 if isleap(year) else 365
+    first = date(year, 1, 1).toordinal()
+    columns = [[MISSING] * days for _ in PRAYERS]
+    for day, *times in rows:
+        index = day.toordinal() - first
+        for column, value in zip(columns, times):
+            column[index] = value.hour * 60 + value.minute
+
+    body = []
+    for column in columns:
+        body.append(_to_bytes([column[0]] + [current - previous for previous, current in zip(column, column[1:])]))
+    return HEADER.pack(PACK_MAGIC, FORMAT_VERSION, year, days, len(PRAYERS)) + b''.join(body)
+
+
+def decode(canonical):
+    """Returns (year, {prayer: [minutes since midnight or None per day]}) of a canonical pack."""
+    magic, version, year, days, prayers = HEADER.unpack_from(canonical)
+    if magic != PACK_MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a timetable pack of a supported format")
+    values = _from_bytes(canonical[HEADER.size:])
+    columns = {}
+    for index, prayer in enumerate(PRAYERS[:prayers]):
+        column, total = [], 0
+        for delta in values[index * days:(index + 1) * days]:
+            total += delta
+            column.append(None if total == MISSING else total)
+        columns[prayer] = column
+    return year, columns
+
+
+def digest(canonical):
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def make_delta(base, target):
+    """Compressed delta turning canonical `base` into `target`, or None when their layouts differ."""
+    if len(base) != len(target) or base[:HEADER.size] != target[:HEADER.size]:
+        return None
+    old, new = _from_bytes(base[HEADER.size:]), _from_bytes(target[HEADER.size:])
+    changes = [DELTA_RECORD.pack(slot, value) for slot, (previous, value) in enumerate(zip(old, new)) if previous != value]
+    header = DELTA_HEADER.pack(
+        DELTA_MAGIC, hashlib.sha256(base).digest(), hashlib.sha256(target).digest(), len(changes)
+    )
+    return zlib.compress(header + b''.join(changes), 9)
+
+
+def apply_delta(base, delta):
+    """Applies a compressed delta to canonical `base`, as clients do, and checks the result."""
+    data = zlib.decompress(delta)
+    magic, base_hash, target_hash, count = DELTA_HEADER.unpack_from(data)
+    if magic != DELTA_MAGIC or hashlib.sha256(base).digest() != base_hash:
+        raise ValueError("Delta does not apply to this pack")
+    values = _from_bytes(base[HEADER.size:])
+    for slot, value in DELTA_RECORD.iter_unpack(data[DELTA_HEADER.size:DELTA_HEADER.size + count * DELTA_RECORD.size]):
+        values[slot] = value
+    target = base[:HEADER.size] + _to_bytes(values)
+    if hashlib.sha256(target).digest() != target_hash:
+        raise ValueError("Patched pack does not match the target version")
+    return target
+
+
+def latest_packs(year=None, defer_data=True):
+    """Latest OfflinePack of every (location, year)."""
+    packs = OfflinePack.objects.order_by('location_id', 'year', '-created_at', '-id').distinct('location_id', 'year')
+    if year is not None:
+        packs = packs.filter(year=year)
+    return packs.defer('data') if defer_data else packs
+
+
+def build_packs(year, location_ids=None, keep=KEEP_VERSIONS):
+    """
+    Builds the packs of `year` for `location_ids` (every location when None) from one
+    streamed query. A new version is stored only when the content changed, and the
+    `keep` latest versions of each pack are kept. Returns (built, unchanged).
+    """
+    rows = PrayerTime.objects.filter(date__year=year, location__isnull=False)
+    latest = latest_packs(year)
+    if location_ids is not None:
+        rows = rows.filter(location_id__in=location_ids)
+        latest = latest.filter(location_id__in=location_ids)
+    current = dict(latest.values_list('location_id', 'sha256'))
+    rows = rows.order_by('location_id', 'date').values_list('location_id', 'date', *PRAYERS)
+
+    packs = []
+    unchanged = 0
+    for location_id, location_rows in groupby(rows.iterator(chunk_size=2000), key=lambda row: row[0]):
+        canonical = encode(year, (row[1:] for row in location_rows))
+        sha256 = digest(canonical)
+        if current.get(location_id) == sha256:
+            unchanged += 1
+            continue
+        data = zlib.compress(canonical, 9)
+        packs.append(OfflinePack(location_id=location_id, year=year, sha256=sha256, data=data, size=len(data)))
+
+    with transaction.atomic():
+        # A pack reverting to an older version makes that version the latest again
+        OfflinePack.objects.bulk_create(
+            packs,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['location', 'year', 'sha256'],
+            update_fields=['created_at'],
+        )
+        for pack in packs:
+            stale = OfflinePack.objects.filter(location_id=pack.location_id, year=year).values_list('id', flat=True)[keep:]
+            OfflinePack.objects.filter(id__in=list(stale)).delete()
+    return len(packs), unchanged
@@ -0,0 +1,184 @@
+"""
+Yearly partitions of the PrayerTime table and their retention.
+
+prayertime_prayertime is partitioned by RANGE (date) with one partition per year
+(prayertime_prayertime_y2025, ...) and a default partition catching dates without
+one. Queries filtering on `date` only read the partitions of those years.
+
+Past years are archived as gzipped NDJSON in the default storage, their masjid links
+included, then detached and dropped. JumuahPrayerTime and EidPrayerTime rows that no
+longer apply are archived and deleted alongside.
+"""
+import gzip
+import hashlib
+import json
+import tempfile
+from datetime import date
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, Value
+
+from .models import EidPrayerTime, JumuahPrayerTime, PrayerTime, PrayerTimeMasjid
+
+ARCHIVE_PREFIX = 'archives/prayertime'
+FETCH_SIZE = 5000
+COLUMNS = ('id', 'date', 'hijri_date', 'fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha', 'location_id', 'fetched_at')
+
+
+def _table():
+    return PrayerTime._meta.db_table
+
+
+def partition_name(year):
+    return f'{_table()}_y{year}'
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def partition_years():
+    """Years having a partition attached to the PrayerTime table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [_table()],
+        )
+        prefix = f'{_table()}_y'
+        return sorted(int(name[len(prefix):]) for name, in cursor.fetchall() if name.startswith(prefix))
+
+
+def default_years():
+    """Years having rows in the default partition."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT extract(year FROM date)::int FROM {_quote(f'{_table()}_default')}")
+        return sorted(year for year, in cursor.fetchall())
+
+
+def ensure_partitions(years):
+    """
+    Creates the missing partitions of `years`. Rows of those years that landed in the
+    default partition are moved into the new partition. Returns the years created.
+    """
+    created = []
+    existing = set(partition_years())
+    default = _quote(f'{_table()}_default')
+    for year in sorted(set(years) - existing):
+        bounds = [date(year, 1, 1), date(year + 1, 1, 1)]
+        # The rows are moved with their ids, so their masjid links stay valid
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE moved_prayer_times AS "
+                f"SELECT * FROM {default} WHERE date >= %s AND date < %s", bounds
+            )
+            cursor.execute(f"DELETE FROM {default} WHERE date >= %s AND date < %s", bounds)
+            cursor.execute(
+                f"CREATE TABLE {_quote(partition_name(year))} PARTITION OF {_quote(_table())} "
+                f"FOR VALUES FROM (%s) TO (%s)", bounds
+            )
+            cursor.execute(f"INSERT INTO {_quote(_table())} SELECT * FROM moved_prayer_times")
+            cursor.execute("DROP TABLE moved_prayer_times")
+        created.append(year)
+    return created
+
+
+def _upload(name, rows):
+    """Writes `rows` as gzipped NDJSON to the default storage. Returns (name, count, sha256)."""
+    count = 0
+    digest = hashlib.sha256()
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as archive:
+            for row in rows:
+                line = (json.dumps(row, default=str, ensure_ascii=False) + '\n').encode('utf-8')
+                digest.update(line)
+                archive.write(line)
+                count += 1
+        tmp.seek(0)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        name = default_storage.save(name, File(tmp))
+    return name, count, digest.hexdigest()
+
+
+def _partition_rows(year):
+    """Streams the rows of a year's partition, with their masjid ids, from a server-side cursor."""
+    field = PrayerTime._meta.get_field('masjids')
+    through = field.remote_field.through._meta.db_table
+    sql = (
+        f"SELECT {', '.join(f'pt.{column}' for column in COLUMNS)}, "
+        f"ARRAY(SELECT t.{_quote(field.m2m_reverse_name())} FROM {_quote(through)} t "
+        f"WHERE t.{_quote(field.m2m_column_name())} = pt.id ORDER BY 1) "
+        f"FROM {_quote(partition_name(year))} pt ORDER BY pt.location_id, pt.date"
+    )
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for *values, masjids in rows:
+                yield {**dict(zip(COLUMNS, values)), 'masjids': masjids}
+
+
+def archive_year(year, drop=True):
+    """
+    Archives the PrayerTime partition of `year` with its masjid links, then deletes the
+    links and detaches the partition, dropping it unless `drop` is False.
+    Returns (archive name, rows, sha256).
+    """
+    if year not in partition_years():
+        raise ValueError(f"No PrayerTime partition for {year}")
+    with transaction.atomic():
+        name, count, sha256 = _upload(f'{ARCHIVE_PREFIX}/{year}/prayer_times.ndjson.gz', _partition_rows(year))
+
+        # Dropping the partition leaves its links behind: nothing references it in the database
+        partition = _quote(partition_name(year))
+        prayertime = PrayerTimeMasjid._meta.get_field('prayertime')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {_quote(PrayerTimeMasjid._meta.db_table)} t USING {partition} pt "
+                f"WHERE t.{_quote(prayertime.column)} = pt.id"
+            )
+            cursor.execute(f"ALTER TABLE {_quote(_table())} DETACH PARTITION {partition}")
+            if drop:
+                cursor.execute(f"DROP TABLE {partition}")
+    return name, count, sha256
+
+
+def _rule_rows(queryset):
+    fields = [field.attname for field in queryset.model._meta.concrete_fields]
+    if queryset.model is EidPrayerTime:
+        queryset = queryset.annotate(
+            masjid_ids=ArrayAgg('masjids', filter=Q(masjids__isnull=False), distinct=True, default=Value([]))
+        )
+        fields.append('masjid_ids')
+    return queryset.order_by('id').values(*fields).iterator(chunk_size=FETCH_SIZE)
+
+
+def archive_rules(before):
+    """
+    Archives and deletes the Eid prayers dated before `before`, and the Jumuah rules
+    superseded before it, i.e. a later rule of the same masjid already applied on `before`.
+    Returns {model name: (archive name, rows)}.
+    """
+    superseded = JumuahPrayerTime.objects.filter(
+        masjid_id=OuterRef('masjid_id'), date__gt=OuterRef('date'), date__lte=before
+    )
+    querysets = (
+        EidPrayerTime.objects.filter(date__lt=before),
+        JumuahPrayerTime.objects.filter(date__lt=before).filter(Exists(superseded)),
+    )
+    archived = {}
+    with transaction.atomic():
+        for queryset in querysets:
+            name = f'{ARCHIVE_PREFIX}/{before:%Y-%m-%d}/{queryset.model._meta.model_name}.ndjson.gz'
+            name, count, _ = _upload(name, _rule_rows(queryset))
+            queryset.delete()
+            archived[queryset.model.__name__] = (name, count)
+    return archived
@@ -0,0 +1,54 @@
+"""
+Plans incremental prayer time refreshes: which (zone, date) cells of a window
+are missing from PrayerTime, or were fetched too long ago.
+"""
+from datetime import timedelta
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q
+from django.utils import timezone
+
+from .loaders import prefetch_locations
+from .models import PrayerTime
+
+
+def zone_locations(zones):
+    """
+    Maps each zone to the id of the Address its prayer times are stored on,
+    with the same preference as loaders.resolve_location (lowest id first).
+    Zones that were never loaded are left out.
+    """
+    addresses = prefetch_locations((zone.governorate, zone.city) for zone in zones)
+    return {
+        zone: addresses[(zone.governorate, zone.city)].id
+        for zone in zones
+        if (zone.governorate, zone.city) in addresses
+    }
+
+
+def plan_refresh(zones, start_date, end_date, max_age=None):
+    """
+    Returns {zone: [dates]} for the cells between start_date and end_date that are
+    missing, or older than `max_age` (a timedelta) when given. Zones with nothing
+    to refresh are not in the result. Existing cells are read in one grouped query.
+    """
+    days = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
+    locations = zone_locations(zones)
+
+    fresh = None
+    if max_age is not None:
+        fresh = Q(fetched_at__gte=timezone.now() - max_age)
+    present = dict(
+        PrayerTime.objects.filter(location_id__in=locations.values(), date__range=(start_date, end_date))
+        .values('location_id')
+        .annotate(dates=ArrayAgg('date', filter=fresh, default=[]))
+        .values_list('location_id', 'dates')
+    )
+
+    plan = {}
+    for zone in zones:
+        have = set(present.get(locations.get(zone), ()))
+        missing = [day for day in days if day not in have]
+        if missing:
+            plan[zone] = missing
+    return plan
@@ -0,0 +1,192 @@
+"""
+Builds the DailySchedule read model.
+
+For every masjid and day of the horizon, the adhan times come from the PrayerTime
+linked to the masjid, and its iqama and Jumuah rules are resolved to absolute times:
+
+- IqamaTime and JumuahPrayerTime rows apply from their date onwards; a day uses the
+  latest row dated on or before it, or the earliest row when all are later.
+- Iqamas are minute offsets from the adhan. Dhuhr uses dhuhr_iqama_hour when set,
+  else dhuhr_iqama_from_asr minutes before Asr, else the dhuhr_iqama offset.
+- Jumuah is the earliest timeslot of the applicable Friday rules; a first timeslot
+  Jumuah is at the Dhuhr adhan.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DailySchedule, IqamaTime, JumuahPrayerTime, PrayerTime
+
+BATCH_SIZE = 1000
+ADHAN_FIELDS = ('fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
+# Adhan field -> IqamaTime minute offset field, Dhuhr is resolved separately
+IQAMA_OFFSETS = {
+    'fajr': 'fajr_iqama',
+    'asr': 'asr_iqama',
+    'maghrib': 'maghrib_iqama',
+    'isha': 'isha_iqama',
+}
+SCHEDULE_FIELDS = (
+    'hijri_date', *ADHAN_FIELDS,
+    'fajr_iqama', 'dhuhr_iqama', 'asr_iqama', 'maghrib_iqama', 'isha_iqama', 'jumuah', 'built_at',
+)
+
+_DAY = datetime(2000, 1, 1)
+
+
+def horizon(start=None, days=None):
+    """Returns the (first, last) dates of the rolling horizon starting today."""
+    start = start or timezone.localdate()
+    days = days or settings.DAILY_SCHEDULE_HORIZON_DAYS
+    return start, start + timedelta(days=days - 1)
+
+
+def shift(value, minutes):
+    """Adds `minutes` (possibly negative) to a time of day."""
+    return (datetime.combine(_DAY, value) + timedelta(minutes=minutes)).time()
+
+
+def applicable(rules, day):
+    """
+    From date-sorted `rules`, returns those of the latest date on or before `day`,
+    or those of the earliest date when every rule is later.
+    """
+    if not rules:
+        return []
+    dates = [rule.date for rule in rules]
+    index = bisect_right(dates, day)
+    chosen = dates[index - 1] if index else dates[0]
+    return [rule for rule in rules if rule.date == chosen]
+
+
+def resolve_iqamas(adhan, rule):
+    """Absolute iqama times for the adhan times of a day and an IqamaTime rule (or None)."""
+    iqamas = {field: None for field in ('fajr_iqama', 'dhuhr_iqama', 'asr_iqama', 'maghrib_iqama', 'isha_iqama')}
+    if rule is None:
+        return iqamas
+
+    for prayer, field in IQAMA_OFFSETS.items():
+        offset = getattr(rule, field)
+        if offset is not None:
+            iqamas[field] = shift(adhan[prayer], offset)
+
+    if rule.dhuhr_iqama_hour:
+        iqamas['dhuhr_iqama'] = rule.dhuhr_iqama_hour
+    elif rule.dhuhr_iqama_from_asr:
+        iqamas['dhuhr_iqama'] = shift(adhan['asr'], -rule.dhuhr_iqama_from_asr)
+    elif rule.dhuhr_iqama is not None:
+        iqamas['dhuhr_iqama'] = shift(adhan['dhuhr'], rule.dhuhr_iqama)
+    return iqamas
+
+
+def resolve_jumuah(adhan, rules):
+    """Earliest Jumuah time of the applicable JumuahPrayerTime rules, or None."""
+    times = [adhan['dhuhr'] if rule.first_timeslot_jumuah else rule.jumuah_time for rule in rules]
+    times = [value for value in times if value is not None]
+    return min(times) if times else None
+
+
+def iter_schedules(masjid_ids=None, start=None, end=None, chunk_size=BATCH_SIZE):
+    """
+    Yields unsaved DailySchedule objects of `masjid_ids` (every masjid when None) between
+    `start` and `end`, the horizon by default, ordered by masjid and date. PrayerTimes
+    are read with one streamed range query, the rules with one query each.
+    """
+    if start is None or end is None:
+        start, end = horizon()
+    if masjid_ids is not None:
+        masjid_ids = list(masjid_ids)
+        if not masjid_ids:
+            return
+
+    Link = PrayerTime.masjids.through
+    links = Link.objects.filter(prayertime__date__range=(start, end))
+    iqama_rules = IqamaTime.objects.order_by('masjid_id', 'date', 'id')
+    jumuah_rules = JumuahPrayerTime.objects.order_by('masjid_id', 'date', 'jumuah_time')
+    if masjid_ids is not None:
+        links = links.filter(masjid_id__in=masjid_ids)
+        iqama_rules = iqama_rules.filter(masjid_id__in=masjid_ids)
+        jumuah_rules = jumuah_rules.filter(masjid_id__in=masjid_ids)
+
+    iqamas_by_masjid = defaultdict(list)
+    for rule in iqama_rules:
+        iqamas_by_masjid[rule.masjid_id].append(rule)
+    jumuahs_by_masjid = defaultdict(list)
+    for rule in jumuah_rules:
+        jumuahs_by_masjid[rule.masjid_id].append(rule)
+
+    rows = links.order_by('masjid_id', 'prayertime__date', 'prayertime_id').values_list(
+        'masjid_id', 'prayertime__date', 'prayertime__hijri_date', *(f'prayertime__{field}' for field in ADHAN_FIELDS)
+    )
+
+    previous = None
+    for masjid_id, day, hijri_date, *times in rows.iterator(chunk_size=chunk_size):
+        # A masjid linked to several locations keeps the first PrayerTime of the day
+        if (masjid_id, day) == previous:
+            continue
+        previous = (masjid_id, day)
+
+        adhan = dict(zip(ADHAN_FIELDS, times))
+        iqama = applicable(iqamas_by_masjid.get(masjid_id, ()), day)
+        jumuah = None
+        if day.weekday() == 4:  # Friday
+            jumuah = resolve_jumuah(adhan, applicable(jumuahs_by_masjid.get(masjid_id, ()), day))
+        yield DailySchedule(
+            masjid_id=masjid_id,
+            date=day,
+            hijri_date=hijri_date,
+            jumuah=jumuah,
+            **adhan,
+            **resolve_iqamas(adhan, iqama[-1] if iqama else None),
+        )
+
+
+def build_schedules(masjid_ids=None, start=None, end=None, batch_size=BATCH_SIZE):
+    """
+    Rebuilds the DailySchedule rows of `masjid_ids` (every masjid when None) between
+    `start` and `end`, the horizon by default. Rows that no longer have a PrayerTime
+    are deleted. Returns (written, deleted).
+    """
+    if start is None or end is None:
+        start, end = horizon()
+    if masjid_ids is not None:
+        masjid_ids = list(masjid_ids)
+        if not masjid_ids:
+            return 0, 0
+    started = timezone.now()
+
+    written = 0
+    pending = []
+    for schedule in iter_schedules(masjid_ids, start, end, batch_size):
+        schedule.built_at = started
+        pending.append(schedule)
+        if len(pending) >= batch_size:
+            written += _write(pending)
+            pending = []
+    if pending:
+        written += _write(pending)
+
+    stale = DailySchedule.objects.filter(date__range=(start, end), built_at__lt=started)
+    if masjid_ids is not None:
+        stale = stale.filter(masjid_id__in=masjid_ids)
+    deleted, _ = stale.delete()
+    return written, deleted
+
+
+def _write(schedules):
+    DailySchedule.objects.bulk_create(
+        schedules,
+        update_conflicts=True,
+        unique_fields=['masjid', 'date'],
+        update_fields=SCHEDULE_FIELDS,
+    )
+    return len(schedules)
+
+
+def prune(before=None):
+    """Deletes the schedules of days before `before` (today by default)."""
+    deleted, _ = DailySchedule.objects.filter(date__lt=before or timezone.localdate()).delete()
+    return deleted
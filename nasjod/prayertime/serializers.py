@@ -1,10 +1,12 @@
+from django.db import models
 from rest_framework import serializers
 from django.contrib.gis.geos import Point
 
 from core.models import Address
 from core.serializers import AddressSerializer
 from masjid.models import Masjid
-from .models import JumuahPrayerTime, EidPrayerTime, IqamaTime, PrayerTime
+from .iqamas import IQAMA_FIELDS, current_rules
+from .models import DailySchedule, JumuahPrayerTime, EidPrayerTime, IqamaTime, PrayerTime
 
 
 class BasePrayerTimeSerializer(serializers.ModelSerializer):
@@ -136,6 +138,16 @@ class IqamaTimeSerializer(serializers.ModelSerializer):
         fields = ('date', 'fajr_iqama', 'dhuhr_iqama', 'dhuhr_iqama_from_asr', 'dhuhr_iqama_hour', 'dhuhr_iqama_in_hours', 'asr_iqama', 
                 'maghrib_iqama', 'isha_iqama', 'masjid')
 
+
+class IqamaTimeBulkSerializer(serializers.ModelSerializer):
+    """One entry of a bulk iqama update, masjids are resolved for the whole batch at once."""
+    masjid = serializers.UUIDField()
+
+    class Meta:
+        model = IqamaTime
+        fields = ('masjid', 'date', *IQAMA_FIELDS)
+
+
 class IqamaTimeMasjidSerializer(serializers.ModelSerializer):
     """Serializer for IqamaTime used in MasjidSerializer to avoid nested masjid representation."""
     class Meta:
@@ -151,3 +163,26 @@ class IqamaTimeMasjidSerializer(serializers.ModelSerializer):
                 "isha_iqama",
                 )
         read_only_fields = ('hijri_date',)
+
+
+class CurrentIqamaListSerializer(serializers.ListSerializer):
+    """
+    Lists a masjid's iqama rules as the one in force today followed by the next scheduled
+    change, instead of the whole history. Writes are unchanged.
+    """
+    def to_representation(self, data):
+        if isinstance(data, models.manager.BaseManager):
+            data = current_rules(data.instance.pk)
+        return super().to_representation(data)
+
+
+class DailyScheduleSerializer(serializers.ModelSerializer):
+    """Resolved adhan and iqama times of a masjid for one day."""
+    class Meta:
+        model = DailySchedule
+        fields = ("date", "hijri_date",
+                  "fajr", "sunrise", "dhuhr", "asr", "maghrib", "isha",
+                  "fajr_iqama", "dhuhr_iqama", "asr_iqama", "maghrib_iqama", "isha_iqama",
+                  "jumuah",
+                )
+        read_only_fields = fields
@@ -0,0 +1,43 @@
+"""
+Keeps the DailySchedule read model, the calendars and the shared timetable in sync
+with edits made through the ORM.
+Bulk writes that bypass signals (PrayerTimeLoader, prayertime.linking) queue
+their rebuilds themselves.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import ical
+from .models import IqamaTime, JumuahPrayerTime, PrayerTime
+from .tasks import schedule_rebuild, timetable_changed
+
+
+@receiver(post_save, sender=IqamaTime)
+@receiver(post_delete, sender=IqamaTime)
+@receiver(post_save, sender=JumuahPrayerTime)
+@receiver(post_delete, sender=JumuahPrayerTime)
+def rebuild_on_rule_change(sender, instance, **kwargs):
+    schedule_rebuild([instance.masjid_id])
+
+
+@receiver(post_save, sender=PrayerTime)
+@receiver(pre_delete, sender=PrayerTime)
+def rebuild_on_prayer_time_change(sender, instance, **kwargs):
+    # pre_delete: the links are gone by the time post_delete is sent
+    schedule_rebuild(instance.masjids.values_list('id', flat=True))
+    ical.invalidate_zones([instance.location_id])
+    timetable_changed()
+
+
+@receiver(m2m_changed, sender=PrayerTime.masjids.through)
+def rebuild_on_link_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'pre_clear'):
+        timetable_changed()
+    if reverse:
+        # masjid.prayertime_set.add(...): instance is the masjid
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            schedule_rebuild([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        schedule_rebuild(pk_set)
+    elif action == 'pre_clear':
+        schedule_rebuild(instance.masjids.values_list('id', flat=True))
@@ -0,0 +1,63 @@
+"""
+Background tasks for prayer times, run by `manage.py run_worker` (see core/jobs.py).
+"""
+from datetime import timedelta
+
+from django.db import transaction
+
+from core.jobs import task
+
+from . import ical, timetable
+from .models import PrayerTime
+from .schedules import build_schedules, prune
+
+
+@task(dedup_key='daily-schedule:{masjid_id}')
+def rebuild_masjid_schedule(masjid_id):
+    """Rebuilds the DailySchedule horizon of one masjid and drops its cached calendar."""
+    build_schedules([masjid_id])
+    ical.invalidate([masjid_id])
+
+
+@task()
+def rebuild_masjid_schedules(masjid_ids):
+    """Rebuilds the DailySchedule horizon and drops the cached calendars of a batch of masjids at once."""
+    build_schedules(masjid_ids)
+    ical.invalidate(masjid_ids)
+
+
+@task(dedup_key='daily-schedule-location:{location_id}')
+def rebuild_location_schedules(location_id):
+    """Rebuilds the DailySchedule horizon and drops the cached calendars of a location and its linked masjids."""
+    masjid_ids = list(PrayerTime.masjids.through.objects.filter(
+        prayertime__location_id=location_id
+    ).values_list('masjid_id', flat=True).distinct())
+    build_schedules(masjid_ids)
+    ical.invalidate(masjid_ids)
+    ical.invalidate_zones([location_id])
+
+
+@task(priority=-5, every=timedelta(days=1))
+def extend_daily_schedules():
+    """Moves the DailySchedule horizon to today and drops the past days, like build_daily_schedules, once a day."""
+    with transaction.atomic():
+        build_schedules()
+        prune()
+
+
+@task(priority=-10, dedup_key='timetable')
+def rebuild_timetable():
+    """Rebuilds the shared memory-mapped timetable once a batch of prayer times or links changed."""
+    timetable.build()
+
+
+def timetable_changed():
+    """Marks the shared timetable stale, so reads go to Postgres, and queues its rebuild."""
+    timetable.mark_stale()
+    rebuild_timetable.delay()
+
+
+def schedule_rebuild(masjid_ids):
+    """Queues a DailySchedule rebuild for each masjid."""
+    for masjid_id in set(masjid_ids):
+        rebuild_masjid_schedule.delay(masjid_id=masjid_id)
@@ -0,0 +1,25 @@
+from core.tests.fixtures import *
+
+import pytest
+
+from core.models import Address
+
+
+@pytest.fixture
+def location():
+    return Address.objects.create(
+        city="Sfax Ville",
+        state="Sfax",
+        country="Tunisia",
+        coordinates="POINT (10.760028 34.745000)"
+    )
+
+
+@pytest.fixture
+def meteo_entries():
+    return [
+        {"date": "2024-12-15 00:00", "sobh": "05:41", "sunrise": "07:09", "dhohr": "12:14",
+         "aser": "14:50", "magreb": "17:11", "isha": "18:37"},
+        {"date": "2024-12-16 00:00", "sobh": "05:42", "sunrise": "07:10", "dhohr": "12:15",
+         "aser": "14:50", "magreb": "17:11", "isha": "18:38"},
+    ]
@@ -0,0 +1,38 @@
+import gzip
+import json
+
+import pytest
+
+from .. import exports
+from ..loaders import PrayerTimeLoader
+
+
+@pytest.mark.django_db
+def test_iter_csv_batches_rows(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+
+    chunks = list(exports.iter_csv(exports.export_queryset(2024, 'Sfax Ville'), chunk_size=1))
+    lines = ''.join(chunks).splitlines()
+    assert len(chunks) == 2
+    assert lines[0] == ','.join(exports.COLUMNS)
+    assert lines[1].startswith('sfax,sfax ville,2024-12-15,')
+    assert len(lines) == 3
+
+
+@pytest.mark.django_db
+def test_export_endpoint_streams_gzipped_ndjson(client, location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+
+    response = client.get(
+        '/api/prayer-times/export', {'zone': 'sfax ville', 'year': 2024, 'format': 'ndjson'},
+        HTTP_ACCEPT_ENCODING='gzip',
+    )
+    assert response.status_code == 200
+    assert response['Content-Encoding'] == 'gzip'
+    rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+    assert [row['date'] for row in rows] == ['2024-12-15', '2024-12-16']
+    assert rows[0]['fajr'] == '05:41:00'
+
+    # Formats are renderers: an unknown one is not found, like any other ?format= of the API
+    assert client.get('/api/prayer-times/export', {'format': 'xml'}).status_code == 404
+    assert client.get('/api/prayer-times/export', {'year': 'next'}).status_code == 400
@@ -0,0 +1,99 @@
+import pytest
+from datetime import date
+
+from core.models import Address
+from core.throttling import CalendarThrottle
+from masjid.models import Masjid
+from .. import ical
+from ..linking import link_prayer_times
+from ..loaders import PrayerTimeLoader
+
+
+@pytest.fixture
+def masjid():
+    address = Address.objects.create(
+        city="Sfax Ville",
+        state="Sfax",
+        country="Tunisia",
+        coordinates="POINT (10.761000 34.740000)"
+    )
+    return Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=address)
+
+
+@pytest.fixture(autouse=True)
+def calendar_cache(settings):
+    settings.CALENDAR_CACHE = 'default'
+
+
+def test_fold_limits_lines_to_75_octets():
+    folded = ical.fold("SUMMARY:" + "é" * 80)
+    lines = folded.split('\r\n')[:-1]
+    assert all(len(line.encode('utf-8')) <= 75 for line in lines)
+    assert all(line.startswith(' ') for line in lines[1:])
+    assert ''.join(line[1:] if index else line for index, line in enumerate(lines)) == "SUMMARY:" + "é" * 80
+
+
+@pytest.mark.django_db
+def test_stream_feed_contains_selected_prayers(location, masjid, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    link_prayer_times([masjid.pk], [location.pk])
+
+    feed = ''.join(ical.stream_feed(masjid, 1, ['fajr', 'maghrib'], 'adhan', start=date(2024, 12, 1)))
+
+    assert feed.startswith('BEGIN:VCALENDAR\r\n') and feed.endswith('END:VCALENDAR\r\n')
+    assert feed.count('BEGIN:VEVENT') == 4
+    assert 'DTSTART;TZID=Africa/Tunis:20241215T054100' in feed
+    assert 'LOCATION:Masjid Sidi Lakhmi\\, Sfax' in feed
+
+
+@pytest.mark.django_db
+def test_calendar_endpoint_answers_conditional_requests(client, masjid):
+    url = f'/api/masajid/{masjid.uuid}/calendar.ics'
+    response = client.get(url, {'prayers': 'fajr,isha', 'time': 'iqama'})
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/calendar')
+    b''.join(response.streaming_content)
+
+    response = client.get(url, {'prayers': 'fajr,isha', 'time': 'iqama'}, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+    assert client.get(url, {'prayers': 'sunset'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_calendar_endpoint_is_throttled(client, masjid, monkeypatch):
+    monkeypatch.setattr(CalendarThrottle, 'THROTTLE_RATES', {'calendar': '1/min'})
+    CalendarThrottle.cache.clear()
+    url = f'/api/masajid/{masjid.uuid}/calendar.ics'
+
+    assert client.get(url).status_code == 200
+    response = client.get(url)
+    assert response.status_code == 429
+    assert response['Content-Type'] == 'application/json' and 'detail' in response.json()
+
+
+@pytest.mark.django_db
+def test_invalidate_bumps_the_stored_version(masjid):
+    key = f'masjid:{masjid.pk}'
+    assert ical.version(key) == 0
+
+    ical.invalidate([masjid.pk])
+    ical.invalidate([masjid.pk])
+
+    assert ical.version(key) == 2
+
+
+@pytest.mark.django_db
+def test_zone_calendar_endpoint_streams_the_adhan_times(client, location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    url = f'/api/zones/{location.pk}/calendar.ics'
+
+    response = client.get(url, {'prayers': 'fajr'})
+    assert response.status_code == 200
+    feed = b''.join(response.streaming_content).decode('utf-8')
+    assert 'X-WR-CALNAME:' in feed and feed.endswith('END:VCALENDAR\r\n')
+
+    ical.invalidate_zones([location.pk])
+    assert client.get(url, {'prayers': 'fajr'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 200
+    assert client.get(url, {'time': 'iqama'}).status_code == 400
+    assert client.get(f'/api/zones/{location.pk + 1000}/calendar.ics').status_code == 404
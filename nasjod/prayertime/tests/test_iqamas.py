@@ -0,0 +1,87 @@
+from datetime import date
+
+import pytest
+
+from core.models import Address, Job
+from masjid.models import Masjid
+from .. import iqamas
+from ..models import IqamaTime
+from ..tasks import rebuild_masjid_schedules
+
+URL = '/api/iqamas/bulk/'
+
+
+def new_address(index):
+    # A masjid needs an address of its own
+    return Address.objects.create(
+        city="Sfax Ville",
+        state="Sfax",
+        country="Tunisia",
+        coordinates=f"POINT ({10.761 + index / 1000:.6f} 34.740000)"
+    )
+
+
+@pytest.fixture
+def masjids(manager_user):
+    managed = [Masjid.objects.create(name=f"Masjid {index}", address=new_address(index)) for index in range(3)]
+    for masjid in managed:
+        masjid.managers.add(manager_user)
+    return managed
+
+
+@pytest.mark.django_db
+def test_bulk_creates_and_updates_rules_in_one_batch(api_client, manager_user, masjids):
+    IqamaTime.objects.create(masjid=masjids[0], date=date(2025, 3, 1), fajr_iqama=20, isha_iqama=10)
+    Job.objects.all().delete()
+    api_client.force_authenticate(manager_user)
+
+    response = api_client.post(URL, [
+        {'masjid': str(masjid.uuid), 'date': '2025-03-01', 'fajr_iqama': 25} for masjid in masjids
+    ], format='json')
+
+    assert response.status_code == 200
+    assert response.json() == {'created': 2, 'updated': 1}
+    rule = IqamaTime.objects.get(masjid=masjids[0])
+    assert (rule.fajr_iqama, rule.isha_iqama) == (25, 10)
+    assert IqamaTime.objects.get(masjid=masjids[1]).hijri_date
+    jobs = Job.objects.filter(name=rebuild_masjid_schedules.task_name)
+    assert [job.payload['masjid_ids'] for job in jobs] == [sorted(masjid.pk for masjid in masjids)]
+
+
+@pytest.mark.django_db
+def test_bulk_rejects_batches_with_foreign_masjids(api_client, manager_user, masjids):
+    other = Masjid.objects.create(name="Masjid Other", address=new_address(3))
+    api_client.force_authenticate(manager_user)
+
+    response = api_client.post(URL, [
+        {'masjid': str(masjids[0].uuid), 'date': '2025-03-01', 'fajr_iqama': 25},
+        {'masjid': str(other.uuid), 'date': '2025-03-01', 'fajr_iqama': 25},
+    ], format='json')
+
+    assert response.status_code == 403
+    assert response.json()['masjids'] == [str(other.uuid)]
+    assert not IqamaTime.objects.exists()
+
+
+@pytest.mark.django_db
+def test_current_rules_expose_active_rule_and_next_change(masjids):
+    masjid = masjids[0]
+    for day, fajr in ((date(2025, 1, 1), 20), (date(2025, 3, 1), 25), (date(2025, 6, 1), 30)):
+        IqamaTime.objects.create(masjid=masjid, date=day, fajr_iqama=fajr)
+
+    rules = iqamas.current_rules(masjid.pk, date(2025, 4, 15))
+    assert [(rule.date, rule.fajr_iqama) for rule in rules] == [(date(2025, 3, 1), 25), (date(2025, 6, 1), 30)]
+    assert iqamas.rule_in_force(masjid.pk, date(2024, 12, 1)).date == date(2025, 1, 1)
+    assert [rule.date for rule in iqamas.current_rules(masjid.pk, date(2025, 7, 1))] == [date(2025, 6, 1)]
+
+
+@pytest.mark.django_db
+def test_redundant_rules_are_shadowed_or_repeated(masjids):
+    masjid = masjids[0]
+    kept = IqamaTime.objects.create(masjid=masjid, date=date(2025, 1, 1), fajr_iqama=20)
+    repeated = IqamaTime.objects.create(masjid=masjid, date=date(2025, 2, 1), fajr_iqama=20)
+    shadowed = IqamaTime.objects.create(masjid=masjid, date=date(2025, 3, 1), fajr_iqama=25)
+    same_day = IqamaTime.objects.create(masjid=masjid, date=date(2025, 3, 1), fajr_iqama=30)
+
+    assert sorted(iqamas.redundant_rules([masjid.pk])) == sorted([repeated.pk, shadowed.pk])
+    assert {kept.pk, same_day.pk}.isdisjoint(iqamas.redundant_rules())
@@ -0,0 +1,75 @@
+import pytest
+
+from core.models import Address, Job
+from masjid.models import Masjid
+from ..linking import link_prayer_times, set_prayer_times, zone_location_ids
+from ..loaders import PrayerTimeLoader
+
+
+@pytest.fixture
+def masjid():
+    address = Address.objects.create(
+        city="Sfax Ville",
+        state="Sfax",
+        country="Tunisia",
+        coordinates="POINT (10.761000 34.740000)"
+    )
+    return Masjid.objects.create(name="Masjid Sidi Lakhmi", address=address)
+
+
+@pytest.fixture
+def other_location():
+    return Address.objects.create(
+        city="Gabes Medina",
+        state="Gabes",
+        country="Tunisia",
+        coordinates="POINT (10.097000 33.881000)"
+    )
+
+
+@pytest.mark.django_db
+def test_link_prayer_times_is_idempotent(location, masjid, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    location_ids = zone_location_ids(city__iexact="sfax ville")
+
+    assert link_prayer_times([masjid.pk], location_ids) == 2
+    assert link_prayer_times([masjid.pk], location_ids) == 0
+    assert masjid.prayertime_set.count() == 2
+
+
+@pytest.mark.django_db
+def test_link_prayer_times_queues_one_rebuild_for_all_masjids(location, masjid, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    other = Masjid.objects.create(name="Masjid El Kasbah", address=Address.objects.create(
+        city="Sfax Ville", state="Sfax", country="Tunisia", coordinates="POINT (10.762000 34.741000)"
+    ))
+
+    link_prayer_times([other.pk, masjid.pk], [location.pk])
+
+    [job] = Job.objects.filter(name='prayertime.tasks.rebuild_masjid_schedules')
+    assert job.payload == {'masjid_ids': sorted([masjid.pk, other.pk])}
+
+
+@pytest.mark.django_db
+def test_set_prayer_times_removes_other_zones(location, other_location, masjid, meteo_entries):
+    loader = PrayerTimeLoader()
+    loader.load(location, meteo_entries)
+    loader.load(other_location, meteo_entries)
+    link_prayer_times([masjid.pk], [location.pk])
+
+    assert set_prayer_times([masjid.pk], [other_location.pk]) == (2, 2)
+    assert set(masjid.prayertime_set.values_list('location_id', flat=True)) == {other_location.pk}
+
+
+@pytest.mark.django_db
+def test_relink_task_uses_the_masjid_city(location, other_location, masjid, meteo_entries, settings):
+    from masjid.tasks import relink_prayer_times
+
+    settings.USE_MAIN_CITY_FOR_PRAYER_TIMES = False
+    loader = PrayerTimeLoader()
+    loader.load(location, meteo_entries)
+    loader.load(other_location, meteo_entries)
+    link_prayer_times([masjid.pk], [other_location.pk])
+
+    relink_prayer_times(masjid_id=masjid.pk)
+    assert set(masjid.prayertime_set.values_list('location_id', flat=True)) == {location.pk}
@@ -0,0 +1,113 @@
+import json
+from io import StringIO
+
+import pytest
+from datetime import date, time
+from django.core.files import storage
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from core.management.commands import fetch_and_store_prayer_times as command
+from core.models import Address, Checkpoint
+from ..loaders import PrayerTimeLoader, parse_entry, prefetch_locations, resolve_location
+from ..meteo import Zone
+from ..models import PrayerTime
+
+
+def test_parse_entry(meteo_entries):
+    row = parse_entry(meteo_entries[0])
+    assert row['date'] == date(2024, 12, 15)
+    assert row['fajr'] == time(5, 41)
+    assert row['sunrise'] == time(7, 9)
+    assert row['isha'] == time(18, 37)
+
+def test_parse_entry_missing_time(meteo_entries):
+    entry = dict(meteo_entries[0], sunrise=None)
+    with pytest.raises(ValueError):
+        parse_entry(entry)
+
+@pytest.mark.django_db
+def test_loader_is_idempotent(location, meteo_entries):
+    loader = PrayerTimeLoader()
+    assert loader.load(location, meteo_entries) == []
+    assert loader.load(location, meteo_entries) == []
+    assert PrayerTime.objects.filter(location=location).count() == 2
+    assert loader.created == 2
+    assert loader.unchanged == 2
+    assert loader.updated == 0
+
+@pytest.mark.django_db
+def test_loader_updates_changed_rows(location, meteo_entries):
+    loader = PrayerTimeLoader()
+    loader.load(location, meteo_entries)
+    loader.load(location, [dict(meteo_entries[0], isha="18:40")])
+    assert loader.updated == 1
+    assert PrayerTime.objects.get(location=location, date=date(2024, 12, 15)).isha == time(18, 40)
+
+@pytest.mark.django_db
+def test_loader_reports_invalid_entries(location, meteo_entries):
+    errors = PrayerTimeLoader().load(location, [dict(meteo_entries[0], dhohr="noon")])
+    assert len(errors) == 1
+    assert not PrayerTime.objects.filter(location=location).exists()
+
+@pytest.mark.django_db
+def test_resolve_location_reuses_address(location):
+    assert resolve_location("Sfax", "Sfax Ville") == location
+    assert Address.objects.count() == 1
+
+@pytest.mark.django_db
+def test_prefetch_locations_only_returns_loaded_pairs(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    locations = prefetch_locations([("SFAX", "sfax ville"), ("Gabes", "Gabes Medina")])
+    assert locations == {("SFAX", "sfax ville"): location}
+
+@pytest.mark.django_db
+def test_resolve_location_reuses_the_address_of_a_delegation_named_otherwise(location, meteo_entries):
+    # Loaded from a file keyed on the meteo.tn names, then fetched under the zone names
+    PrayerTimeLoader().load(location, meteo_entries)
+
+    assert resolve_location("Sfax", "Sfax", "34.7450", "10.7600") == location
+    assert resolve_location("Sfax", "Sfax Medina", "34.7450", "10.7600", rename=True) == location
+    assert Address.objects.count() == 1
+    assert prefetch_locations([("Sfax", "Sfax Medina")]) == {("Sfax", "Sfax Medina"): location}
+
+@pytest.mark.django_db
+def test_store_from_storage_loads_the_files_parsed_by_the_workers(monkeypatch, tmp_path, location, meteo_entries):
+    files = storage.FileSystemStorage(location=tmp_path)
+    monkeypatch.setattr(storage, 'default_storage', files)
+    files.save("prayer-times-Sfax-Sfax Ville.json", ContentFile(json.dumps({"prayer_times": meteo_entries})))
+    err = StringIO()
+
+    call_command(
+        'store_prayer_time_to_db_from_S3', '--governorate-city-pairs', 'Sfax-Sfax Ville', 'Sfax-Sakiet Eddaier',
+        '--max-workers', '2', stdout=StringIO(), stderr=err,
+    )
+
+    assert PrayerTime.objects.filter(location=location).count() == 2
+    assert "File not found for Sfax-Sakiet Eddaier" in err.getvalue()
+
+@pytest.mark.django_db
+def test_fetch_and_store_only_records_zones_stored_in_full(monkeypatch, location, meteo_entries):
+    zones = [Zone('Sfax', 'Sfax Ville', 1, 1), Zone('Sfax', 'Sakiet Eddaier', 1, 2)]
+    days = [date(2024, 12, 15), date(2024, 12, 16)]
+
+    def fetch_prayer_time_cells(cells, **options):
+        return [
+            (zone, day, ValueError("Timeout") if zone.city == 'Sakiet Eddaier' and day == days[1] else {
+                'latitude': 34.745 if zone.city == 'Sfax Ville' else 34.80, 'longitude': 10.760028,
+                'entry': meteo_entries[days.index(day)],
+            })
+            for zone, day in cells
+        ]
+
+    monkeypatch.setattr(command, 'load_zones', lambda governorates: zones)
+    monkeypatch.setattr(command, 'fetch_prayer_time_cells', fetch_prayer_time_cells)
+    err = StringIO()
+
+    call_command('fetch_and_store_prayer_times', stdout=StringIO(), stderr=err)
+
+    checkpoint = Checkpoint.objects.get(command='fetch_and_store_prayer_times')
+    assert checkpoint.position['zones'] == ['Sfax/Sfax Ville']
+    assert checkpoint.completed_at is None
+    assert PrayerTime.objects.filter(location=location).count() == 2
+    assert "will be fetched again: Sfax/Sakiet Eddaier" in err.getvalue()
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from datetime import date
+
+import httpx
+
+from core._http_cache import CacheMissError, HttpCache
+from .. import meteo
+from ..meteo import CircuitBreaker, CircuitOpenError, MeteoClient, Zone, fetch_prayer_times, load_zones
+
+ZONE = Zone('Sfax', 'Sfax ville', 359, 540)
+
+
+def meteo_handler(request):
+    if 'lever_coucher' in request.url.path:
+        return httpx.Response(200, json={"data": {"lever": "07:09"}})
+    return httpx.Response(200, json={"data": {
+        "gouvernorat": {"intituleAn": "Sfax"},
+        "delegation": {"intituleAn": "Sfax Ville"},
+        "lat": "34.74", "lng": "10.76", "date": "2024-12-15 00:00",
+        "sobh": "05:41", "dhohr": "12:14", "aser": "14:50", "magreb": "17:11", "isha": "18:37",
+    }})
+
+
+def test_load_zones_covers_every_governorate():
+    zones = load_zones()
+    assert len({zone.governorate for zone in zones}) == 24
+    assert [zone.governorate for zone in load_zones(['sfax'])] == ['Sfax']
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.success()
+    breaker.check()
+
+def test_fetch_day_merges_sunrise():
+    results = fetch_prayer_times([ZONE], [date(2024, 12, 15)], transport=httpx.MockTransport(meteo_handler))
+    zone, day, record = results[0]
+    assert record['city'] == 'Sfax Ville'
+    assert record['entry']['sobh'] == '05:41'
+    assert record['entry']['sunrise'] == '07:09'
+
+def test_get_json_retries_server_errors(monkeypatch):
+    monkeypatch.setattr(meteo, 'BACKOFF_BASE', 0)
+    calls = []
+
+    def flaky_handler(request):
+        calls.append(request.url)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"data": {}})
+
+    async def run():
+        async with MeteoClient(rate=0, transport=httpx.MockTransport(flaky_handler)) as client:
+            return await client.get_json("https://www.meteo.tn/horaire_gouvernorat/2024-12-15/359/540")
+
+    assert asyncio.run(run()) == {"data": {}}
+    assert len(calls) == 2
+
+def test_cache_serves_reruns_and_replay(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    calls = []
+
+    def counting_handler(request):
+        calls.append(request.url)
+        return meteo_handler(request)
+
+    day = date(2024, 12, 15)
+    fetch_prayer_times([ZONE], [day], cache=cache, transport=httpx.MockTransport(counting_handler))
+    fetch_prayer_times([ZONE], [day], cache=cache, transport=httpx.MockTransport(counting_handler))
+    assert len(calls) == 2
+
+    _, _, record = fetch_prayer_times([ZONE], [day], cache=cache, replay=True)[0]
+    assert record['entry']['sunrise'] == '07:09'
+
+    _, _, error = fetch_prayer_times([ZONE], [date(2024, 12, 16)], cache=cache, replay=True)[0]
+    assert isinstance(error, CacheMissError)
+
+def test_cache_evicts_least_recently_read(tmp_path):
+    cache = HttpCache(str(tmp_path), max_bytes=25)
+    cache.set('https://a', b'x' * 10)
+    cache.set('https://b', b'x' * 10)
+    cache.get('https://a')
+    cache.set('https://c', b'x' * 10)
+    assert cache.get('https://a') is not None
+    assert cache.get('https://b') is None
@@ -0,0 +1,63 @@
+import zlib
+from datetime import date, time
+
+import pytest
+
+from .. import packs
+from ..loaders import PrayerTimeLoader
+from ..models import OfflinePack, PrayerTime
+
+
+def test_encode_round_trips_minutes_and_missing_days():
+    rows = [(date(2024, 12, 15), time(5, 41), time(7, 9), time(12, 14), time(14, 50), time(17, 11), time(18, 37))]
+    year, columns = packs.decode(packs.encode(2024, rows))
+
+    assert year == 2024
+    assert len(columns['fajr']) == 366
+    assert columns['fajr'][349] == 5 * 60 + 41
+    assert columns['isha'][349] == 18 * 60 + 37
+    assert columns['fajr'][348] is None
+
+
+def test_delta_patches_base_into_target():
+    day = (time(5, 41), time(7, 9), time(12, 14), time(14, 50), time(17, 11), time(18, 37))
+    base = packs.encode(2025, [(date(2025, 1, 1), *day)])
+    target = packs.encode(2025, [(date(2025, 1, 1), *day), (date(2025, 1, 2), *day)])
+
+    delta = packs.make_delta(base, target)
+    assert packs.apply_delta(base, delta) == target
+    with pytest.raises(ValueError):
+        packs.apply_delta(target, delta)
+    assert packs.make_delta(base, packs.encode(2024, [])) is None
+
+
+@pytest.mark.django_db
+def test_build_packs_only_stores_changed_versions(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+
+    assert packs.build_packs(2024) == (1, 0)
+    assert packs.build_packs(2024) == (0, 1)
+
+    PrayerTime.objects.filter(location=location, date=date(2024, 12, 16)).update(fajr=time(5, 43))
+    assert packs.build_packs(2024) == (1, 0)
+    assert OfflinePack.objects.filter(location=location, year=2024).count() == 2
+
+
+@pytest.mark.django_db
+def test_offline_pack_endpoint_serves_deltas(client, location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    packs.build_packs(2024)
+    first = OfflinePack.objects.get()
+    PrayerTime.objects.filter(location=location, date=date(2024, 12, 16)).update(fajr=time(5, 43))
+    packs.build_packs(2024)
+
+    manifest = client.get('/api/offline-packs/', {'year': 2024}).json()
+    latest = manifest['packs'][0]
+    assert latest['zone'] == location.pk and latest['sha256'] != first.sha256
+
+    response = client.get(latest['url'], {'since': first.sha256})
+    assert response['Content-Type'] == 'application/vnd.nasjod.timetable-delta'
+    patched = packs.apply_delta(zlib.decompress(first.data), response.content)
+    assert packs.digest(patched) == latest['sha256']
+
+    assert client.get(latest['url'], HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
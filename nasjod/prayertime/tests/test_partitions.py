@@ -0,0 +1,65 @@
+import gzip
+import json
+from datetime import date
+
+import pytest
+from django.core.files.storage import FileSystemStorage
+
+from core.restore import delete_rows
+from masjid.models import Masjid
+from .. import partitions
+from ..linking import link_prayer_times
+from ..loaders import PrayerTimeLoader
+from ..models import PrayerTime, PrayerTimeMasjid
+
+# Far enough back for migration 0012 not to have created its partition (current and next years)
+YEAR = date.today().year - 5
+
+
+@pytest.fixture
+def entries(meteo_entries):
+    return [{**entry, 'date': entry['date'].replace('2024-', f'{YEAR}-', 1)} for entry in meteo_entries]
+
+
+@pytest.mark.django_db
+def test_ensure_partitions_moves_rows_out_of_the_default_partition(location, entries):
+    PrayerTimeLoader().load(location, entries)
+    assert YEAR in partitions.default_years()
+
+    assert partitions.ensure_partitions([YEAR]) == [YEAR]
+    assert YEAR in partitions.partition_years()
+    assert YEAR not in partitions.default_years()
+    assert PrayerTime.objects.filter(date__year=YEAR).count() == 2
+
+
+@pytest.mark.django_db
+def test_archive_year_uploads_rows_with_links_then_drops_the_partition(monkeypatch, tmp_path, location, entries):
+    monkeypatch.setattr(partitions, 'default_storage', FileSystemStorage(location=tmp_path))
+    PrayerTimeLoader().load(location, entries)
+    masjid = Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=location)
+    link_prayer_times([masjid.pk], [location.pk])
+    partitions.ensure_partitions([YEAR])
+
+    name, count, _ = partitions.archive_year(YEAR)
+
+    assert count == 2
+    with gzip.open(tmp_path / name, 'rt') as archive:
+        rows = [json.loads(line) for line in archive]
+    assert [row['date'] for row in rows] == [f'{YEAR}-12-15', f'{YEAR}-12-16']
+    assert rows[0]['masjids'] == [masjid.pk]
+    assert YEAR not in partitions.partition_years()
+    assert not PrayerTime.objects.filter(date__year=YEAR).exists()
+    assert not PrayerTime.masjids.through.objects.filter(masjid=masjid).exists()
+
+
+@pytest.mark.django_db
+def test_deleting_prayer_times_in_sql_deletes_their_links(location, entries):
+    PrayerTimeLoader().load(location, entries)
+    masjid = Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=location)
+    link_prayer_times([masjid.pk], [location.pk])
+    pks = list(PrayerTime.objects.values_list('pk', flat=True))
+
+    delete_rows(PrayerTime, pks, cascade=True)
+
+    assert not PrayerTime.objects.exists()
+    assert not PrayerTimeMasjid.objects.filter(masjid=masjid).exists()
@@ -0,0 +1,30 @@
+import pytest
+from datetime import date, timedelta
+
+from ..loaders import PrayerTimeLoader
+from ..meteo import Zone
+from ..models import PrayerTime
+from ..planner import plan_refresh
+
+SFAX = Zone('Sfax', 'Sfax ville', 359, 540)
+TUNIS = Zone('Tunis', 'La Medina', 350, 623)
+
+
+@pytest.mark.django_db
+def test_plan_refresh_lists_missing_cells(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    plan = plan_refresh([SFAX, TUNIS], date(2024, 12, 15), date(2024, 12, 17))
+    assert plan[SFAX] == [date(2024, 12, 17)]
+    assert plan[TUNIS] == [date(2024, 12, 15), date(2024, 12, 16), date(2024, 12, 17)]
+
+@pytest.mark.django_db
+def test_plan_refresh_is_empty_when_complete(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    assert plan_refresh([SFAX], date(2024, 12, 15), date(2024, 12, 16)) == {}
+
+@pytest.mark.django_db
+def test_plan_refresh_includes_stale_cells(location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    PrayerTime.objects.filter(date=date(2024, 12, 15)).update(fetched_at=None)
+    plan = plan_refresh([SFAX], date(2024, 12, 15), date(2024, 12, 16), max_age=timedelta(days=30))
+    assert plan[SFAX] == [date(2024, 12, 15)]
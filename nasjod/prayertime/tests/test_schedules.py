@@ -0,0 +1,68 @@
+import pytest
+from datetime import date, time
+
+from core.models import Address
+from masjid.models import Masjid
+from ..linking import link_prayer_times
+from ..loaders import PrayerTimeLoader
+from ..models import DailySchedule, IqamaTime, JumuahPrayerTime
+from ..schedules import build_schedules, resolve_iqamas
+
+ADHAN = {'fajr': time(5, 41), 'sunrise': time(7, 9), 'dhuhr': time(12, 14),
+         'asr': time(14, 50), 'maghrib': time(17, 11), 'isha': time(18, 37)}
+
+
+@pytest.fixture
+def masjid():
+    address = Address.objects.create(
+        city="Sfax Ville",
+        state="Sfax",
+        country="Tunisia",
+        coordinates="POINT (10.761000 34.740000)"
+    )
+    return Masjid.objects.create(name="Masjid Sidi Lakhmi", address=address)
+
+
+def test_resolve_iqamas_offsets_and_dhuhr_rules():
+    rule = IqamaTime(fajr_iqama=20, dhuhr_iqama=10, asr_iqama=15, maghrib_iqama=5, isha_iqama=None)
+    iqamas = resolve_iqamas(ADHAN, rule)
+    assert iqamas['fajr_iqama'] == time(6, 1)
+    assert iqamas['dhuhr_iqama'] == time(12, 24)
+    assert iqamas['maghrib_iqama'] == time(17, 16)
+    assert iqamas['isha_iqama'] is None
+
+    assert resolve_iqamas(ADHAN, IqamaTime(dhuhr_iqama_from_asr=30))['dhuhr_iqama'] == time(14, 20)
+    assert resolve_iqamas(ADHAN, IqamaTime(dhuhr_iqama_hour=time(13, 0)))['dhuhr_iqama'] == time(13, 0)
+
+
+@pytest.mark.django_db
+def test_build_schedules_resolves_each_day(location, masjid):
+    friday = date(2024, 12, 13)
+    PrayerTimeLoader().load(location, [
+        {"date": f"2024-12-{day} 00:00", "sobh": "05:41", "sunrise": "07:09", "dhohr": "12:14",
+         "aser": "14:50", "magreb": "17:11", "isha": "18:37"}
+        for day in (12, 13)
+    ])
+    link_prayer_times([masjid.pk], [location.pk])
+    IqamaTime.objects.create(masjid=masjid, date=date(2024, 12, 1), fajr_iqama=20, dhuhr_iqama=10)
+    IqamaTime.objects.create(masjid=masjid, date=friday, fajr_iqama=30, dhuhr_iqama=10)
+    JumuahPrayerTime.objects.create(masjid=masjid, date=friday, first_timeslot_jumuah=True)
+
+    written, deleted = build_schedules([masjid.pk], date(2024, 12, 12), date(2024, 12, 13))
+
+    assert (written, deleted) == (2, 0)
+    thursday, friday_schedule = DailySchedule.objects.filter(masjid=masjid)
+    assert thursday.fajr_iqama == time(6, 1)
+    assert thursday.jumuah is None
+    assert friday_schedule.fajr_iqama == time(6, 11)
+    assert friday_schedule.jumuah == time(12, 14)
+
+
+@pytest.mark.django_db
+def test_build_schedules_deletes_unlinked_days(location, masjid, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    link_prayer_times([masjid.pk], [location.pk])
+    build_schedules([masjid.pk], date(2024, 12, 15), date(2024, 12, 16))
+
+    masjid.prayertime_set.clear()
+    assert build_schedules([masjid.pk], date(2024, 12, 15), date(2024, 12, 16)) == (0, 2)
@@ -0,0 +1,55 @@
+from datetime import date, time
+
+import pytest
+
+from masjid.models import Masjid
+from .. import timetable
+from ..linking import link_prayer_times
+from ..loaders import PrayerTimeLoader
+from ..models import PrayerTime
+
+
+@pytest.mark.django_db
+def test_masjid_times_follow_atomic_rebuilds(tmp_path, location, meteo_entries):
+    PrayerTimeLoader().load(location, meteo_entries)
+    masjid = Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=location)
+    link_prayer_times([masjid.pk], [location.pk])
+    path = str(tmp_path / 'timetable.bin')
+    start, end = date(2024, 12, 1), date(2024, 12, 31)
+
+    assert timetable.build(path, start, end) == (1, 31, 1)
+    table = timetable.Timetable(path, recheck_interval=0)
+    times = table.masjid_times([masjid.pk, masjid.pk + 1], [date(2024, 12, 15), date(2024, 12, 17)])
+    assert list(times) == [masjid.pk]
+    assert times[masjid.pk][0] == (5 * 60 + 41, 7 * 60 + 9, 12 * 60 + 14, 14 * 60 + 50, 17 * 60 + 11, 18 * 60 + 37)
+    assert times[masjid.pk][1] == (None,) * len(timetable.PRAYERS)
+
+    PrayerTime.objects.filter(location=location, date=date(2024, 12, 15)).update(fajr=time(5, 40))
+    timetable.build(path, start, end)
+    assert timetable.to_time(table.zone_times([location.pk], [date(2024, 12, 15)])[location.pk][0][0]) == time(5, 40)
+
+
+def test_missing_timetable_is_unavailable(tmp_path):
+    table = timetable.Timetable(str(tmp_path / 'missing.bin'))
+    assert not table.available
+    assert table.masjid_times([1], [date(2024, 12, 15)]) == {}
+
+
+@pytest.mark.django_db
+def test_reads_fall_back_to_the_orm_while_the_timetable_is_stale(tmp_path, settings, location, meteo_entries):
+    settings.TIMETABLE_PATH = str(tmp_path / 'timetable.bin')
+    timetable.shared.cache_clear()
+    PrayerTimeLoader().load(location, meteo_entries)
+    masjid = Masjid.objects.create(name="Masjid Sidi Lakhmi, Sfax", address=location)
+    link_prayer_times([masjid.pk], [location.pk])
+    day = date(2024, 12, 15)
+
+    timetable.build(start=date(2024, 12, 1), end=date(2024, 12, 31))
+    timetable.shared().recheck_interval = 0
+    [mapped] = timetable.masjid_prayer_times([masjid.pk], [day])[masjid.pk]
+    assert (mapped.date, mapped.fajr, mapped.isha) == (day, time(5, 41), time(18, 37))
+    assert timetable.masjid_prayer_times([masjid.pk], [date(2025, 1, 1)]) is None
+
+    timetable.mark_stale()
+    assert timetable.masjid_prayer_times([masjid.pk], [day]) is None
+    timetable.shared.cache_clear()
@@ -0,0 +1,273 @@
+"""
+Memory-mapped timetable of adhan times, shared by every process of the host.
+
+Published PrayerTime rows are copied into one file holding the adhan time of each
+zone (PrayerTime location), day and prayer as int16 minutes since midnight (MISSING
+when unknown), and the zone of each linked masjid:
+
+    header: magic "NJTT" | format uint8 | prayers uint8 | first day ordinal uint32
+            | days uint32 | zones uint32 | masjids uint32, padded to 32 bytes
+    zone ids int64 * zones, sorted
+    masjid ids int64 * masjids, sorted
+    masjid zone indexes int32 * masjids
+    minutes int16 * zones * days * prayers
+
+Values use the native byte order since the file is built and read on the same host.
+Processes map it read-only, so the uwsgi workers share the same page cache pages
+instead of querying Postgres. A rebuild writes a temporary file renamed over the
+previous one; readers notice the new file within RECHECK_INTERVAL seconds.
+
+Writes to prayer times or their links touch a "<path>.stale" marker before queueing
+the rebuild (mark_stale). A file older than the marker is stale: read paths fall back
+to the ORM (masjid_prayer_times) until the rebuild, whose file is dated from the start
+of its reads, replaces it.
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time as clock
+from array import array
+from bisect import bisect_left
+from datetime import date, time
+from functools import lru_cache
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import PrayerTime, hijri_date_for
+
+logger = logging.getLogger(__name__)
+
+PRAYERS = ('fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
+MISSING = -1
+FORMAT_VERSION = 1
+MAGIC = b'NJTT'
+HEADER = struct.Struct('=4sBBxxIIII8x')
+RECHECK_INTERVAL = 5.0
+
+
+def default_range(today=None):
+    """From January 1st of the current year to December 31st of the next one."""
+    today = today or timezone.localdate()
+    return date(today.year, 1, 1), date(today.year + 1, 12, 31)
+
+
+def to_time(minutes):
+    return None if minutes is None else time(minutes // 60, minutes % 60)
+
+
+def _marker(path):
+    return f'{path}.stale'
+
+
+def mark_stale(path=None):
+    """Flags the timetable at `path` (settings.TIMETABLE_PATH) as stale until its next build."""
+    marker = _marker(path or settings.TIMETABLE_PATH)
+    try:
+        os.makedirs(os.path.dirname(marker) or '.', exist_ok=True)
+        with open(marker, 'a'):
+            os.utime(marker, None)
+    except OSError as e:
+        logger.warning("Could not mark the timetable stale: %s", e)
+
+
+def build(path=None, start=None, end=None):
+    """
+    Writes the timetable of the PrayerTime rows between `start` and `end` (default_range)
+    to `path` (settings.TIMETABLE_PATH) atomically. Returns (zones, days, masjids).
+    """
+    path = path or settings.TIMETABLE_PATH
+    if start is None or end is None:
+        start, end = default_range()
+    # Changes marked stale after this point are not in the file, so it is dated from now
+    started = clock.time()
+    days = (end - start).days + 1
+
+    prayer_times = PrayerTime.objects.filter(date__range=(start, end), location__isnull=False)
+    zones = list(prayer_times.order_by('location_id').values_list('location_id', flat=True).distinct())
+    zone_index = {zone: index for index, zone in enumerate(zones)}
+
+    minutes = array('h', [MISSING]) * (len(zones) * days * len(PRAYERS))
+    rows = prayer_times.order_by().values_list('location_id', 'date', *PRAYERS)
+    for location_id, day, *times in rows.iterator(chunk_size=5000):
+        offset = (zone_index[location_id] * days + (day - start).days) * len(PRAYERS)
+        for index, value in enumerate(times):
+            minutes[offset + index] = value.hour * 60 + value.minute
+
+    # A masjid linked to several locations uses the first one, whatever the day
+    links = (
+        PrayerTime.masjids.through.objects
+        .filter(prayertime__date__range=(start, end), prayertime__location__isnull=False)
+        .values('masjid_id')
+        .annotate(location_id=Min('prayertime__location_id'))
+        .order_by('masjid_id')
+        .values_list('masjid_id', 'location_id')
+    )
+    masjid_ids, masjid_zones = array('q'), array('i')
+    for masjid_id, location_id in links:
+        masjid_ids.append(masjid_id)
+        masjid_zones.append(zone_index[location_id])
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.timetable-', delete=False) as tmp:
+        try:
+            tmp.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, len(PRAYERS), start.toordinal(), days, len(zones), len(masjid_ids)
+            ))
+            tmp.write(array('q', zones).tobytes())
+            tmp.write(masjid_ids.tobytes())
+            tmp.write(masjid_zones.tobytes())
+            tmp.write(minutes.tobytes())
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+    os.chmod(tmp.name, 0o644)
+    os.utime(tmp.name, (started, started))
+    os.replace(tmp.name, path)
+    return len(zones), days, len(masjid_ids)
+
+
+class Timetable:
+    """
+    Read-only view of a timetable file. Lookups take lists of ids and dates and return,
+    per id, one tuple of minutes since midnight (None when unknown) per date.
+    Ids missing from the timetable are left out of the result.
+    """
+
+    def __init__(self, path, recheck_interval=RECHECK_INTERVAL):
+        self.path = path
+        self.recheck_interval = recheck_interval
+        self._identity = None
+        self._checked = None
+        self._loaded = False
+        self._stale = False
+
+    def _refresh(self):
+        now = monotonic()
+        if self._checked is not None and now - self._checked < self.recheck_interval:
+            return
+        self._checked = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._identity, self._loaded = None, False
+            return
+        try:
+            self._stale = os.stat(_marker(self.path)).st_mtime_ns >= stat.st_mtime_ns
+        except FileNotFoundError:
+            self._stale = False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity:
+            return
+
+        with open(self.path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, prayers, first, days, zones, masjids = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != FORMAT_VERSION or prayers != len(PRAYERS):
+            raise ValueError(f"{self.path} is not a timetable of a supported format")
+
+        # The previous map is released with the last view referencing it
+        view = memoryview(mapped)
+        offset = HEADER.size
+        self._zone_ids = view[offset:offset + 8 * zones].cast('q')
+        offset += 8 * zones
+        self._masjid_ids = view[offset:offset + 8 * masjids].cast('q')
+        offset += 8 * masjids
+        self._masjid_zones = view[offset:offset + 4 * masjids].cast('i')
+        offset += 4 * masjids
+        self._minutes = view[offset:offset + 2 * zones * days * prayers].cast('h')
+        self._first, self._days = first, days
+        self._identity, self._loaded = identity, True
+
+    @property
+    def available(self):
+        self._refresh()
+        return self._loaded
+
+    @property
+    def fresh(self):
+        """Whether the timetable is available and holds the latest prayer times."""
+        return self.available and not self._stale
+
+    def covers(self, dates):
+        return self.available and all(0 <= day.toordinal() - self._first < self._days for day in dates)
+
+    def _day_offsets(self, dates):
+        offsets = []
+        for day in dates:
+            index = day.toordinal() - self._first
+            offsets.append(index * len(PRAYERS) if 0 <= index < self._days else None)
+        return offsets
+
+    def _rows(self, zone, offsets):
+        base = zone * self._days * len(PRAYERS)
+        unknown = (None,) * len(PRAYERS)
+        rows = []
+        for offset in offsets:
+            if offset is None:
+                rows.append(unknown)
+                continue
+            values = self._minutes[base + offset:base + offset + len(PRAYERS)].tolist()
+            rows.append(tuple(None if value == MISSING else value for value in values))
+        return rows
+
+    @staticmethod
+    def _find(ids, value):
+        index = bisect_left(ids, value)
+        return index if index < len(ids) and ids[index] == value else None
+
+    def zone_times(self, zone_ids, dates):
+        """{location id: [(fajr, sunrise, dhuhr, asr, maghrib, isha) per date]}"""
+        if not self.available:
+            return {}
+        offsets = self._day_offsets(dates)
+        result = {}
+        for zone_id in zone_ids:
+            zone = self._find(self._zone_ids, zone_id)
+            if zone is not None:
+                result[zone_id] = self._rows(zone, offsets)
+        return result
+
+    def masjid_times(self, masjid_ids, dates):
+        """{masjid id: [(fajr, sunrise, dhuhr, asr, maghrib, isha) per date]}"""
+        if not self.available:
+            return {}
+        offsets = self._day_offsets(dates)
+        result = {}
+        for masjid_id in masjid_ids:
+            index = self._find(self._masjid_ids, masjid_id)
+            if index is not None:
+                result[masjid_id] = self._rows(self._masjid_zones[index], offsets)
+        return result
+
+
+@lru_cache(maxsize=None)
+def shared():
+    """The timetable at settings.TIMETABLE_PATH, mapped once per process."""
+    return Timetable(settings.TIMETABLE_PATH)
+
+
+def masjid_prayer_times(masjid_ids, dates):
+    """
+    {masjid id: [unsaved PrayerTime per date with known times]} from the shared timetable,
+    or None when it is missing, stale or does not cover `dates`: callers then query the ORM.
+    """
+    table = shared()
+    if not table.fresh or not table.covers(dates):
+        return None
+    found = table.masjid_times(masjid_ids, dates)
+    result = {}
+    for masjid_id in masjid_ids:
+        result[masjid_id] = [
+            PrayerTime(date=day, hijri_date=hijri_date_for(day), **dict(zip(PRAYERS, map(to_time, minutes))))
+            for day, minutes in zip(dates, found.get(masjid_id, ()))
+            if None not in minutes
+        ]
+    return result
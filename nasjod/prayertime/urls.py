@@ -1,17 +1,27 @@
 from django.urls import path
-from .views import (IqamaTimeViewSet, PrayerTimeViewSet, JumuahPrayerTimeViewSet, EidPrayerTimeViewSet)
+from .views import (IqamaTimeViewSet, PrayerTimeViewSet, JumuahPrayerTimeViewSet, EidPrayerTimeViewSet,
+                    OfflinePackViewSet, ZoneViewSet)
 
 urlpatterns = [
     # Prayer Times
     path('prayer-times/', PrayerTimeViewSet.as_view({'get': 'list', 'post': 'create'}), name='prayer-time-list'),
+    path('prayer-times/export', PrayerTimeViewSet.as_view({'get': 'export'}), name='prayer-time-export'),
     path('prayer-times/<int:pk>/', PrayerTimeViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='prayer-time-detail'),
 
+    # Offline timetable packs
+    path('offline-packs/', OfflinePackViewSet.as_view({'get': 'list'}), name='offline-pack-list'),
+    path('offline-packs/<int:zone>/<int:year>/', OfflinePackViewSet.as_view({'get': 'retrieve'}), name='offline-pack'),
+
+    # iCalendar feed of a zone
+    path('zones/<int:zone>/calendar.ics', ZoneViewSet.as_view({'get': 'calendar'}), name='zone-calendar'),
+
     # Jumuah Prayer Times (remains with masjid_uuid)
     path('jumuah-prayer-times/', JumuahPrayerTimeViewSet.as_view({'get': 'list', 'post': 'create'}), name='jumuah-prayer-time-list'),
     path('jumuah-prayer-times/<int:pk>/', JumuahPrayerTimeViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='jumuah-prayer-time-detail'),
     
     # Iqama
     path('iqamas/', IqamaTimeViewSet.as_view({'get': 'list', 'post': 'create'}), name='iqamas-list'),
+    path('iqamas/bulk/', IqamaTimeViewSet.as_view({'post': 'bulk'}), name='iqamas-bulk'),
     path('iqamas/<int:pk>/', IqamaTimeViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='iqamas-detail'),
 
     # Eid Prayer Times (remains with masjid_uuid)
@@ -1,10 +1,27 @@
+import hashlib
+import zlib
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
 
+from core.models import Address
 from core.permissions import IsAdminOrManagerOrAssistant
-from .models import PrayerTime, JumuahPrayerTime, EidPrayerTime, IqamaTime
-from prayertime.serializers import (EidPrayerTimeSerializer, IqamaTimeSerializer, JumuahPrayerTimeSerializer,
-                                    PrayerTimeSerializer)
+from core.renderers import (CSVRenderer, ICalendarRenderer, NDJSONRenderer, TimetableDeltaRenderer,
+                            TimetablePackRenderer)
+from core.throttling import CalendarThrottle, ExportThrottle, OfflinePackThrottle
+from . import exports, ical, iqamas, packs
+from .models import OfflinePack, PrayerTime, JumuahPrayerTime, EidPrayerTime, IqamaTime
+from prayertime.serializers import (EidPrayerTimeSerializer, IqamaTimeBulkSerializer, IqamaTimeSerializer,
+                                    JumuahPrayerTimeSerializer, PrayerTimeSerializer)
 
 
 class PrayerTimeViewSet(viewsets.ModelViewSet):
@@ -20,6 +37,37 @@ class PrayerTimeViewSet(viewsets.ModelViewSet):
             self.permission_classes = []
         return super().get_permissions()
 
+    def get_throttles(self):
+        if self.action == 'export':
+            return [*super().get_throttles(), ExportThrottle()]
+        return super().get_throttles()
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    @method_decorator(gzip_page)
+    def export(self, request):
+        """
+        Full-year timetable export, streamed from a server-side cursor and gzipped when accepted.
+
+        Query parameters:
+        - year: defaults to the current year
+        - zone: city of the prayer times (e.g. "sfax ville"), all zones when omitted
+        - format: "csv" (default) or "ndjson"
+        """
+        fmt = request.accepted_renderer.format
+        zone = request.query_params.get('zone', '').strip()
+        try:
+            year = int(request.query_params.get('year', timezone.localdate().year))
+        except ValueError:
+            raise ValidationError({'year': "year must be a number"})
+
+        response = StreamingHttpResponse(
+            exports.iter_export(fmt, exports.export_queryset(year, zone)),
+            content_type=exports.FORMATS[fmt],
+        )
+        filename = f"prayer-times-{zone.replace(' ', '-').lower() or 'tunisia'}-{year}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
 class JumuahPrayerTimeViewSet(viewsets.ModelViewSet):
     queryset = JumuahPrayerTime.objects.all()
     serializer_class = JumuahPrayerTimeSerializer
@@ -56,6 +104,142 @@ class IqamaTimeViewSet(viewsets.ModelViewSet):
             self.permission_classes = [IsAuthenticated, IsAdminUser]
         elif self.action in ('update', 'partial_update'):
             self.permission_classes = [IsAuthenticated, IsAdminUser]
+        elif self.action == 'bulk':
+            self.permission_classes = [IsAuthenticated]
         else:
             self.permission_classes = []
         return super().get_permissions()
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Create or update many iqama rules at once, for masjids the user manages or assists.
+        The body is a list of {masjid (uuid), date, fajr_iqama, ...}: an entry updates the
+        fields it provides on the rule of its masjid and date, or creates that rule.
+        """
+        serializer = IqamaTimeBulkSerializer(data=request.data, many=True, max_length=iqamas.MAX_BATCH)
+        serializer.is_valid(raise_exception=True)
+        uuids = {entry['masjid'] for entry in serializer.validated_data}
+        masjid_ids = iqamas.editable_masjids(request.user, uuids)
+        denied = uuids - set(masjid_ids)
+        if denied:
+            raise PermissionDenied({'masjids': sorted(str(uuid) for uuid in denied)})
+
+        created, updated = iqamas.bulk_upsert(serializer.validated_data, masjid_ids)
+        return Response({'created': created, 'updated': updated})
+
+
+class OfflinePackViewSet(viewsets.ViewSet):
+    """Offline timetable packs of the zones (see prayertime/packs.py)."""
+    permission_classes = []
+
+    def get_renderers(self):
+        if self.action == 'retrieve':
+            return [TimetablePackRenderer(), TimetableDeltaRenderer()]
+        return super().get_renderers()
+
+    def get_throttles(self):
+        return [*super().get_throttles(), OfflinePackThrottle()]
+
+    def list(self, request):
+        """
+        Manifest of the latest offline timetable pack of every zone and year, with their hashes.
+
+        Query parameters:
+        - year: only list the packs of this year
+        """
+        year = request.query_params.get('year')
+        if year is not None and not year.isdigit():
+            raise ValidationError({'year': "year must be a number"})
+        latest = list(packs.latest_packs(int(year) if year else None).select_related('location'))
+
+        etag = '"%s"' % hashlib.sha1(' '.join(pack.sha256 for pack in latest).encode('utf-8')).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response({
+                'format': packs.FORMAT_VERSION,
+                'prayers': packs.PRAYERS,
+                'packs': [
+                    {
+                        'zone': pack.location_id,
+                        'governorate': pack.location.state,
+                        'city': pack.location.city,
+                        'year': pack.year,
+                        'sha256': pack.sha256,
+                        'size': pack.size,
+                        'url': reverse('offline-pack', args=[pack.location_id, pack.year]),
+                    }
+                    for pack in latest
+                ],
+            })
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=3600)
+        return response
+
+    def retrieve(self, request, zone=None, year=None):
+        """
+        Latest offline timetable pack of a zone and year (zlib compressed, see prayertime/packs.py).
+
+        Query parameters:
+        - since: sha256 of the version held by the client, answered with a binary delta when known
+        """
+        latest = OfflinePack.objects.filter(location_id=zone, year=year).first()
+        if latest is None:
+            raise NotFound("No offline pack for this zone and year")
+
+        etag = f'"{latest.sha256}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            since = request.query_params.get('since')
+            base = None
+            if since and since != latest.sha256:
+                base = OfflinePack.objects.filter(location_id=zone, year=year, sha256=since).first()
+            delta = base and packs.make_delta(zlib.decompress(base.data), zlib.decompress(latest.data))
+            if delta is not None:
+                response = HttpResponse(delta, content_type=TimetableDeltaRenderer.media_type)
+                response['X-Delta-Base'] = since
+            else:
+                response = HttpResponse(bytes(latest.data), content_type=TimetablePackRenderer.media_type)
+                response['Content-Disposition'] = f'attachment; filename="{zone}-{year}.njtp"'
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=3600)
+        return response
+
+
+class ZoneViewSet(viewsets.ViewSet):
+    """Zones: the locations prayer times are fetched for."""
+    permission_classes = []
+
+    def get_throttles(self):
+        if self.action == 'calendar':
+            return [*super().get_throttles(), CalendarThrottle()]
+        return super().get_throttles()
+
+    @action(detail=True, methods=['get'], url_path='calendar.ics', renderer_classes=[ICalendarRenderer])
+    def calendar(self, request, zone=None):
+        """
+        iCalendar feed of the adhan times of a zone (PrayerTime location), for phone calendar subscriptions.
+
+        Query parameters:
+        - prayers: comma separated subset of fajr,dhuhr,asr,maghrib,isha (default: all)
+        - months: number of months from the current one, 1 to 12 (default: 3)
+        """
+        if not PrayerTime.objects.filter(location_id=zone).exists():
+            raise NotFound("No prayer times for this zone")
+        location = Address.objects.get(pk=zone)
+        try:
+            prayers, _, months = ical.parse_options(request.query_params, kinds=('adhan',))
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        etag = f'"{ical.zone_feed_etag(location, months, prayers)}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(
+                ical.stream_zone_feed(location, months, prayers),
+                content_type='text/calendar; charset=utf-8',
+            )
+            response['Content-Disposition'] = f'inline; filename="zone-{zone}.ics"'
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=3600)
+        return response